@@ -2,15 +2,19 @@
 
 import asyncio
 import base64
-import json
-import os
 import re
 import time
 from urllib.parse import quote_plus, urljoin
 
-import aiohttp
 from selectolax.parser import HTMLParser
 
+from common import net, resolutions, tiered
+from common.catalog import Catalog
+from common.lifecycle import Lifecycle
+from common.pipeline import Pipeline, Stage
+from common.playlist import write_playlist
+from common.runtime import run_standalone
+
 # ================= CONFIG =================
 
 BASE_URL = "https://the-tv.app/"
@@ -29,33 +33,22 @@ ORIGIN = "https://gooz.aapmains.net"
 TVG_ID = "Live.Event.us"
 TAG = "APPTV"
 
-CACHE_FILE = "apptv.json"
+# Entries are re-resolved once older than this (see common.catalog).
 CACHE_EXP = 3 * 60 * 60  # 3 hours
 
 DEFAULT_LOGO = "https://i.gyazo.com/4a5e9fa2525808ee4b65002b56d3450e.png"
 
+# Upper bound per stage; the per-host limiter in common.net adapts below it.
+FETCH_CONCURRENCY = 8
+
 # ================= HELPERS =================
 
 def log(msg):
     print(msg, flush=True)
 
 
-def load_cache():
-    if not os.path.exists(CACHE_FILE):
-        return {}
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def save_cache(data):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-async def fetch(session, url, headers=None):
+async def fetch(session, url, headers=None, until=None):
+    """Page text, or None; with ``until`` reading stops at its first match."""
     try:
         default_headers = {
             "User-Agent": USER_AGENT,
@@ -68,11 +61,12 @@ async def fetch(session, url, headers=None):
         if headers:
             default_headers.update(headers)
         
-        async with session.get(url, timeout=30, headers=default_headers) as r:
-            if r.status == 200:
-                return await r.text()
-            else:
-                log(f"Fetch error {r.status}: {url}")
+        status, text = await net.fetch_shared(
+            session, url, headers=default_headers, timeout=30, hedge=True, until=until
+        )
+        if status == 200:
+            return text
+        log(f"Fetch error {status}: {url}")
     except Exception as e:
         log(f"Fetch error: {e}")
     return None
@@ -80,14 +74,14 @@ async def fetch(session, url, headers=None):
 
 # ================= STREAM EXTRACTION =================
 
-async def extract_stream(session, event_url):
-    """Extract stream URL from event page"""
-    log(f"  Fetching event page: {event_url}")
-    html = await fetch(session, event_url)
-    if not html:
-        log("  Failed to fetch event page")
-        return None
+# Reading stops once these are found: the first iframe tag decides
+# find_iframe, and a load-playlist URL is the top-priority stream pattern.
+FIRST_IFRAME = re.compile(r"<iframe\b[^>]*>", re.I)
+LOAD_PLAYLIST = re.compile(r'(https?://[^"\']+/playlist/\d+/load-playlist)')
 
+
+def find_iframe(html, event_url):
+    """Locate the player iframe on an event page; returns an absolute URL."""
     soup = HTMLParser(html)
 
     # Try multiple iframe selectors
@@ -111,8 +105,7 @@ async def extract_stream(session, event_url):
         if raw_match:
             iframe_src = raw_match.group(1)
             log(f"  Found iframe via regex: {iframe_src}")
-            iframe_src = urljoin(event_url, iframe_src)
-            return await extract_from_iframe_url(session, iframe_src)
+            return urljoin(event_url, iframe_src)
         log("  No iframe found at all")
         return None
 
@@ -122,15 +115,25 @@ async def extract_stream(session, event_url):
         return None
 
     # Handle relative iframe URLs
-    iframe_src = urljoin(event_url, iframe_src)
-    log(f"  Fetching iframe: {iframe_src}")
-    
-    return await extract_from_iframe_url(session, iframe_src)
+    return urljoin(event_url, iframe_src)
+
+
+async def resolve_iframe(rt, session, iframe_url, event_url, force=False):
+    """Stream for a player iframe, shared with other sources' resolutions.
+
+    The static patterns run first; the browser only loads players they
+    cannot read (see common.tiered). ``force`` resolves afresh even when a
+    stored stream exists (pre-kickoff re-resolves).
+    """
+    return await resolutions.resolve(iframe_url, "apptv", lambda: tiered.resolve(
+        rt, iframe_url, lambda: extract_from_iframe_url(session, iframe_url),
+        referer=event_url, user_agent=USER_AGENT,
+    ), force=force)
 
 
 async def extract_from_iframe_url(session, iframe_url):
     """Extract stream URL from iframe content"""
-    iframe_html = await fetch(session, iframe_url)
+    iframe_html = await fetch(session, iframe_url, until=LOAD_PLAYLIST)
     if not iframe_html:
         log("  Failed to fetch iframe content")
         return None
@@ -138,8 +141,7 @@ async def extract_from_iframe_url(session, iframe_url):
     # ================= PATTERNS =================
 
     # 1. New playlist pattern (IMPORTANT - from the example)
-    pattern_playlist = r'(https?://[^"\']+/playlist/\d+/load-playlist)'
-    match = re.search(pattern_playlist, iframe_html)
+    match = LOAD_PLAYLIST.search(iframe_html)
     if match:
         stream_url = match.group(1)
         log(f"   Found playlist URL: {stream_url}")
@@ -188,20 +190,28 @@ async def extract_from_iframe_url(session, iframe_url):
         log(f"   Found generic stream: {stream_url[:80]}...")
         return stream_url
 
-    # 7. Try to find any HTTP URL as last resort
-    pattern_any = r'(https?://[^"\'\s<>]+)'
-    match = re.search(pattern_any, iframe_html)
-    if match:
-        stream_url = match.group(1)
-        log(f"   Using fallback URL: {stream_url[:80]}...")
-        return stream_url
-
     log("   No stream found in iframe")
     return None
 
 
 # ================= EVENTS =================
 
+def kickoff_from_badge(text):
+    """Kickoff estimate from a listing's status badge ("2 hours ago",
+    "15 mins from now", "In Progress"), or None."""
+    now = time.time()
+    m = re.search(r'([0-9]+)\s*(hours?|mins?|days?)\s*(ago|from\s*now)', text, re.I)
+    if m:
+        unit = m.group(2).lower()
+        seconds = int(m.group(1)) * (
+            86400 if unit.startswith("day") else 3600 if unit.startswith("hour") else 60
+        )
+        return now - seconds if m.group(3).lower() == "ago" else now + seconds
+    if re.search(r'In\s*Progress', text, re.I):
+        return now
+    return None
+
+
 async def get_events(session):
     """Parse events from the main page"""
     log(f"Fetching main page: {BASE_URL}")
@@ -258,7 +268,8 @@ async def get_events(session):
                 events.append({
                     "sport": sport,
                     "title": title,
-                    "url": full_url
+                    "url": full_url,
+                    "kickoff": kickoff_from_badge(title_text),
                 })
                 log(f"Found event: {sport} - {title}")
     
@@ -302,7 +313,8 @@ async def get_events(session):
             events.append({
                 "sport": sport,
                 "title": title,
-                "url": full_url
+                "url": full_url,
+                "kickoff": kickoff_from_badge(title_text),
             })
             log(f"Found event (fallback): {sport} - {title}")
 
@@ -311,96 +323,140 @@ async def get_events(session):
 
 # ================= MAIN =================
 
-async def main():
+async def run(rt):
     log("=" * 60)
     log("TheTVApp Scraper Started")
     log("=" * 60)
 
-    cache = load_cache()
-    now = int(time.time())
+    catalog = Catalog("apptv")
+    lifecycle = Lifecycle("apptv")
+    listed = []
+    found = []
+
+    session = await rt.session()
 
-    async with aiohttp.ClientSession() as session:
+    async def discover():
         events = await get_events(session)
+        found.extend(events)
         log(f"\nFound {len(events)} total events")
-        
         if not events:
             log("No events found - check if website structure changed")
             log("You may need to update the selectors in get_events()")
-            return
-
-        entries = []
-
-        for i, ev in enumerate(events, 1):
-            # Create unique key for cache
-            key = f"[{ev['sport']}] {ev['title']} ({TAG})"
-            
-            # Check cache
-            if key in cache and now - cache[key]["ts"] < CACHE_EXP:
-                log(f"[{i}/{len(events)}] Cached: {key[:60]}...")
-                entries.append(cache[key]["entry"])
-                continue
-
-            log(f"\n[{i}/{len(events)}] Processing: {key[:60]}...")
-            
-            # Extract stream URL
-            stream = await extract_stream(session, ev["url"])
-            
-            if not stream:
-                log(f"   No stream found for: {key}")
-                continue
-            
-            # Add headers to stream URL
-            stream_with_headers = (
-                f"{stream}"
-                f"|referer={REFERER}"
-                f"|origin={ORIGIN}"
-                f"|user-agent={ENCODED_UA}"
+        for ev in events:
+            # Create unique key for the catalog
+            ev["key"] = f"[{ev['sport']}] {ev['title']} ({TAG})"
+
+        # Finished and vanished events are retired; the rest is resolved
+        # when new, stale or about to kick off, else served from the catalog.
+        active, todo = lifecycle.plan(
+            catalog,
+            {ev["key"]: ev["kickoff"] for ev in events},
+            max_age=CACHE_EXP,
+        )
+        listed.extend(active)
+        todo = set(todo)
+        log(f"Cached: {len(listed) - len(todo)}, to resolve: {len(todo)}")
+        for ev in events:
+            if ev["key"] in todo:
+                yield ev
+
+    async def fetch_page(ev):
+        log(f"\nProcessing: {ev['key'][:60]}...")
+        ev["html"] = await fetch(session, ev["url"], until=FIRST_IFRAME)
+        if not ev["html"]:
+            log(f"  Failed to fetch event page: {ev['url']}")
+            return None
+        return ev
+
+    async def extract(ev):
+        iframe_src = find_iframe(ev["html"], ev["url"])
+        if iframe_src:
+            log(f"  Fetching iframe: {iframe_src}")
+            ev["stream"] = await resolve_iframe(
+                rt, session, iframe_src, ev["url"],
+                force=ev["key"] in lifecycle.forced,
             )
-            
-            log(f"   Stream URL: {stream[:80]}...")
-            
-            entry = {
-                "name": key,
-                "url": stream_with_headers,
-                "logo": DEFAULT_LOGO,
-            }
-            
-            # Update cache
-            cache[key] = {
-                "ts": now,
-                "entry": entry
-            }
-            
-            entries.append(entry)
-            
-            # Small delay to avoid overwhelming the server
-            await asyncio.sleep(0.5)
+        if not ev.get("stream"):
+            log(f"   No stream found for: {ev['key']}")
+            return None
+        return ev
+
+    async def verify(ev):
+        stream = ev["stream"]
+        if not stream.startswith("http"):
+            log(f"   Not a URL, dropping: {stream[:80]}")
+            return None
+
+        log(f"   Stream URL: {stream[:80]}...")
+
+        # Add headers to stream URL
+        stream_with_headers = (
+            f"{stream}"
+            f"|referer={REFERER}"
+            f"|origin={ORIGIN}"
+            f"|user-agent={ENCODED_UA}"
+        )
+        ev["entry"] = {
+            "name": ev["key"],
+            "url": stream_with_headers,
+            "logo": DEFAULT_LOGO,
+        }
+
+        catalog.update(ev["key"], ev["entry"], url=stream)
+        return ev
+
+    # Adaptive per-host concurrency replaces the fixed delay between events.
+    pipeline = Pipeline("apptv", discover, [
+        Stage("fetch", fetch_page, concurrency=FETCH_CONCURRENCY),
+        Stage("extract", extract, concurrency=FETCH_CONCURRENCY),
+        Stage("verify", verify),
+    ])
+    await pipeline.run()
+
+    # Merge: fresh results plus still-valid catalog entries for everything
+    # the site lists. An empty listing is more likely a broken scrape than
+    # an empty schedule, so it leaves the catalog alone.
+    if found:
+        catalog.retain(listed)
+    catalog.save()
+    lifecycle.save()
+    entries = catalog.entries(listed, max_age=CACHE_EXP)
+
+    if found and not listed:
+        # Every event has finished: unpublish them rather than leaving the
+        # last playlist up.
+        log("\nAll events finished, clearing playlist")
+        write_playlist(OUTPUT_FILE, [])
+        return 0
 
     if not entries:
         log("\nNo streams collected")
-        return
+        return 0
 
     # ================= WRITE M3U =================
-    log(f"\nWriting {len(entries)} streams to {OUTPUT_FILE}")
-    
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n")
-        for e in entries:
-            # Escape special characters in name
-            safe_name = e["name"].replace(",", "\\,")
-            f.write(
-                f'#EXTINF:-1 tvg-id="{TVG_ID}" '
-                f'tvg-name="{safe_name}" '
-                f'tvg-logo="{e["logo"]}" '
-                f'group-title="Live Events",{safe_name}\n'
-            )
-            f.write(f'{e["url"]}\n')
+    playlist = []
+    for e in entries:
+        # Escape special characters in name
+        safe_name = e["name"].replace(",", "\\,")
+        playlist.append([
+            f'#EXTINF:-1 tvg-id="{TVG_ID}" '
+            f'tvg-name="{safe_name}" '
+            f'tvg-logo="{e["logo"]}" '
+            f'group-title="Live Events",{safe_name}',
+            e["url"],
+        ])
+
+    if write_playlist(OUTPUT_FILE, playlist):
+        log(f"\nWrote {len(entries)} streams to {OUTPUT_FILE}")
 
-    save_cache(cache)
-    
     log("\n" + "=" * 60)
     log(f"Success! Saved {len(entries)} streams to {OUTPUT_FILE}")
     log("=" * 60)
+    return len(entries)
+
+
+async def main():
+    await run_standalone(run)
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+"""Shared helpers used by the playlist scrapers in the repository root."""
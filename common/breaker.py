@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Per-host circuit breakers for upstream requests and page loads.
+
+After FAILURE_THRESHOLD failures in a row (timeouts, connection errors,
+403/429/5xx) a host's breaker opens. Requests and page loads to the host
+then fail at once with ``CircuitOpen`` for a cool-down. After that a
+single probe is let through (half-open): success closes the breaker,
+failure reopens it with twice the cool-down. State is kept across runs in
+``.cache/breakers.json``, so a host that was down at the end of one run is
+not hammered again at the start of the next.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from common.state import load_json, locked, save_json
+
+# ================= CONFIG =================
+
+BREAKERS_FILE = "breakers.json"
+
+FAILURE_THRESHOLD = 5
+COOL_DOWN = 120  # seconds before the first probe
+MAX_COOL_DOWN = 30 * 60
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def host_of(url):
+    return (urlsplit(url).hostname or url).lower()
+
+
+def failed_status(status):
+    """Statuses that mean the host is down or refusing us."""
+    return status in (403, 429) or status >= 500
+
+
+class CircuitOpen(Exception):
+    pass
+
+# ================= BREAKERS =================
+
+_lock = threading.Lock()
+_breakers = None
+_probing = set()  # hosts whose half-open probe is in flight here
+_changed = set()
+
+
+def _load():
+    global _breakers
+    if _breakers is None:
+        _breakers = load_json(BREAKERS_FILE, {})
+    return _breakers
+
+
+def _get(host):
+    return _load().setdefault(host, {
+        "state": CLOSED, "failures": 0, "opened": 0, "cool_down": COOL_DOWN,
+        "updated": 0,
+    })
+
+
+def _set(host, b, state):
+    if b["state"] != state:
+        log(f"[breaker] {host}: {b['state']} -> {state}")
+    b["state"] = state
+    b["updated"] = time.time()
+    _changed.add(host)
+
+
+def allows(url):
+    """Whether a request to ``url`` would be let through right now."""
+    with _lock:
+        host = host_of(url)
+        b = _load().get(host)
+        if not b or b["state"] == CLOSED:
+            return True
+        if host in _probing:
+            return False
+        return time.time() - b["opened"] >= b["cool_down"]
+
+
+def acquire(url):
+    """Admit a request to ``url`` or raise ``CircuitOpen``; True when the
+    request is the half-open probe."""
+    with _lock:
+        host = host_of(url)
+        b = _load().get(host)
+        if not b or b["state"] == CLOSED:
+            return False
+        if host not in _probing and time.time() - b["opened"] >= b["cool_down"]:
+            # Let one probe through; everything else waits for its verdict.
+            _probing.add(host)
+            _set(host, b, HALF_OPEN)
+            return True
+        if host in _probing:
+            raise CircuitOpen(f"circuit half-open for {host}, probe in flight")
+        left = b["opened"] + b["cool_down"] - time.time()
+        raise CircuitOpen(f"circuit open for {host} ({left:.0f}s left)")
+
+
+def report(url, ok, probe=False):
+    """Outcome of an admitted request: True, False, or None for no signal
+    (e.g. the caller was cancelled). ``probe`` is what ``acquire`` returned."""
+    with _lock:
+        host = host_of(url)
+        if probe:
+            _probing.discard(host)
+        if ok is None:
+            return
+        b = _get(host)
+        if ok:
+            if b["state"] != CLOSED or b["failures"]:
+                b["failures"] = 0
+                b["cool_down"] = COOL_DOWN
+                _set(host, b, CLOSED)
+            return
+        b["failures"] += 1
+        b["updated"] = time.time()
+        _changed.add(host)
+        if probe:
+            b["cool_down"] = min(MAX_COOL_DOWN, b["cool_down"] * 2)
+        elif b["state"] != CLOSED or b["failures"] < FAILURE_THRESHOLD:
+            return
+        b["opened"] = time.time()
+        _set(host, b, OPEN)
+
+
+@contextmanager
+def guard(url):
+    """Run a request or page load to ``url`` through its host's breaker;
+    any exception out of the block counts as a failure."""
+    probe = acquire(url)
+    try:
+        yield
+    except BaseException as exc:
+        cancelled = isinstance(exc, (asyncio.CancelledError, KeyboardInterrupt, GeneratorExit))
+        report(url, None if cancelled else False, probe)
+        raise
+    report(url, True, probe)
+
+
+def save():
+    """Write this run's breaker changes, newest state per host winning."""
+    with _lock:
+        if not _changed:
+            return
+        with locked(BREAKERS_FILE):
+            merged = load_json(BREAKERS_FILE, {})
+            for host in _changed:
+                b = _breakers[host]
+                if b["updated"] >= merged.get(host, {}).get("updated", 0):
+                    merged[host] = b
+            save_json(BREAKERS_FILE, merged)
+        _changed.clear()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Optional long-lived Playwright browser servers.
+
+With BROWSER_SERVER=1 scrapers attach to an already running browser over
+the Playwright wire protocol instead of cold-starting one. There is one
+server per engine and set of launch options, so a source never ends up on
+a browser launched with another source's flags. A server is started on
+first use (the orchestrator starts the ones its sources declare up front),
+health-checked before every attach and relaunched when it died. Starting
+and stopping happen under the server's state lock, so worker processes
+racing to start the same server end up sharing one. Each server records
+the processes attached to it; a recycle only stops a server that no other
+process is using. Without the variable,
+or when the server cannot be reached, browsers are launched locally as
+before.
+
+Usage: python -m common.browser start|stop|status|watch [engine ...]
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from common.state import STATE_DIR, load_json, locked, save_json, state_path
+
+# ================= CONFIG =================
+
+SERVER_MODE = os.environ.get("BROWSER_SERVER", "") not in ("", "0", "false")
+
+ENGINES = ("chromium", "firefox")
+
+STARTUP_TIMEOUT = 30  # seconds to wait for the ws endpoint
+CONNECT_TIMEOUT = 10_000  # ms
+WATCH_INTERVAL = 15  # seconds between health checks in watch mode
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def server_key(engine, launch_options=None):
+    """Name of ``engine``'s server launched with ``launch_options``."""
+    if not launch_options:
+        return engine
+    options = json.dumps(launch_options, sort_keys=True).encode("utf-8")
+    return f"{engine}-{hashlib.sha1(options).hexdigest()[:8]}"
+
+
+def _state_name(key):
+    return f"browser-server-{key}.json"
+
+
+def known_servers(engines):
+    """Keys of the servers with state on disk for any of ``engines``."""
+    keys = []
+    for path in sorted(STATE_DIR.glob("browser-server-*.json")):
+        key = path.name[len("browser-server-"):-len(".json")]
+        if key.endswith(".config"):
+            continue
+        if key.split("-", 1)[0] in engines:
+            keys.append(key)
+    return keys
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def _port_open(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=2):
+            return True
+    except OSError:
+        return False
+
+# ================= SERVER =================
+
+def healthy(state):
+    return bool(state) and _pid_alive(state.get("pid")) and _port_open(state.get("port"))
+
+
+def _stop(key):
+    """Stop server ``key``; the caller holds its lock."""
+    state = load_json(_state_name(key))
+    if state and _pid_alive(state.get("pid")):
+        try:
+            os.killpg(state["pid"], signal.SIGTERM)
+        except OSError:
+            pass
+    save_json(_state_name(key), {})
+
+
+def stop_server(engine, launch_options=None):
+    key = server_key(engine, launch_options)
+    with locked(_state_name(key)):
+        _stop(key)
+
+
+def _start(key, engine, launch_options=None):
+    """Launch a detached browser server and return its state; the caller
+    holds its lock."""
+    _stop(key)
+
+    port = _free_port()
+    config = dict(launch_options or {})
+    config.update({"headless": True, "port": port, "wsPath": f"kpr-{key}"})
+
+    config_path = state_path(f"browser-server-{key}.config.json")
+    config_path.write_text(json.dumps(config), encoding="utf-8")
+    log_path = state_path(f"browser-server-{key}.log")
+
+    with open(log_path, "w", encoding="utf-8") as out:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "playwright", "launch-server",
+             "--browser", engine, "--config", str(config_path)],
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{key} server exited: {log_path.read_text()[-300:]}")
+        for line in log_path.read_text(encoding="utf-8").splitlines():
+            if line.startswith("ws://") and _port_open(port):
+                state = {
+                    "pid": proc.pid, "port": port, "ws": line.strip(),
+                    "started": time.time(), "engine": engine,
+                    "options": launch_options or {},
+                }
+                save_json(_state_name(key), state)
+                log(f"{key} server ready at {state['ws']}")
+                return state
+        time.sleep(0.5)
+
+    os.killpg(proc.pid, signal.SIGTERM)
+    raise RuntimeError(f"{key} server did not start within {STARTUP_TIMEOUT}s")
+
+
+def server_pid(engine, launch_options=None):
+    """Process group leader of the running server, or None."""
+    state = load_json(_state_name(server_key(engine, launch_options)))
+    pid = state.get("pid") if state else None
+    return pid if _pid_alive(pid) else None
+
+
+def _live_clients(state):
+    return [pid for pid in state.get("clients", []) if _pid_alive(pid)]
+
+
+def ensure_server(engine, launch_options=None, client=None):
+    """Return a healthy server's state, relaunching it when needed, and
+    record pid ``client`` as attached to it.
+
+    Holds the server's lock throughout, so concurrent callers wait for
+    one launch instead of killing each other's servers.
+    """
+    key = server_key(engine, launch_options)
+    with locked(_state_name(key)):
+        state = load_json(_state_name(key))
+        if not healthy(state):
+            if state:
+                log(f"{key} server unhealthy, relaunching")
+            state = _start(key, engine, launch_options)
+        if client is not None:
+            state["clients"] = sorted(set(_live_clients(state)) | {client})
+            save_json(_state_name(key), state)
+        return state
+
+
+def clients(engine, launch_options=None):
+    """Number of live processes attached to the server."""
+    state = load_json(_state_name(server_key(engine, launch_options)))
+    return len(_live_clients(state)) if state else 0
+
+
+def detach(engine, launch_options=None, stop_if_last=False):
+    """Record this process as no longer attached; with ``stop_if_last``
+    the server is stopped when no other process is. Returns whether it
+    was stopped."""
+    key = server_key(engine, launch_options)
+    with locked(_state_name(key)):
+        state = load_json(_state_name(key))
+        if not state:
+            return False
+        others = [pid for pid in _live_clients(state) if pid != os.getpid()]
+        if stop_if_last and not others:
+            _stop(key)
+            return True
+        state["clients"] = others
+        save_json(_state_name(key), state)
+        return False
+
+# ================= ATTACH =================
+
+async def get_browser(playwright, engine="chromium", **launch_options):
+    """Connect to the shared browser server, or launch locally."""
+    launcher = getattr(playwright, engine)
+
+    if SERVER_MODE:
+        for attempt in (1, 2):
+            try:
+                state = await asyncio.to_thread(
+                    ensure_server, engine, launch_options, os.getpid()
+                )
+                return await launcher.connect(state["ws"], timeout=CONNECT_TIMEOUT)
+            except Exception as exc:
+                log(f"{engine} server attach failed ({attempt}/2): {exc}")
+                # Health check passed but the browser does not answer.
+                await asyncio.to_thread(stop_server, engine, launch_options)
+        log(f"Falling back to a local {engine} launch")
+
+    return await launcher.launch(headless=True, **launch_options)
+
+# ================= MAIN =================
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("start", "stop", "status", "watch"):
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
+
+    command = sys.argv[1]
+    engines = sys.argv[2:] or list(ENGINES)
+
+    if command == "start":
+        for engine in engines:
+            ensure_server(engine)
+    elif command == "stop":
+        for key in known_servers(engines):
+            with locked(_state_name(key)):
+                _stop(key)
+    elif command == "status":
+        for key in known_servers(engines):
+            state = load_json(_state_name(key))
+            status = "up" if healthy(state) else "down"
+            log(f"{key:<18} {status:<5} {state.get('ws', '') if state else ''}")
+    elif command == "watch":
+        while True:
+            servers = {server_key(engine): (engine, None) for engine in engines}
+            for key in known_servers(engines):
+                state = load_json(_state_name(key)) or {}
+                if "engine" in state:
+                    servers[key] = (state["engine"], state["options"])
+            for key, (engine, options) in servers.items():
+                try:
+                    ensure_server(engine, options)
+                except Exception as exc:
+                    log(f"{key} relaunch failed: {exc}")
+            time.sleep(WATCH_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
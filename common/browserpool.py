@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Memory-governed page pool on a shared browser.
+
+Browser sources hold a slot from their engine's pool for every page (or
+context) they open. The pool starts small and reads the browser's RSS and
+the system's available memory as pages open and close. It allows another
+page while both have room for one more page of the size seen so far, and
+gives slots back when memory runs short. A browser that grows past
+BROWSER_MAX_RSS_MB is drained and relaunched, so a leaky browser is
+recycled before the supervisor's RSS limit kills the whole worker.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+from common.browser import SERVER_MODE, clients, server_pid
+from common.memory import available_mb, cmdline, descendants, rss_mb
+
+# ================= CONFIG =================
+
+MIN_PAGES = int(os.environ.get("BROWSER_MIN_PAGES", 1))
+MAX_PAGES = int(os.environ.get("BROWSER_MAX_PAGES", 6))
+INITIAL_PAGES = 2
+
+# Stays below the supervisor's per-worker RSS limit (SUPERVISOR_MAX_RSS_MB).
+BROWSER_MAX_RSS_MB = int(os.environ.get("BROWSER_MAX_RSS_MB", 1200))
+# System memory left free for everything else on the runner.
+MEMORY_HEADROOM_MB = int(os.environ.get("BROWSER_HEADROOM_MB", 512))
+
+PAGE_MB_ESTIMATE = 300  # until a page has been measured
+PAGE_MB_ALPHA = 0.3  # EWMA weight of the newest per-page reading
+
+SAMPLE_INTERVAL = 2  # seconds between memory readings
+WAIT_POLL = 0.2  # seconds between slot checks for waiters
+
+# Substrings of the browser processes' command lines, per engine.
+ENGINE_MARKERS = {
+    "chromium": ("chrom",),
+    "firefox": ("firefox",),
+}
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+# ================= POOL =================
+
+class BrowserPool:
+    def __init__(self, rt, engine, launch_options=None, min_pages=MIN_PAGES,
+                 max_pages=MAX_PAGES, max_rss_mb=BROWSER_MAX_RSS_MB):
+        self.rt = rt
+        self.engine = engine
+        self.launch_options = launch_options or {}
+        self.min_pages = max(1, min_pages)
+        self.max_pages = max(self.min_pages, max_pages)
+        self.max_rss_mb = max_rss_mb
+        self.limit = min(max(INITIAL_PAGES, self.min_pages), self.max_pages)
+        self.active = 0
+        self.opened = 0
+        self.peak = 0
+        self.low = self.limit
+        self.high = self.limit
+        self.recycles = 0
+        self.rss = 0.0
+        self.peak_rss = 0.0
+        self.page_mb = PAGE_MB_ESTIMATE
+        self.base_mb = None
+        self.draining = False
+        self._sampled = 0.0
+        self._recycling = asyncio.Lock()
+
+    async def browser(self):
+        """The engine's shared browser (launched on first use)."""
+        return await self.rt.browser(self.engine, **self.launch_options)
+
+    def browser_rss_mb(self):
+        root = server_pid(self.engine, self.launch_options) if SERVER_MODE else None
+        markers = ENGINE_MARKERS.get(self.engine, (self.engine,))
+        return rss_mb(
+            pid for pid in descendants(root or os.getpid())
+            if any(m in cmdline(pid) for m in markers)
+        )
+
+    def sample(self, force=False):
+        """Read memory and adjust the limit, at most every SAMPLE_INTERVAL."""
+        now = time.monotonic()
+        if not force and now - self._sampled < SAMPLE_INTERVAL:
+            return
+        self._sampled = now
+
+        self.rss = self.browser_rss_mb()
+        self.peak_rss = max(self.peak_rss, self.rss)
+        if not self.rss:
+            return  # browser not running yet, or no /proc
+        if self.active == 0:
+            self.base_mb = self.rss
+        elif self.base_mb is not None:
+            per_page = max(0.0, self.rss - self.base_mb) / self.active
+            self.page_mb = PAGE_MB_ALPHA * per_page + (1 - PAGE_MB_ALPHA) * self.page_mb
+
+        # A shared server's RSS includes other workers' pages: only its sole
+        # user recycles it. Everyone else just gives slots back below.
+        if (self.rss > self.max_rss_mb and not self.draining
+                and not (SERVER_MODE and clients(self.engine, self.launch_options) > 1)):
+            self.draining = True
+            log(f"[pool {self.engine}] browser RSS {self.rss:.0f}MB > "
+                f"{self.max_rss_mb}MB, draining to recycle")
+
+        room = self.max_rss_mb - self.rss
+        free = available_mb()
+        if free is not None:
+            room = min(room, free - MEMORY_HEADROOM_MB)
+
+        if room < 0 and self.limit > self.min_pages:
+            self.limit -= 1
+            log(f"[pool {self.engine}] memory short ({room:.0f}MB), "
+                f"{self.limit} pages")
+        elif (self.active >= self.limit and self.limit < self.max_pages
+              and room > self.page_mb * (self.limit + 1 - self.active)):
+            # Only grow while pages are queueing for a slot.
+            self.limit += 1
+            log(f"[pool {self.engine}] {room:.0f}MB free for "
+                f"~{self.page_mb:.0f}MB pages, {self.limit} pages")
+        self.low = min(self.low, self.limit)
+        self.high = max(self.high, self.limit)
+
+    async def _recycle(self):
+        async with self._recycling:
+            if not self.draining or self.active:
+                return
+            log(f"[pool {self.engine}] recycling browser")
+            try:
+                await self.rt.recycle(self.engine, **self.launch_options)
+            except Exception as exc:
+                log(f"[pool {self.engine}] recycle failed: {exc}")
+            self.recycles += 1
+            self.base_mb = None
+            self.draining = False
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one page slot; yields the browser to open the page on."""
+        while self.draining or self.active >= self.limit:
+            if self.draining and not self.active:
+                await self._recycle()
+                continue
+            self.sample()
+            await asyncio.sleep(WAIT_POLL)
+        self.active += 1
+        self.opened += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            yield await self.browser()
+        finally:
+            self.active -= 1
+            self.sample(force=self.active == 0)
+            if self.draining and not self.active:
+                await self._recycle()
+
+    @asynccontextmanager
+    async def context(self, **options):
+        """Hold a slot for a fresh browser context, closed on exit."""
+        async with self.slot() as browser:
+            context = await browser.new_context(**options)
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception:
+                    pass
+
+    def metrics(self):
+        return {
+            "pages": self.opened,
+            "limit": self.limit,
+            "low": self.low,
+            "high": self.high,
+            "peak": self.peak,
+            "recycles": self.recycles,
+            "peak_rss_mb": round(self.peak_rss),
+            "page_mb": round(self.page_mb),
+        }
+
+    def report(self):
+        if not self.opened:
+            return
+        m = self.metrics()
+        log(f"[pool {self.engine}] {m['pages']} pages, limit {m['low']}-{m['high']} "
+            f"(peak {m['peak']} open), ~{m['page_mb']}MB/page, "
+            f"peak browser RSS {m['peak_rss_mb']}MB, {m['recycles']} recycles")
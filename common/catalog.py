@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Persisted catalog of resolved entries, with rolling partial refresh.
+
+A source keeps every entry it resolved in ``.cache/<name>.catalog.json``
+together with when it was resolved and when its stream token expires. Each
+run asks the catalog which of the currently listed events to resolve and
+publishes the catalog's entries for everything still listed.
+
+With ROLLING_SLICE=<n> each run resolves at most n events: new ones first,
+then those whose token expires soon, then those older than the staleness
+bound (ROLLING_MAX_AGE seconds), and spare capacity goes to the least
+recently resolved so ages stay spread out. Per-run cost stays constant
+while every entry is still refreshed within the bound, as long as the
+slice is large enough for the listing.
+"""
+
+import os
+import time
+
+from common.playlist import expiry_margin, url_expiry
+from common.state import load_json, save_json
+
+# ================= CONFIG =================
+
+ROLLING_SLICE = int(os.environ.get("ROLLING_SLICE", 0))  # 0 = resolve everything
+ROLLING_MAX_AGE = int(os.environ.get("ROLLING_MAX_AGE", 90 * 60))
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+# ================= CATALOG =================
+
+class Catalog:
+    def __init__(self, name, max_age=ROLLING_MAX_AGE, slice_size=ROLLING_SLICE):
+        self.name = name
+        self.file = f"{name}.catalog.json"
+        self.max_age = max_age
+        self.slice_size = slice_size
+        self.records = load_json(self.file, {})
+
+    @property
+    def rolling(self):
+        return self.slice_size > 0
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def entry(self, key):
+        record = self.records.get(key)
+        return record["entry"] if record else None
+
+    def resolved(self, key):
+        record = self.records.get(key)
+        return record["resolved"] if record else None
+
+    def age(self, key, now=None):
+        record = self.records.get(key)
+        if not record:
+            return None
+        return (now or time.time()) - record["resolved"]
+
+    def _rank(self, key, now, bound, force=()):
+        """Refresh urgency: (class, tiebreak); lower goes first."""
+        record = self.records.get(key)
+        if not record or key in force:
+            return (0, 0)
+        expires = record.get("expires")
+        if expires is not None and expires < now + expiry_margin():
+            return (1, expires)
+        age = now - record["resolved"]
+        if age >= bound:
+            return (2, -age)
+        return (3, -age)
+
+    def plan(self, keys, max_age=None, force=()):
+        """Pick which of the listed ``keys`` to resolve this run.
+
+        Without rolling refresh that is every key older than ``max_age``
+        (all of them when None); with it, at most ``slice_size`` keys by
+        urgency. Keys in ``force`` rank with new ones. Keys keep their
+        listing order within the result.
+        """
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        force = set(force)
+        for key in keys:
+            record = self.records.get(key)
+            if record:
+                record["last_seen"] = now
+
+        if not self.rolling:
+            if max_age is None:
+                return keys
+            return [
+                k for k in keys
+                if self._rank(k, now, max_age, force)[0] < 3
+            ]
+
+        bound = self.max_age if max_age is None else min(max_age, self.max_age)
+        ranked = sorted(keys, key=lambda k: self._rank(k, now, bound, force))
+        picked = set(ranked[:self.slice_size])
+        overdue = sum(
+            1 for k in ranked[self.slice_size:]
+            if self._rank(k, now, bound, force)[0] < 3
+        )
+        log(f"[{self.name}] rolling refresh: {len(picked)}/{len(keys)} this run"
+            + (f", {overdue} overdue left for later" if overdue else ""))
+        return [k for k in keys if k in picked]
+
+    def update(self, key, entry, url=None, resolved=None):
+        """Store a freshly resolved entry; ``url`` is checked for an expiry.
+        ``resolved`` is when it was resolved, if not just now."""
+        now = time.time()
+        record = self.records.get(key, {"first_seen": now})
+        record.update({
+            "entry": entry,
+            "resolved": resolved or now,
+            "last_seen": now,
+            "expires": url_expiry(url) if url else None,
+        })
+        self.records[key] = record
+
+    def entries(self, keys, max_age=None):
+        """Usable entries for ``keys``: skips missing and expired ones.
+
+        Without rolling refresh, a key older than ``max_age`` was due this
+        run, so one still that old failed to refresh and is skipped rather
+        than published indefinitely. Rolling refresh keeps serving overdue
+        keys until a slice reaches them.
+        """
+        now = time.time()
+        out = []
+        for key in dict.fromkeys(keys):
+            record = self.records.get(key)
+            if not record:
+                continue
+            if record.get("expires") is not None and record["expires"] < now:
+                continue
+            if (max_age is not None and not self.rolling
+                    and now - record["resolved"] >= max_age):
+                continue
+            out.append(record["entry"])
+        return out
+
+    def retain(self, keys):
+        """Forget everything no longer listed upstream."""
+        keys = set(keys)
+        gone = [k for k in self.records if k not in keys]
+        for key in gone:
+            del self.records[key]
+        return gone
+
+    def save(self):
+        save_json(self.file, self.records)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Run-level deadline shared by every stage of a source's run.
+
+The orchestrator (or supervisor worker) starts a deadline from the source's
+``timeout`` before calling ``run(rt)``; standalone runs read RUN_DEADLINE
+(seconds, unset = no deadline). Work stops ``reserve`` seconds before the
+hard limit so there is still time to write what was resolved, and the time
+left is shared out among the events still to resolve.
+"""
+
+import contextvars
+import os
+import time
+
+# ================= CONFIG =================
+
+RUN_DEADLINE = float(os.environ.get("RUN_DEADLINE", 0)) or None
+
+# Seconds kept back at the end of a run for writing playlists.
+PUBLISH_RESERVE = 20
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+# ================= DEADLINE =================
+
+class Deadline:
+    def __init__(self, seconds=None, reserve=PUBLISH_RESERVE):
+        self.expires = time.monotonic() + seconds if seconds else None
+        self.reserve = reserve if seconds and seconds > 2 * reserve else 0
+
+    def remaining(self):
+        """Seconds of work left before the soft stop, or None if unbounded."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - self.reserve - time.monotonic())
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def share(self, pending, workers=1, floor=0, cap=None):
+        """Time budget for the next of ``pending`` items on ``workers`` slots.
+
+        Returns ``cap`` when unbounded and None when less than ``floor`` is
+        left, i.e. the item should not be started at all.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining < floor:
+            return None
+        rounds = -(-max(1, pending) // max(1, workers))
+        budget = max(remaining / rounds, floor)
+        if cap is not None:
+            budget = min(budget, cap)
+        return budget
+
+
+def start(seconds):
+    """Begin a deadline for the current task and the tasks it spawns."""
+    deadline = Deadline(seconds)
+    _current.set(deadline)
+    return deadline
+
+
+def current():
+    deadline = _current.get()
+    if deadline is None:
+        deadline = start(RUN_DEADLINE)
+    return deadline
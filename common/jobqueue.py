@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+SQLite-backed lease queue for stream resolution jobs.
+
+Discovery enqueues one job per event. Any number of worker processes on
+this machine lease jobs, resolve them and store the result. A lease that
+is not completed or renewed before it expires (crashed worker) becomes
+leasable again.
+
+Enable with JOB_QUEUE=1 (database under .cache/) or JOB_QUEUE=<path>. By
+default the database runs in WAL mode, which needs shared memory between
+the processes and so only works for workers on this machine. To spread
+workers across hosts, put the database on a filesystem they all mount
+(with working POSIX locks, e.g. NFSv4) and set JOB_QUEUE_SHARED=1 on every
+host: the database then uses a rollback journal, which SQLite supports
+there at the cost of readers waiting on writers. Leases are timed with the
+wall clock, so the hosts' clocks must agree to well within LEASE_SECONDS.
+
+Database calls block (up to the 30s busy timeout under contention), so
+the workers below make them from a thread, off the event loop.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from common import deadline
+from common.state import state_path
+
+# ================= CONFIG =================
+
+JOB_QUEUE = os.environ.get("JOB_QUEUE", "")
+QUEUE_MODE = JOB_QUEUE not in ("", "0", "false")
+# Rollback journal instead of WAL, for a database shared between hosts.
+SHARED = os.environ.get("JOB_QUEUE_SHARED", "") not in ("", "0", "false")
+
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 2
+POLL_INTERVAL = 2  # seconds between lease attempts when idle
+IDLE_TIMEOUT = 60  # remote workers exit after this long without work
+
+# Results younger than this are reused by the next cycle instead of
+# resolving the event again.
+RESULT_TTL = 30 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    queue TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (queue, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (queue, status, priority, id);
+"""
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def worker_id(n=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{n}"
+
+# ================= QUEUE =================
+
+class JobQueue:
+    def __init__(self, path=None, shared=SHARED):
+        if path is None:
+            path = JOB_QUEUE if JOB_QUEUE not in ("", "0", "1", "true") else None
+        self.path = str(path or state_path("jobs.sqlite"))
+        # One connection, used from worker threads one call at a time.
+        self.db = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.RLock()
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"PRAGMA journal_mode={'DELETE' if shared else 'WAL'}")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _tx(self, fn):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self.db.execute("COMMIT")
+                return result
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def start_cycle(self, queue, jobs):
+        """Replace the job set of ``queue`` with ``[(key, payload, priority)]``.
+
+        Jobs no longer listed are dropped, recent results are kept, and
+        everything else goes back to pending.
+        """
+        now = time.time()
+
+        def fn():
+            keys = [key for key, _, _ in jobs]
+            if keys:
+                self.db.execute(
+                    f"DELETE FROM jobs WHERE queue = ? AND key NOT IN ({','.join('?' * len(keys))})",
+                    (queue, *keys),
+                )
+            else:
+                self.db.execute("DELETE FROM jobs WHERE queue = ?", (queue,))
+            for key, payload, priority in jobs:
+                self.db.execute(
+                    """
+                    INSERT INTO jobs (queue, key, payload, priority, updated)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (queue, key) DO UPDATE SET
+                        payload = excluded.payload,
+                        priority = excluded.priority,
+                        status = CASE
+                            WHEN status = 'done' AND updated > ? THEN 'done'
+                            WHEN status = 'leased' AND lease_until > ? THEN 'leased'
+                            ELSE 'pending' END,
+                        attempts = CASE WHEN status = 'done' THEN attempts ELSE 0 END
+                    """,
+                    (queue, key, json.dumps(payload), priority, now, now - RESULT_TTL, now),
+                )
+
+        self._tx(fn)
+
+    def lease(self, queue, worker, lease_seconds=LEASE_SECONDS):
+        """Lease the highest-priority available job, or return None."""
+        now = time.time()
+
+        def fn():
+            row = self.db.execute(
+                """
+                SELECT * FROM jobs
+                WHERE queue = ? AND (
+                    status = 'pending'
+                    OR (status = 'leased' AND lease_until < ?)
+                )
+                ORDER BY priority, id
+                LIMIT 1
+                """,
+                (queue, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                """
+                UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?,
+                    attempts = attempts + 1, updated = ?
+                WHERE id = ?
+                """,
+                (worker, now + lease_seconds, now, row["id"]),
+            )
+            return {"id": row["id"], "key": row["key"], "payload": json.loads(row["payload"])}
+
+        return self._tx(fn)
+
+    def renew(self, job_id, worker, lease_seconds=LEASE_SECONDS):
+        self._execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (time.time() + lease_seconds, job_id, worker),
+        )
+
+    def complete(self, job_id, worker, result):
+        self._execute(
+            """
+            UPDATE jobs SET status = 'done', result = ?, updated = ?
+            WHERE id = ? AND worker = ? AND status = 'leased'
+            """,
+            (json.dumps(result), time.time(), job_id, worker),
+        )
+
+    def fail(self, job_id, worker, error="", max_attempts=MAX_ATTEMPTS):
+        self._execute(
+            """
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                error = ?, updated = ?
+            WHERE id = ? AND worker = ? AND status = 'leased'
+            """,
+            (max_attempts, str(error)[:300], time.time(), job_id, worker),
+        )
+
+    def counts(self, queue):
+        rows = self._execute(
+            "SELECT status, COUNT(*) AS n FROM jobs WHERE queue = ? GROUP BY status",
+            (queue,),
+        )
+        return {row["status"]: row["n"] for row in rows}
+
+    def results(self, queue):
+        rows = self._execute(
+            "SELECT key, result FROM jobs WHERE queue = ? AND status = 'done' ORDER BY key",
+            (queue,),
+        )
+        return {row["key"]: json.loads(row["result"]) for row in rows}
+
+# ================= WORKERS =================
+
+async def _work(jq, queue, worker, handler, idle_timeout, lease_seconds):
+    idle_since = time.monotonic()
+    run_deadline = deadline.current()
+    while True:
+        if run_deadline.expired():
+            # Unfinished jobs stay pending for the next run or other workers.
+            return
+        job = await asyncio.to_thread(jq.lease, queue, worker, lease_seconds)
+        if job is None:
+            counts = await asyncio.to_thread(jq.counts, queue)
+            outstanding = counts.get("pending", 0) + counts.get("leased", 0)
+            if not outstanding:
+                return
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        async def keep_leased():
+            while True:
+                await asyncio.sleep(lease_seconds / 3)
+                await asyncio.to_thread(jq.renew, job["id"], worker, lease_seconds)
+
+        renewer = asyncio.create_task(keep_leased())
+        try:
+            result = await handler(job["payload"])
+        except Exception as exc:
+            await asyncio.to_thread(jq.fail, job["id"], worker, f"{type(exc).__name__}: {exc}")
+        else:
+            if result:
+                await asyncio.to_thread(jq.complete, job["id"], worker, result)
+            else:
+                await asyncio.to_thread(jq.fail, job["id"], worker, "no result")
+        finally:
+            renewer.cancel()
+        idle_since = time.monotonic()
+
+
+async def drain(jq, queue, handler, concurrency=1, idle_timeout=None,
+                lease_seconds=LEASE_SECONDS):
+    """Lease and handle jobs from ``queue`` with ``concurrency`` workers.
+
+    ``handler(payload)`` returns a JSON-serialisable result, or None on
+    failure. Returns when nothing is left pending or leased, when the run
+    deadline is reached, or, with ``idle_timeout``, after that many seconds
+    without a leasable job.
+    """
+    await asyncio.gather(*(
+        _work(jq, queue, worker_id(n), handler, idle_timeout, lease_seconds)
+        for n in range(concurrency)
+    ))
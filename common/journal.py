@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Append-only journal of resolved entries for long scraper runs.
+
+Each resolved event is appended as one JSON line and flushed to disk right
+away, so a run killed by the workflow timeout or a browser crash keeps
+everything it resolved. The next run loads the journal and skips those
+events instead of resolving them again.
+"""
+
+import json
+import os
+import time
+
+from common.state import atomic_write, state_path
+
+# ================= CONFIG =================
+
+# Journal lines older than this are ignored on resume; their stream tokens
+# are likely to have expired.
+JOURNAL_TTL = int(os.environ.get("JOURNAL_TTL", 30 * 60))
+
+# ================= JOURNAL =================
+
+class Journal:
+    def __init__(self, name, ttl=JOURNAL_TTL):
+        self.path = state_path(f"{name}.journal.jsonl")
+        self.ttl = ttl
+        self.entries = {}
+        self._stamps = {}
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+
+        now = time.time()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from a killed run.
+                    continue
+                if now - record.get("ts", 0) < self.ttl:
+                    self.entries[record["key"]] = record["entry"]
+                    self._stamps[record["key"]] = record["ts"]
+
+        # Compact: drop expired and duplicate lines.
+        atomic_write(self.path, "".join(
+            json.dumps({"key": k, "ts": self._stamps[k], "entry": v}) + "\n"
+            for k, v in self.entries.items()
+        ))
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def stamp(self, key):
+        """When ``key`` was appended, or None."""
+        return self._stamps.get(key)
+
+    def append(self, key, entry):
+        now = time.time()
+        self.entries[key] = entry
+        self._stamps[key] = now
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "ts": now, "entry": entry}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        self.entries = {}
+        self._stamps = {}
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
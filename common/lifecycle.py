@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Event lifecycle: first seen -> scheduled -> live -> finished, or gone.
+
+Each run reports what the source currently lists, with kickoff times where
+known. The registry persists every event's state in
+``.cache/<name>.lifecycle.json``. From that state it retires events that
+finished or left the listing, so their catalog entries are evicted and
+never published again. It also re-resolves an event shortly before
+kickoff when its cached stream was resolved earlier than that.
+"""
+
+import os
+import time
+
+from common.priority import LIVE_WINDOW, kickoff_ts
+from common.state import load_json, save_json
+
+# ================= CONFIG =================
+
+# Re-resolve events this long before kickoff; earlier streams are usually
+# placeholders.
+PRE_RESOLVE_LEAD = int(os.environ.get("LIFECYCLE_LEAD_MINUTES", 20)) * 60
+
+# An event is finished this long after kickoff.
+MATCH_LENGTH = LIVE_WINDOW
+
+SCHEDULED, LIVE, FINISHED = "scheduled", "live", "finished"
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+# ================= LIFECYCLE =================
+
+class Lifecycle:
+    def __init__(self, name, lead=PRE_RESOLVE_LEAD, length=MATCH_LENGTH):
+        self.name = name
+        self.file = f"{name}.lifecycle.json"
+        self.lead = lead
+        self.length = length
+        self.events = load_json(self.file, {})
+        # Keys the last plan re-resolves because kickoff is near.
+        self.forced = set()
+
+    def _state(self, record, now):
+        kickoff = record.get("kickoff")
+        if kickoff is None or now < kickoff:
+            # Without a kickoff an event counts as on while it is listed.
+            return LIVE if kickoff is None else SCHEDULED
+        if now < kickoff + self.length:
+            return LIVE
+        return FINISHED
+
+    def state(self, key, now=None):
+        record = self.events.get(key)
+        return self._state(record, now or time.time()) if record else None
+
+    def observe(self, listing, now=None):
+        """Record the current listing, ``{key: kickoff or None}``.
+
+        Returns the keys still worth publishing, in listing order. Events
+        that finished or are no longer listed are retired. An empty listing
+        is treated as an upstream failure and retires nothing.
+        """
+        now = now or time.time()
+        if not listing:
+            return []
+
+        counts = {"new": 0, SCHEDULED: 0, LIVE: 0, FINISHED: 0, "gone": 0}
+        for key in [k for k in self.events if k not in listing]:
+            del self.events[key]
+            counts["gone"] += 1
+
+        active = []
+        for key, kickoff in listing.items():
+            record = self.events.get(key)
+            if record is None:
+                record = self.events[key] = {"first_seen": now, "kickoff": None}
+                counts["new"] += 1
+            record["last_seen"] = now
+            kickoff = kickoff_ts(kickoff)
+            if kickoff is not None:
+                record["kickoff"] = kickoff
+
+            state = self._state(record, now)
+            if state != record.get("state"):
+                record["state"] = state
+                if state == LIVE:
+                    record["live_since"] = now
+            counts[state] += 1
+            if state != FINISHED:
+                active.append(key)
+
+        log(f"[{self.name}] lifecycle: " + ", ".join(f"{n} {s}" for s, n in counts.items()))
+        return active
+
+    def pre_resolve(self, key, resolved, now=None):
+        """True when the stream cached at ``resolved`` predates the
+        pre-kickoff window the event has now entered."""
+        record = self.events.get(key)
+        if not record or record.get("kickoff") is None or resolved is None:
+            return False
+        window = record["kickoff"] - self.lead
+        return (now or time.time()) >= window > resolved
+
+    def plan(self, catalog, listing, max_age=None):
+        """Observe ``listing`` and pick what ``catalog`` should resolve.
+
+        Returns ``(active, todo)``; finished and vanished events are evicted
+        from the catalog. Keys re-resolved before kickoff are kept in
+        ``forced``.
+        """
+        active = self.observe(listing)
+        if active:
+            catalog.retain(active)
+        force = [k for k in active if self.pre_resolve(k, catalog.resolved(k))]
+        self.forced = set(force)
+        return active, catalog.plan(active, max_age=max_age, force=force)
+
+    def save(self):
+        save_json(self.file, self.events)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Memory readings from /proc, shared by the supervisor and browser pools.
+
+Every reading degrades to "unknown" (None or 0) off Linux, so callers fall
+back to their static limits.
+"""
+
+import os
+
+# ================= PROCESSES =================
+
+def _children():
+    """Map of pid -> parent pid from /proc (empty off Linux)."""
+    parents = {}
+    try:
+        pids = [p for p in os.listdir("/proc") if p.isdigit()]
+    except OSError:
+        return parents
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                # The command name may contain spaces; fields follow ')'.
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(pid)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return parents
+
+
+def descendants(root_pid):
+    """Pids of every process below ``root_pid``."""
+    parents = _children()
+    tree = {root_pid}
+    changed = True
+    while changed:
+        changed = False
+        for pid, ppid in parents.items():
+            if ppid in tree and pid not in tree:
+                tree.add(pid)
+                changed = True
+    tree.discard(root_pid)
+    return tree
+
+
+def cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+
+def rss_mb(pids):
+    """Combined resident memory of ``pids``, in MB."""
+    page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            continue
+    return total / (1024 * 1024)
+
+
+def tree_rss_mb(root_pid):
+    """Resident memory of a process and all its descendants, in MB."""
+    return rss_mb({root_pid} | descendants(root_pid))
+
+# ================= SYSTEM =================
+
+def available_mb():
+    """Memory the kernel can hand out without swapping, or None."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
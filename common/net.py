@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+"""
+Shared upstream fetch layer with per-host adaptive concurrency.
+
+Every HTTP request a scraper makes goes through a slot from its host's
+limiter, whether it uses aiohttp (``fetch_text`` / ``slot``) or a blocking
+client in a thread (``slot_sync``). Each limiter does AIMD: while requests
+succeed at healthy latency the limit grows by about one per window of
+requests, and a timeout, connection error, 429 or 5xx halves it. Limits
+and counters are reported with the run metrics.
+
+With NET_HEDGE=1, fetches made with ``hedge=True`` are hedged. A GET that
+has not answered by its host's p90 latency is sent a second time, and
+whichever answers first wins. Hedges are capped at a small fraction of all
+requests so a slow host is not hit with double traffic.
+
+Every request also takes a slot from the host's machine-wide budget
+(common.ratelimit), and requests to a host whose circuit breaker is open
+(common.breaker) fail at once. Timeouts passed to the fetch helpers are defaults; once a host has history
+its timeouts come from common.timeouts.
+
+Bodies are read in chunks and capped at MAX_BODY_BYTES. Given ``until`` (a
+compiled regex), reading stops as soon as it matches and the connection is
+dropped; the text returned then ends just after the match.
+
+``fetch_shared`` coalesces identical GETs: concurrent callers share one
+upstream request, and successful responses are reused for MEMO_TTL
+seconds within the run.
+"""
+
+import asyncio
+import codecs
+import concurrent.futures
+import os
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+
+from common import breaker, ratelimit, timeouts
+
+# ================= CONFIG =================
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+# Stays at or below the shared aiohttp pool's per-host connection limit.
+MAX_LIMIT = int(os.environ.get("NET_MAX_PER_HOST", 8))
+
+DECREASE_FACTOR = 0.5
+# A response slower than this multiple of the host's best smoothed latency
+# holds the limit instead of growing it.
+SLOW_FACTOR = 2.5
+LATENCY_ALPHA = 0.2  # EWMA weight of the newest sample
+
+WAIT_POLL = 0.05  # seconds between slot checks for async waiters
+
+HEDGE_ENABLED = os.environ.get("NET_HEDGE", "") not in ("", "0", "false")
+HEDGE_RATIO = 0.05  # hedges allowed per request made, across all hosts
+HEDGE_BURST = 3  # hedges allowed before there is a history to take a ratio of
+HEDGE_MIN_SAMPLES = 10  # successful requests needed for a host's p90
+HEDGE_MIN_DELAY = 0.2  # seconds
+LATENCY_SAMPLES = 100  # recent latencies kept per host
+
+MAX_BODY_BYTES = int(os.environ.get("NET_MAX_BODY_KB", 2048)) * 1024
+CHUNK_SIZE = 64 * 1024
+# Characters re-scanned before each new chunk, so an ``until`` match split
+# across two chunks is still found.
+SCAN_OVERLAP = 4096
+
+MEMO_TTL = 120  # seconds a successful shared fetch is reused
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def host_of(url):
+    return (urlsplit(url).hostname or url).lower()
+
+
+def overloaded(status):
+    """Statuses that mean the host wants less traffic."""
+    return status == 429 or status >= 500
+
+# ================= LIMITER =================
+
+class HostLimiter:
+    def __init__(self, host):
+        self.host = host
+        self.limit = float(INITIAL_LIMIT)
+        self.inflight = 0
+        self.peak = self.limit
+        self.low = self.limit
+        self.requests = 0
+        self.errors = 0
+        self.cuts = 0
+        self.latency = None
+        self.best_latency = None
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.shared = 0
+        self._last_cut = 0.0
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        with self._cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire_sync(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(WAIT_POLL)
+
+    def release(self, ok, latency):
+        """``ok`` None means no signal (e.g. the caller was cancelled)."""
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            if ok is not None:
+                self.requests += 1
+            if ok:
+                self.samples.append(latency)
+                self.latency = latency if self.latency is None else (
+                    LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+                )
+                if self.best_latency is None or self.latency < self.best_latency:
+                    self.best_latency = self.latency
+                if latency <= SLOW_FACTOR * self.best_latency:
+                    self.limit = min(MAX_LIMIT, self.limit + 1 / self.limit)
+            elif ok is False:
+                self.errors += 1
+                # Requests in flight together fail together; cut once per
+                # round trip rather than once per failed request.
+                if now - self._last_cut > (self.latency or 1.0):
+                    self.limit = max(MIN_LIMIT, self.limit * DECREASE_FACTOR)
+                    self._last_cut = now
+                    self.cuts += 1
+            self.peak = max(self.peak, self.limit)
+            self.low = min(self.low, self.limit)
+            self._cond.notify_all()
+
+    def p90(self):
+        """90th percentile of recent successful latencies, or None."""
+        with self._cond:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[int(0.9 * (len(ordered) - 1))]
+
+    def metrics(self):
+        return {
+            "limit": round(self.limit, 2),
+            "peak": round(self.peak, 2),
+            "low": round(self.low, 2),
+            "requests": self.requests,
+            "errors": self.errors,
+            "cuts": self.cuts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "shared": self.shared,
+            "latency_ms": round(self.latency * 1000) if self.latency else None,
+        }
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def limiter(url):
+    host = host_of(url)
+    with _registry_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter(host)
+        return _limiters[host]
+
+# ================= SLOTS =================
+
+class Slot:
+    """Outcome of one request; set ``status`` once a response arrives."""
+
+    def __init__(self):
+        self.status = None
+        self.cancelled = False
+
+    @property
+    def ok(self):
+        if self.cancelled:
+            return None
+        return self.status is not None and not overloaded(self.status)
+
+    @property
+    def healthy(self):
+        """The breaker's view: also fails on 403, a host blocking us."""
+        if self.cancelled:
+            return None
+        return self.status is not None and not breaker.failed_status(self.status)
+
+    def fail(self, exc):
+        if isinstance(exc, (asyncio.CancelledError, KeyboardInterrupt, GeneratorExit)):
+            self.cancelled = True
+        elif self.status is None:
+            self.status = _failed_status(exc)
+
+
+def _failed_status(exc):
+    if isinstance(exc, HTTPError):
+        return exc.code
+    code = getattr(exc, "status", None) or getattr(
+        getattr(exc, "response", None), "status_code", None
+    )
+    return code if isinstance(code, int) else None
+
+
+@asynccontextmanager
+async def slot(url):
+    """Hold one of ``url``'s host slots for the duration of a request.
+
+    Raises ``breaker.CircuitOpen`` at once while the host's breaker is open.
+    """
+    probe = breaker.acquire(url)
+    lim = limiter(url)
+    outcome = Slot()
+    try:
+        await lim.acquire()
+        try:
+            await ratelimit.acquire(url)
+        except BaseException:
+            lim.release(None, 0)
+            raise
+    except BaseException:
+        breaker.report(url, None, probe)
+        raise
+    started = time.monotonic()
+    try:
+        yield outcome
+    except BaseException as exc:
+        outcome.fail(exc)
+        raise
+    finally:
+        ratelimit.release_nowait(url)
+        lim.release(outcome.ok, time.monotonic() - started)
+        breaker.report(url, outcome.healthy, probe)
+
+
+@contextmanager
+def slot_sync(url):
+    """Blocking variant of ``slot`` for requests made in threads."""
+    probe = breaker.acquire(url)
+    lim = limiter(url)
+    outcome = Slot()
+    lim.acquire_sync()
+    try:
+        ratelimit.acquire_sync(url)
+    except BaseException:
+        lim.release(None, 0)
+        breaker.report(url, None, probe)
+        raise
+    started = time.monotonic()
+    try:
+        yield outcome
+    except BaseException as exc:
+        outcome.fail(exc)
+        raise
+    finally:
+        ratelimit.release(url)
+        lim.release(outcome.ok, time.monotonic() - started)
+        breaker.report(url, outcome.healthy, probe)
+
+# ================= HEDGING =================
+
+_hedge_lock = threading.Lock()
+_hedge_total = 0
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="hedge")
+
+
+def hedge_delay(url):
+    """Seconds to wait before hedging a GET to ``url``, or None."""
+    if not HEDGE_ENABLED:
+        return None
+    p90 = limiter(url).p90()
+    return None if p90 is None else max(HEDGE_MIN_DELAY, p90)
+
+
+def _take_hedge(lim):
+    global _hedge_total
+    with _registry_lock:
+        made = sum(l.requests for l in _limiters.values())
+    with _hedge_lock:
+        if _hedge_total >= HEDGE_BURST + HEDGE_RATIO * made:
+            return False
+        _hedge_total += 1
+    lim.hedges += 1
+    return True
+
+
+async def _hedged(url, attempt, hedge):
+    delay = hedge_delay(url) if hedge else None
+    if delay is None:
+        return await attempt()
+
+    first = asyncio.ensure_future(attempt())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    lim = limiter(url)
+    if done or not _take_hedge(lim):
+        return await first
+
+    second = asyncio.ensure_future(attempt())
+    pending = {first, second}
+    try:
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        lim.hedge_wins += 1
+                    return task.result()
+            if not pending:
+                # Both failed; report the original request's error.
+                return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _hedged_sync(url, attempt, hedge):
+    delay = hedge_delay(url) if hedge else None
+    if delay is None:
+        return attempt()
+
+    # Attempts run in pool threads so the caller can take whichever
+    # returns first; a losing urllib request runs on to its own timeout.
+    first = _hedge_pool.submit(attempt)
+    lim = limiter(url)
+    try:
+        return first.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+    if not _take_hedge(lim):
+        return first.result()
+
+    second = _hedge_pool.submit(attempt)
+    pending = {first, second}
+    while True:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    lim.hedge_wins += 1
+                return future.result()
+        if not pending:
+            return first.result()
+
+# ================= BODIES =================
+
+class BodyScan:
+    """Decode a body chunk by chunk, stopping early on ``until``."""
+
+    def __init__(self, url, until=None, max_bytes=MAX_BODY_BYTES, charset=None):
+        self.url = url
+        self.until = until
+        self.max_bytes = max_bytes
+        try:
+            decoder = codecs.getincrementaldecoder(charset or "utf-8")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")
+        self.decoder = decoder(errors="replace")
+        self.text = ""
+        self.size = 0
+        self.matched = False
+
+    def feed(self, chunk):
+        """Add a chunk; True once no more of the body is needed."""
+        self.size += len(chunk)
+        start = max(0, len(self.text) - SCAN_OVERLAP)
+        self.text += self.decoder.decode(chunk)
+        if self.until is not None:
+            m = self.until.search(self.text, start)
+            # A match touching the end of what arrived may still grow.
+            if m and m.end() < len(self.text):
+                self.text = self.text[:m.end()]
+                self.matched = True
+                return True
+        if self.size >= self.max_bytes:
+            log(f"[net] body of {self.url[:80]} cut at {self.size // 1024}KB")
+            return True
+        return False
+
+    def finish(self):
+        if not self.matched:
+            self.text += self.decoder.decode(b"", final=True)
+        return self.text
+
+
+async def read_text(response, url, until=None, max_bytes=MAX_BODY_BYTES):
+    scan = BodyScan(url, until, max_bytes, response.charset)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        if scan.feed(chunk):
+            break
+    return scan.finish()
+
+
+def read_text_sync(response, url, until=None, max_bytes=MAX_BODY_BYTES):
+    scan = BodyScan(url, until, max_bytes, response.headers.get_content_charset())
+    while True:
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk or scan.feed(chunk):
+            break
+    return scan.finish()
+
+# ================= FETCH =================
+
+async def fetch_text(session, url, headers=None, timeout=30, hedge=False, until=None,
+                     max_bytes=MAX_BODY_BYTES):
+    """GET ``url`` through the host limiter; returns ``(status, text)``."""
+    async def attempt():
+        async with slot(url) as s:
+            with timeouts.phase(url, "response", timeout) as limit:
+                async with asyncio.timeout(limit):
+                    r = await session.get(url, headers=headers)
+            try:
+                s.status = r.status
+                with timeouts.phase(url, "body", timeout) as limit:
+                    async with asyncio.timeout(limit):
+                        text = await read_text(r, url, until, max_bytes)
+            finally:
+                # Closes the connection when the body was not read to the end.
+                r.release()
+            return r.status, text
+
+    return await _hedged(url, attempt, hedge)
+
+
+def fetch_text_sync(url, headers=None, timeout=30, hedge=False, until=None,
+                    max_bytes=MAX_BODY_BYTES):
+    """Blocking GET through the host limiter with urllib; returns the
+    body text and raises on HTTP errors."""
+    def attempt():
+        req = urllib.request.Request(url, headers=headers or {})
+        with slot_sync(url) as s:
+            # urllib's socket timeout also bounds each read of the body.
+            with timeouts.phase(url, "response", timeout) as limit:
+                r = urllib.request.urlopen(req, timeout=limit)
+            with r:
+                s.status = r.status
+                with timeouts.phase(url, "body", timeout):
+                    return read_text_sync(r, url, until, max_bytes)
+
+    return _hedged_sync(url, attempt, hedge)
+
+# ================= COALESCING =================
+
+_flights = {}
+_memo = {}
+
+
+def _landed(key, flight):
+    _flights.pop(key, None)
+    if flight.cancelled() or flight.exception() is not None:
+        return
+    status, _ = flight.result()
+    if 200 <= status < 300:
+        _memo[key] = (time.monotonic() + MEMO_TTL, flight.result())
+
+
+async def fetch_shared(session, url, headers=None, timeout=30, hedge=False, until=None,
+                       max_bytes=MAX_BODY_BYTES):
+    """``fetch_text`` for GETs that other callers may be making too.
+
+    Calls with the same URL, headers and ``until`` share one request while
+    it is in flight, and reuse its result for MEMO_TTL seconds if it
+    succeeded.
+    """
+    key = (url, tuple(sorted((headers or {}).items())), getattr(until, "pattern", None))
+    memo = _memo.get(key)
+    if memo and memo[0] > time.monotonic():
+        limiter(url).shared += 1
+        return memo[1]
+
+    flight = _flights.get(key)
+    if flight is None:
+        flight = asyncio.ensure_future(
+            fetch_text(session, url, headers, timeout, hedge, until, max_bytes)
+        )
+        _flights[key] = flight
+        flight.add_done_callback(lambda f: _landed(key, f))
+    else:
+        limiter(url).shared += 1
+    # A cancelled caller must not cancel the request for the others.
+    return await asyncio.shield(flight)
+
+# ================= METRICS =================
+
+def metrics():
+    with _registry_lock:
+        return {host: lim.metrics() for host, lim in sorted(_limiters.items())}
+
+
+def merge(*snapshots):
+    """Combine per-host metrics from several processes."""
+    merged = {}
+    for snapshot in snapshots:
+        for host, m in (snapshot or {}).items():
+            if host not in merged:
+                merged[host] = dict(m)
+                continue
+            acc = merged[host]
+            for k in ("requests", "errors", "cuts", "hedges", "hedge_wins", "shared"):
+                acc[k] += m.get(k, 0)
+            acc["peak"] = max(acc["peak"], m["peak"])
+            acc["low"] = min(acc["low"], m["low"])
+            acc["limit"] = m["limit"]
+    return merged
+
+
+def report(snapshot=None):
+    snapshot = metrics() if snapshot is None else snapshot
+    if not snapshot:
+        return
+    log("")
+    log(f"{'HOST':<32} {'LIMIT':>5} {'LOW':>5} {'PEAK':>5} {'REQS':>5} "
+        f"{'ERRS':>5} {'CUTS':>4} {'HEDGED':>7} {'SHARED':>6} {'LAT ms':>7}")
+    for host, m in snapshot.items():
+        latency = m["latency_ms"] if m["latency_ms"] is not None else "-"
+        hedged = f"{m.get('hedge_wins', 0)}/{m.get('hedges', 0)}"
+        log(f"{host[:32]:<32} {m['limit']:>5.1f} {m['low']:>5.1f} {m['peak']:>5.1f} "
+            f"{m['requests']:>5} {m['errors']:>5} {m['cuts']:>4} {hedged:>7} "
+            f"{m.get('shared', 0):>6} {latency:>7}")
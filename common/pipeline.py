@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Staged async pipeline: discover -> fetch -> extract -> verify -> emit.
+
+A pipeline is a source (async or plain iterable of items) followed by
+stages. Stages are connected by bounded asyncio queues, so a slow stage
+pushes back on the ones before it. Each stage runs ``concurrency`` workers
+and items flow on as soon as they are ready, e.g. extraction starts while
+discovery is still paging. A stage returns the (possibly updated) item to
+pass it on, or None to drop it. Exceptions drop the item and are counted.
+Cancelling the pipeline cancels every stage.
+
+Stages catch their own errors, so only discovery can fail a pipeline: its
+exception is raised from ``run`` as is, not wrapped in an exception group.
+
+Pipelines run against the source's run deadline (common.deadline). Stages
+created with ``budget=(floor, cap)`` get a share of the time left per item,
+items are skipped once less than ``floor`` remains, and when the deadline
+is reached stragglers are cancelled and whatever was emitted is returned.
+
+A stage with a ``gate`` (e.g. a browser pool) holds one of the gate's slots
+around each call. ``concurrency`` is then only an upper bound, and budgets
+are shared out over the gate's current ``limit``.
+"""
+
+import asyncio
+import contextlib
+import inspect
+import time
+
+from common import deadline as run_deadline
+
+# ================= CONFIG =================
+
+QUEUE_SIZE = 16
+
+# Seconds a budgeted stage may overrun its budget before it is cancelled.
+BUDGET_GRACE = 10
+
+_DONE = object()
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def _unwrap(group):
+    """The first exception a task group failed with."""
+    while isinstance(group, BaseExceptionGroup):
+        group = group.exceptions[0]
+    return group
+
+# ================= STAGES =================
+
+class Stage:
+    def __init__(self, name, func, concurrency=1, timeout=None, blocking=False,
+                 budget=None, gate=None):
+        """``func(item)`` may be async, cheap and synchronous, or blocking
+        (``blocking=True`` runs it in a thread). With ``budget=(floor, cap)``
+        it is called as ``func(item, budget)`` and bounded by that budget.
+        ``gate.slot()`` is held around each call when given."""
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.blocking = blocking
+        self.budget = budget
+        self.gate = gate
+        self.seen = 0
+        self.passed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    async def call(self, item, budget=None):
+        args = (item,) if budget is None else (item, budget)
+        timeout = self.timeout
+        if budget is not None:
+            # A little slack so the stage can wind down on its own first.
+            timeout = min(timeout or budget + BUDGET_GRACE, budget + BUDGET_GRACE)
+        if self.blocking:
+            call = asyncio.to_thread(self.func, *args)
+        else:
+            call = self.func(*args)
+        if not inspect.isawaitable(call):
+            # Cheap synchronous stage, already done.
+            return call
+        if timeout:
+            async with asyncio.timeout(timeout):
+                return await call
+        return await call
+
+    def share(self, pipeline):
+        """Per-item budget from the time left, or None to skip the item."""
+        floor, cap = self.budget
+        # Items still to pass this stage, including the current one.
+        pending = pipeline.discovered - self.seen + 1
+        workers = self.concurrency
+        if self.gate is not None:
+            workers = min(workers, self.gate.limit)
+        return pipeline.deadline.share(pending, workers, floor, cap)
+
+    def admit(self):
+        return self.gate.slot() if self.gate is not None else contextlib.nullcontext()
+
+    async def worker(self, pipeline, inbox, outbox):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # Let sibling workers see the sentinel too.
+                await inbox.put(_DONE)
+                return
+            self.seen += 1
+            async with self.admit():
+                # Budgets start once the item holds its slot.
+                budget = None
+                if self.budget:
+                    budget = self.share(pipeline)
+                    if budget is None:
+                        self.skipped += 1
+                        continue
+                t0 = time.monotonic()
+                try:
+                    result = await self.call(item, budget)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    self.errors += 1
+                    log(f"[{self.name}] {type(exc).__name__}: {str(exc)[:150]}")
+                    result = None
+                finally:
+                    self.busy += time.monotonic() - t0
+            if result is not None:
+                self.passed += 1
+                await outbox.put(result)
+
+# ================= PIPELINE =================
+
+class Pipeline:
+    def __init__(self, name, source, stages, queue_size=QUEUE_SIZE, deadline=None):
+        self.name = name
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.deadline = deadline or run_deadline.current()
+        self.discovered = 0
+        self.results = []
+        self.cut_short = False
+
+    @property
+    def complete(self):
+        """False when the deadline cut the run short or items were skipped."""
+        return not self.cut_short and not any(s.skipped for s in self.stages)
+
+    async def _discover(self, outbox):
+        source = self.source() if callable(self.source) else self.source
+        if inspect.isawaitable(source):
+            source = await source
+        if hasattr(source, "__aiter__"):
+            async for item in source:
+                self.discovered += 1
+                await outbox.put(item)
+        else:
+            for item in source or []:
+                self.discovered += 1
+                await outbox.put(item)
+        await outbox.put(_DONE)
+
+    async def _stage(self, stage, inbox, outbox):
+        stage.started = time.monotonic()
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(stage.concurrency):
+                tg.create_task(stage.worker(self, inbox, outbox))
+        stage.finished = time.monotonic()
+        await outbox.put(_DONE)
+
+    async def _collect(self, inbox):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                return
+            self.results.append(item)
+
+    async def run(self):
+        """Run until done or the deadline; returns the items that left the
+        last stage."""
+        queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(self.deadline.remaining()):
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(self._discover(queues[0]))
+                    for i, stage in enumerate(self.stages):
+                        tg.create_task(self._stage(stage, queues[i], queues[i + 1]))
+                    tg.create_task(self._collect(queues[-1]))
+        except TimeoutError:
+            # Quorum publish: keep whatever made it through.
+            self.cut_short = True
+            log(f"[{self.name}] run deadline reached, stopping with "
+                f"{len(self.results)} results")
+        except BaseExceptionGroup as group:
+            # Discovery failed (e.g. the listing could not be fetched).
+            raise _unwrap(group) from None
+        finally:
+            self.report(time.monotonic() - started)
+        return self.results
+
+    def report(self, elapsed):
+        log(f"\n[{self.name}] pipeline: {self.discovered} discovered, "
+            f"{len(self.results)} emitted in {elapsed:.1f}s")
+        log(f"  {'STAGE':<10} {'WORKERS':>7} {'IN':>5} {'OUT':>5} {'ERR':>4} "
+            f"{'SKIP':>4} {'BUSY s':>8} {'WALL s':>8}")
+        for s in self.stages:
+            wall = (s.finished or time.monotonic()) - s.started if s.started else 0.0
+            log(f"  {s.name:<10} {s.concurrency:>7} {s.seen:>5} {s.passed:>5} "
+                f"{s.errors:>4} {s.skipped:>4} {s.busy:>8.1f} {wall:>8.1f}")
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Canonical M3U rendering with semantic no-change detection.
+
+Every scraper hands its entries to ``write_playlist``. Entries are put in a
+stable order and compared against the playlist already on disk while
+ignoring volatile fields (rotating tokens, channel numbers). When nothing
+meaningful changed the file is left untouched, so the workflows have
+nothing to commit.
+"""
+
+import contextvars
+import os
+import re
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from common.state import atomic_write, record_output
+
+# ================= CONFIG =================
+
+# Query parameters that rotate between runs without the stream changing.
+# Override with a comma separated list in PLAYLIST_VOLATILE_PARAMS.
+VOLATILE_PARAMS = {
+    p.strip().lower()
+    for p in os.environ.get(
+        "PLAYLIST_VOLATILE_PARAMS",
+        "token,md5,expires,exp,e,st,ts,ip,hash,sig,signature,wmsauthsign",
+    ).split(",")
+    if p.strip()
+}
+
+# EXTINF attributes that are renumbered or regenerated on every run.
+VOLATILE_ATTRS = {"tvg-chno"}
+
+# Parameters carrying a unix expiry. A playlist whose tokens expire before
+# the source's next run is due (see expiry_margin) is rewritten even if
+# nothing else changed.
+EXPIRY_PARAMS = ("expires", "exp")
+# Parameters whose value embeds the expiry among dash-separated fields,
+# e.g. token=<hash>-<n>-<expiry>-<start> (multisports).
+EMBEDDED_EXPIRY_PARAMS = ("token",)
+# Unix timestamps: ten digits (2001-2286).
+TIMESTAMP = re.compile(r"^\d{10}$")
+
+# Seconds between a source's runs: the orchestrator sets each source's
+# ``every``; standalone runs read RUN_INTERVAL (default: the 30 minute cron).
+RUN_INTERVAL = int(os.environ.get("RUN_INTERVAL", 30 * 60))
+# How late the next run may start (cron drift plus the run's own length).
+RUN_SLACK = 15 * 60
+
+_interval = contextvars.ContextVar("run_interval", default=RUN_INTERVAL)
+
+# ================= PARSING =================
+
+def parse(text):
+    """Split playlist text into header lines and entry blocks.
+
+    A block starts at ``#EXTINF`` and ends with the first non-comment line
+    (the stream URL). Comment lines found before a block belong to it.
+    """
+    header = []
+    entries = []
+    block = []
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXTM3U"):
+            header.append(line)
+            continue
+        block.append(line)
+        if not line.startswith("#") and any(
+            l.startswith("#EXTINF") for l in block
+        ):
+            entries.append(block)
+            block = []
+
+    if block:
+        header.extend(block)
+
+    return header, entries
+
+
+def _extinf(entry):
+    for line in entry:
+        if line.startswith("#EXTINF"):
+            return line
+    return ""
+
+
+def _url(entry):
+    return entry[-1] if entry else ""
+
+
+def attr(entry, name):
+    m = re.search(rf'{re.escape(name)}="([^"]*)"', _extinf(entry))
+    return m.group(1) if m else ""
+
+
+def display_name(entry):
+    """Title after the attribute list of the EXTINF line."""
+    line = _extinf(entry)
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            return line[i + 1:].strip()
+    return ""
+
+# ================= NORMALIZATION =================
+
+def strip_volatile_url(url):
+    base, sep, opts = url.partition("|")
+    parts = urlsplit(base)
+    if parts.query:
+        query = [
+            (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+            if k.lower() not in VOLATILE_PARAMS
+        ]
+        base = urlunsplit(parts._replace(query=urlencode(query)))
+    return base + sep + opts
+
+
+def strip_volatile_extinf(line):
+    for name in VOLATILE_ATTRS:
+        line = re.sub(rf'\s*{re.escape(name)}="[^"]*"', "", line)
+    return line
+
+
+def entry_key(entry):
+    """Entry identity with volatile fields removed."""
+    out = []
+    for line in entry:
+        if line.startswith("#EXTINF"):
+            out.append(strip_volatile_extinf(line))
+        elif line.startswith("#"):
+            out.append(line)
+        else:
+            out.append(strip_volatile_url(line))
+    return tuple(out)
+
+
+def sort_key(entry):
+    return (
+        attr(entry, "group-title").lower(),
+        display_name(entry).lower(),
+        entry_key(entry),
+    )
+
+
+def name_key(entry):
+    """Order by title only, for playlists whose titles lead with kickoff time."""
+    return (display_name(entry).lower(), entry_key(entry))
+
+
+def canonical_order(entries, key=None):
+    """Stable ordering independent of discovery order."""
+    return sorted(entries, key=key or sort_key)
+
+
+def url_expiry(url):
+    """Expiry timestamp carried in a stream URL's query, or None."""
+    query = urlsplit(url.partition("|")[0]).query
+    for k, v in parse_qsl(query):
+        if k.lower() in EXPIRY_PARAMS and v.isdigit():
+            return int(v)
+        if k.lower() in EMBEDDED_EXPIRY_PARAMS:
+            # The latest timestamp is the expiry; any other is the start.
+            stamps = [int(f) for f in v.split("-") if TIMESTAMP.match(f)]
+            if stamps:
+                return max(stamps)
+    return None
+
+
+def schedule(seconds):
+    """Set the interval to the next run for the current task and the tasks
+    it spawns."""
+    _interval.set(seconds)
+
+
+def expiry_margin():
+    """Seconds a token must still be valid for to be published: it has to
+    outlive the wait for the next run, which replaces it."""
+    return _interval.get() + RUN_SLACK
+
+
+def expires_soon(entries, now=None, margin=None):
+    now = now or time.time()
+    margin = expiry_margin() if margin is None else margin
+    for entry in entries:
+        expiry = url_expiry(_url(entry))
+        if expiry is not None and expiry < now + margin:
+            return True
+    return False
+
+
+def same_entries(old, new):
+    """True when both playlists carry the same entries, ignoring order and
+    volatile fields."""
+    old_header, old_entries = old
+    new_header, new_entries = new
+    if old_header != new_header:
+        return False
+    return sorted(map(entry_key, old_entries)) == sorted(map(entry_key, new_entries))
+
+# ================= WRITING =================
+
+def render(entries, header=("#EXTM3U",)):
+    lines = list(header)
+    for entry in entries:
+        lines.extend(entry)
+    return "\n".join(lines) + "\n"
+
+
+def write_playlist(path, entries, header=("#EXTM3U",), key=None):
+    """Write ``entries`` to ``path`` in canonical order.
+
+    Returns False (and leaves the file alone) when the existing playlist
+    already holds the same entries.
+    """
+    header = list(header)
+    entries = canonical_order(entries, key)
+
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                old = parse(f.read())
+        except OSError:
+            old = None
+        if old and same_entries(old, (header, entries)) and not expires_soon(old[1]):
+            print(f"{path}: no semantic changes, skipping write", flush=True)
+            return False
+
+    atomic_write(path, render(entries, header))
+    record_output(path)
+    return True
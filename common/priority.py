@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Kickoff-time priority for event resolution.
+
+Browser time per run is limited, so events are resolved in the order people
+are about to watch them: live now, starting soon, later today, tomorrow.
+Events kicking off beyond the horizon are deferred; a later run picks them
+up once they are close. Events without a known kickoff go after the ones
+starting soon and are never deferred.
+"""
+
+import os
+import time
+from datetime import datetime
+
+# ================= CONFIG =================
+
+LIVE_WINDOW = 3 * 60 * 60  # a match that started this long ago may still be on
+SOON_WINDOW = 60 * 60
+HORIZON = float(os.environ.get("EVENT_HORIZON_HOURS", 8)) * 60 * 60
+
+LIVE, SOON, TODAY, TOMORROW, ENDED = range(5)
+TIER_NAMES = ("live", "soon", "today", "tomorrow", "ended")
+
+# ================= PRIORITY =================
+
+def kickoff_ts(value):
+    """Epoch seconds from a datetime (naive = local time) or a number."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def roll_forward(kickoff, now=None):
+    """For clock-only kickoffs (today's date assumed): a time well in the
+    past is tomorrow's match."""
+    now = now or time.time()
+    if kickoff is not None and kickoff < now - LIVE_WINDOW:
+        return kickoff + 24 * 60 * 60
+    return kickoff
+
+
+def priority(kickoff, now=None):
+    """Sort key ``(tier, order)`` for an event kicking off at ``kickoff``."""
+    now = now or time.time()
+    if kickoff is None:
+        return (TODAY, HORIZON)
+    delta = kickoff - now
+    if delta <= 0:
+        if -delta <= LIVE_WINDOW:
+            # Most recently started first: it has the most left to watch.
+            return (LIVE, -delta)
+        return (ENDED, -delta)
+    if delta <= SOON_WINDOW:
+        return (SOON, delta)
+    today = datetime.fromtimestamp(now).date()
+    if datetime.fromtimestamp(kickoff).date() == today:
+        return (TODAY, delta)
+    return (TOMORROW, delta)
+
+
+def schedule(events, kickoff, now=None, horizon=HORIZON):
+    """Order ``events`` for resolution; returns ``(ordered, deferred)``.
+
+    ``kickoff(event)`` returns the event's kickoff (see ``kickoff_ts``) or
+    None when unknown.
+    """
+    now = now or time.time()
+    ordered = []
+    deferred = []
+    for event in events:
+        ts = kickoff_ts(kickoff(event))
+        if ts is not None and ts - now > horizon:
+            deferred.append(event)
+        else:
+            ordered.append((priority(ts, now), event))
+    ordered.sort(key=lambda pair: pair[0])
+
+    tiers = {}
+    for (tier, _), _ in ordered:
+        tiers[TIER_NAMES[tier]] = tiers.get(TIER_NAMES[tier], 0) + 1
+    summary = ", ".join(f"{n} {name}" for name, n in tiers.items()) or "none"
+    print(f"Schedule: {summary}; {len(deferred)} deferred beyond "
+          f"{horizon / 3600:.0f}h", flush=True)
+
+    return [event for _, event in ordered], deferred
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Publish every playlist written in this cycle as one commit and one push.
+
+Scrapers record their outputs through ``common.playlist.write_playlist``.
+This stage stages those files, makes a single commit and pushes it,
+rebasing and retrying when the branch moved underneath us.
+
+Usage: python -m common.publish [--message MSG] [--dry-run]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from common.state import OUTPUTS_FILE, ROOT_DIR, load_json, save_json
+
+# ================= CONFIG =================
+
+REMOTE = "origin"
+PUSH_ATTEMPTS = 5
+RETRY_DELAY = 5  # seconds, doubled after each rejected push
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def git(*args, check=True):
+    return subprocess.run(
+        ["git", *args],
+        cwd=ROOT_DIR,
+        check=check,
+        capture_output=True,
+        text=True,
+    )
+
+
+def current_branch():
+    return git("rev-parse", "--abbrev-ref", "HEAD").stdout.strip()
+
+
+def changed_outputs():
+    """Recorded outputs that differ from HEAD."""
+    outputs = load_json(OUTPUTS_FILE, [])
+    if not outputs:
+        return []
+    status = git("status", "--porcelain", "--", *outputs).stdout
+    return sorted(line[3:].strip() for line in status.splitlines() if line)
+
+# ================= PUBLISH =================
+
+def push(branch, attempts=PUSH_ATTEMPTS):
+    delay = RETRY_DELAY
+    for attempt in range(1, attempts + 1):
+        result = git("push", REMOTE, f"HEAD:{branch}", check=False)
+        if result.returncode == 0:
+            return True
+
+        log(f"Push rejected (attempt {attempt}/{attempts}): {result.stderr.strip()[:200]}")
+        if attempt == attempts:
+            break
+
+        time.sleep(delay)
+        delay *= 2
+
+        # Our freshly generated files win over whatever landed meanwhile.
+        rebase = git(
+            "pull", "--rebase", "--autostash", "-X", "theirs", REMOTE, branch,
+            check=False,
+        )
+        if rebase.returncode != 0:
+            log(f"Rebase failed: {rebase.stderr.strip()[:200]}")
+            git("rebase", "--abort", check=False)
+            return False
+    return False
+
+
+def publish(message=None, dry_run=False):
+    """Commit and push all outputs written this cycle. Returns True when
+    there was nothing to do or the push succeeded."""
+    paths = changed_outputs()
+    if not paths:
+        log("No changes to commit")
+        save_json(OUTPUTS_FILE, [])
+        return True
+
+    log("Publishing:")
+    for path in paths:
+        log(f"  {path}")
+
+    if dry_run:
+        return True
+
+    stamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    message = message or f"Update playlists {stamp}"
+    body = "\n".join(paths)
+
+    git("add", "--", *paths)
+    git("commit", "-m", message, "-m", body)
+
+    branch = current_branch()
+    if not push(branch):
+        log("✗ Push failed")
+        return False
+
+    save_json(OUTPUTS_FILE, [])
+    log(f"✓ Pushed {len(paths)} files to {branch}")
+    return True
+
+# ================= MAIN =================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--message", "-m")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if not publish(args.message, args.dry_run):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
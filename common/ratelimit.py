@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Per-host request budgets shared by every scraper process on this machine.
+
+Sources running side by side from one IP look like one client to an
+upstream, so each host's budget is enforced across processes: a token
+bucket (``rate`` requests per second, bursts up to ``burst``) and a cap on
+requests in flight, kept in ``rate-<host>.json`` under the run directory
+(common.state.RUN_DIR, not the persisted cache, since the in-flight pids
+only mean something on this machine) and updated under a file lock. For
+async callers the lock and file I/O run on a small executor of their own,
+so they never queue behind a source's blocking work on the default one
+(strmfree's extraction threads, for instance). The in-process AIMD
+limiter (common.net) still decides how much of that budget one process
+uses.
+
+Budgets default to RATE_PER_HOST / RATE_MAX_INFLIGHT and can be set per
+host with RATE_LIMITS="host=rate[/inflight],...".
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+from common.state import load_json, locked, run_path, save_json
+
+# ================= CONFIG =================
+
+RATE_PER_HOST = float(os.environ.get("RATE_PER_HOST", 5))  # requests per second
+MAX_INFLIGHT = int(os.environ.get("RATE_MAX_INFLIGHT", 16))
+BURST_SECONDS = 2  # a bucket holds this many seconds' worth of requests
+if RATE_PER_HOST <= 0 or MAX_INFLIGHT < 1:
+    raise ValueError("RATE_PER_HOST and RATE_MAX_INFLIGHT must be positive")
+
+MAX_WAIT_STEP = 1.0  # seconds; re-check at least this often while waiting
+BUSY_POLL = 0.1  # seconds between checks while the in-flight cap is reached
+
+IO_THREADS = 4  # threads for async callers' bucket updates
+
+
+def _parse_budgets(spec):
+    budgets = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        host, _, value = item.partition("=")
+        rate, _, inflight = value.partition("/")
+        try:
+            rate = float(rate)
+            inflight = int(inflight) if inflight else MAX_INFLIGHT
+            if rate <= 0 or inflight < 1:
+                raise ValueError
+        except ValueError:
+            print(f"[ratelimit] ignoring bad budget {item!r}", flush=True)
+            continue
+        budgets[host.strip().lower()] = (rate, inflight)
+    return budgets
+
+
+HOST_BUDGETS = _parse_budgets(os.environ.get("RATE_LIMITS", ""))
+
+_io = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="ratelimit")
+
+# ================= HELPERS =================
+
+def host_of(url):
+    return (urlsplit(url).hostname or url).lower()
+
+
+def budget(host):
+    """``(rate, burst, inflight)`` for ``host``."""
+    rate, inflight = HOST_BUDGETS.get(host, (RATE_PER_HOST, MAX_INFLIGHT))
+    return rate, max(1.0, rate * BURST_SECONDS), inflight
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+# ================= BUCKETS =================
+
+def _take(host):
+    """Take a request slot for ``host``; returns 0, or seconds to wait."""
+    rate, burst, cap = budget(host)
+    name = f"rate-{host}"
+    me = str(os.getpid())
+    now = time.time()
+    with locked(name, run_path):
+        state = load_json(f"{name}.json", where=run_path) or {
+            "tokens": burst, "updated": now, "inflight": {},
+        }
+        tokens = min(burst, state["tokens"] + max(0.0, now - state["updated"]) * rate)
+        # Slots held by processes that died without releasing them are freed.
+        inflight = {
+            pid: n for pid, n in state["inflight"].items()
+            if n > 0 and (pid == me or _alive(int(pid)))
+        }
+        wait = 0.0
+        if sum(inflight.values()) >= cap:
+            wait = BUSY_POLL
+        elif tokens < 1:
+            wait = (1 - tokens) / rate
+        else:
+            tokens -= 1
+            inflight[me] = inflight.get(me, 0) + 1
+        save_json(f"{name}.json", {"tokens": tokens, "updated": now, "inflight": inflight},
+                  where=run_path)
+    return wait
+
+
+def release(url):
+    host = host_of(url)
+    name = f"rate-{host}"
+    me = str(os.getpid())
+    with locked(name, run_path):
+        state = load_json(f"{name}.json", where=run_path)
+        if not state or not state["inflight"].get(me):
+            return
+        state["inflight"][me] -= 1
+        save_json(f"{name}.json", state, where=run_path)
+
+
+def release_nowait(url):
+    """``release`` in a thread; runs even if the caller is being cancelled."""
+    asyncio.get_running_loop().run_in_executor(_io, release, url)
+
+
+async def acquire(url):
+    host = host_of(url)
+    loop = asyncio.get_running_loop()
+    while True:
+        take = loop.run_in_executor(_io, _take, host)
+        try:
+            wait = await asyncio.shield(take)
+        except asyncio.CancelledError:
+            # The take still lands in its thread; give back what it got.
+            def give_back(t):
+                if not t.cancelled() and t.exception() is None and not t.result():
+                    release_nowait(url)
+            take.add_done_callback(give_back)
+            raise
+        if not wait:
+            return
+        await asyncio.sleep(min(wait, MAX_WAIT_STEP))
+
+
+def acquire_sync(url):
+    host = host_of(url)
+    while True:
+        wait = _take(host)
+        if not wait:
+            return
+        time.sleep(min(wait, MAX_WAIT_STEP))
+
+
+@asynccontextmanager
+async def slot(url):
+    """Hold one of ``url``'s host budget slots, e.g. around a page load."""
+    await acquire(url)
+    try:
+        yield
+    finally:
+        release_nowait(url)
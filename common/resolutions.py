@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Stream resolutions shared by every source.
+
+Several sources embed the same player (apptv and istreameast both serve
+gooz.aapmains.net iframes). A stream resolved from a player URL is stored
+in ``.cache/resolutions.json`` under the canonical form of that URL, so
+another source, in this process or another worker, reuses it instead of
+repeating the fetch chain. Entries last until the stream's token expires,
+or RESOLUTION_TTL seconds (about one cycle) when it carries no expiry.
+"""
+
+import os
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from common.playlist import expiry_margin, url_expiry
+from common.state import load_json, locked, save_json, state_path
+
+# ================= CONFIG =================
+
+RESOLUTIONS_FILE = "resolutions.json"
+RESOLUTION_TTL = int(os.environ.get("RESOLUTION_TTL_MINUTES", 20)) * 60
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def canonical(url):
+    """Player URL with case, default port, fragment and query order
+    normalised, so equal players compare equal across sources."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+# ================= STORE =================
+
+_entries = {}
+_mtime = None
+
+
+def _live(entry, now):
+    # A token expiry needs its margin so the stream is not handed out just
+    # before the upstream rejects it; a TTL-derived one is only a reuse
+    # window and holds until it ends.
+    if url_expiry(entry["stream"]):
+        return entry["expires"] > now + expiry_margin()
+    return entry["expires"] > now
+
+
+def _refresh():
+    """Pick up what other processes stored since the last look."""
+    global _mtime
+    path = state_path(RESOLUTIONS_FILE)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return
+    if mtime != _mtime:
+        _mtime = mtime
+        _entries.update(load_json(RESOLUTIONS_FILE, {}))
+
+
+def lookup(player_url):
+    """Stream resolved from ``player_url`` by any source, or None."""
+    _refresh()
+    entry = _entries.get(canonical(player_url))
+    if entry and _live(entry, time.time()):
+        return entry
+    return None
+
+
+def store(player_url, stream, source):
+    global _mtime
+    now = time.time()
+    entry = {
+        "stream": stream,
+        "source": source,
+        "resolved": now,
+        "expires": url_expiry(stream) or now + RESOLUTION_TTL,
+    }
+    key = canonical(player_url)
+    _entries[key] = entry
+    with locked(RESOLUTIONS_FILE):
+        merged = {
+            k: e for k, e in load_json(RESOLUTIONS_FILE, {}).items()
+            if _live(e, now)
+        }
+        merged[key] = entry
+        save_json(RESOLUTIONS_FILE, merged)
+        _mtime = state_path(RESOLUTIONS_FILE).stat().st_mtime
+    _entries.update(merged)
+
+
+async def resolve(player_url, source, extract, force=False):
+    """Stream for ``player_url``: reused when any source already resolved
+    it, else ``await extract()`` and shared. ``force`` skips reuse, e.g. for
+    a pre-kickoff re-resolve, where the stored stream is the one being
+    replaced."""
+    entry = None if force else lookup(player_url)
+    if entry:
+        log(f"   Reusing stream resolved by {entry['source']}: {player_url[:80]}")
+        return entry["stream"]
+    stream = await extract()
+    if stream and stream.startswith("http"):
+        store(player_url, stream, source)
+    return stream
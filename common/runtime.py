@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Shared resources for scrapers running in one event loop.
+
+A ``Runtime`` lazily creates one aiohttp session, one Playwright driver and
+one browser per engine and set of launch options (with a memory-governed
+page pool), and hands the same objects to every source. Standalone
+scripts create their own Runtime; the orchestrator creates one for all
+sources. Results shared between sources live in common.resolutions, which
+also reaches other worker processes.
+"""
+
+import asyncio
+
+from common import breaker, net, tiered, timeouts
+from common.browser import SERVER_MODE, detach, get_browser, server_key
+from common.browserpool import BrowserPool
+
+# ================= CONFIG =================
+
+# Connection pool shared by all sources.
+HTTP_POOL_SIZE = 50
+HTTP_POOL_PER_HOST = 8
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+# ================= RUNTIME =================
+
+class Runtime:
+    def __init__(self):
+        self._session = None
+        self._playwright = None
+        self._pw_manager = None
+        self._browsers = {}  # by server_key(engine, launch_options)
+        self._launched = {}  # key -> (engine, launch_options)
+        self._pools = {}
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def session(self):
+        """Shared aiohttp session."""
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                import aiohttp
+
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=HTTP_POOL_SIZE,
+                        limit_per_host=HTTP_POOL_PER_HOST,
+                    )
+                )
+            return self._session
+
+    async def playwright(self):
+        """Shared Playwright driver."""
+        async with self._lock:
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+
+                self._pw_manager = async_playwright()
+                self._playwright = await self._pw_manager.start()
+            return self._playwright
+
+    async def browser(self, engine="chromium", **launch_options):
+        """Shared browser for ``engine`` ("chromium" or "firefox") launched
+        with ``launch_options``.
+
+        Callers passing the same options get the same browser and should
+        isolate themselves with their own context; other options get a
+        browser of their own. With BROWSER_SERVER=1 this attaches to a warm
+        browser server. Closing the runtime then only disconnects.
+        """
+        playwright = await self.playwright()
+        key = server_key(engine, launch_options)
+        async with self._lock:
+            browser = self._browsers.get(key)
+            if browser is None or not browser.is_connected():
+                browser = await get_browser(playwright, engine, **launch_options)
+                self._browsers[key] = browser
+                self._launched[key] = (engine, launch_options)
+            return browser
+
+    def pool(self, engine="chromium", **launch_options):
+        """Memory-governed page pool on the shared browser for ``engine``
+        and ``launch_options``.
+
+        Sources open pages through the pool so the number open at once
+        follows free memory; see common.browserpool.
+        """
+        key = server_key(engine, launch_options)
+        if key not in self._pools:
+            self._pools[key] = BrowserPool(self, engine, launch_options)
+        return self._pools[key]
+
+    async def recycle(self, engine, **launch_options):
+        """Close the browser; the next ``browser()`` starts afresh.
+
+        In server mode closing only disconnects, which closes this
+        process's contexts; the server itself is stopped only when no other
+        process is attached to it.
+        """
+        key = server_key(engine, launch_options)
+        async with self._lock:
+            browser = self._browsers.pop(key, None)
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        if SERVER_MODE:
+            stopped = await asyncio.to_thread(
+                detach, engine, launch_options, stop_if_last=True
+            )
+            if not stopped:
+                log(f"[runtime] {key} server still in use by other workers, left running")
+
+    async def close(self):
+        for pool in self._pools.values():
+            pool.report()
+        self._pools = {}
+        # Latencies, breaker states and static hit rates carry over to the
+        # next run.
+        timeouts.save()
+        breaker.save()
+        tiered.save()
+
+        for key, browser in self._browsers.items():
+            try:
+                await browser.close()
+            except Exception:
+                pass
+            if SERVER_MODE:
+                await asyncio.to_thread(detach, *self._launched[key])
+        self._browsers = {}
+
+        if self._pw_manager is not None:
+            try:
+                await self._pw_manager.__aexit__(None, None, None)
+            except Exception:
+                pass
+            self._pw_manager = None
+            self._playwright = None
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def run_standalone(run):
+    """Run a single source's ``run(rt)`` with its own Runtime."""
+    async with Runtime() as rt:
+        try:
+            return await run(rt)
+        finally:
+            net.report()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Location and helpers for state that survives between runs.
+
+State lives under ``.cache/`` in the repository root (override with
+KPR_STATE_DIR). The workflows persist that directory with actions/cache;
+it is never committed. Coordination state that only means something on
+this machine right now (e.g. which pids hold a slot) lives in RUN_DIR
+instead, so it is not restored onto a fresh runner.
+"""
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; locks become no-ops there
+    fcntl = None
+
+# ================= CONFIG =================
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+STATE_DIR = Path(os.environ.get("KPR_STATE_DIR", ROOT_DIR / ".cache"))
+RUN_DIR = Path(os.environ.get("KPR_RUN_DIR", Path(tempfile.gettempdir()) / "kpr-run"))
+
+# Outputs written during this cycle, collected by the publisher.
+OUTPUTS_FILE = "outputs.json"
+
+# When set, outputs are handed to this callable instead of the manifest
+# file; worker processes pass each one to the supervisor as it is written.
+_output_sink = None
+
+# ================= HELPERS =================
+
+def atomic_write(path, text):
+    """Write through a temp file so readers never see a partial file."""
+    path = os.fspath(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def state_path(name):
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    return STATE_DIR / name
+
+
+def run_path(name):
+    RUN_DIR.mkdir(parents=True, exist_ok=True)
+    return RUN_DIR / name
+
+
+def load_json(name, default=None, where=state_path):
+    path = where(name)
+    if not path.exists():
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def save_json(name, data, where=state_path):
+    atomic_write(where(name), json.dumps(data, indent=2, sort_keys=True))
+
+
+@contextmanager
+def locked(name, where=state_path):
+    """Hold an exclusive lock on ``<name>.lock`` across processes, e.g. for
+    a read-merge-write of a state file shared by worker processes."""
+    with open(where(f"{name}.lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def capture_outputs(sink):
+    global _output_sink
+    _output_sink = sink
+
+
+def record_output(path):
+    """Remember a written output so the publisher commits it."""
+    path = os.path.abspath(path)
+    if _output_sink is not None:
+        _output_sink(path)
+        return
+    path = os.path.relpath(path, ROOT_DIR)
+    outputs = load_json(OUTPUTS_FILE, [])
+    if path not in outputs:
+        outputs.append(path)
+        save_json(OUTPUTS_FILE, sorted(outputs))
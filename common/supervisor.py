@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Run each source in its own worker process.
+
+A wedged browser or CPU-heavy parsing in one source can no longer stall
+the others. Workers run the source's ``run(rt)`` in a private event loop
+and send heartbeats from that loop. The supervisor enforces a wall-clock
+limit and an RSS limit per worker, kills and restarts workers whose loop
+stopped beating, and collects outcomes over a pipe. Written outputs are
+sent as each one is recorded, so a killed worker's checkpoints still reach
+the publisher.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from common import deadline, net, playlist
+from common.memory import tree_rss_mb
+from common.runtime import run_standalone
+from common.state import capture_outputs, record_output
+
+# ================= CONFIG =================
+
+MAX_WORKERS = int(os.environ.get("SUPERVISOR_WORKERS", 0)) or os.cpu_count() or 2
+
+DEFAULT_TIMEOUT = 600  # seconds of wall clock per source
+MAX_RSS_MB = int(os.environ.get("SUPERVISOR_MAX_RSS_MB", 1500))
+
+HEARTBEAT_INTERVAL = 5  # seconds
+HANG_TIMEOUT = 90  # seconds without a heartbeat before a worker is killed
+MAX_RESTARTS = 1
+
+POLL_INTERVAL = 0.5
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def _kill_tree(proc):
+    # Workers lead their own process group, which includes any locally
+    # launched browsers (shared browser servers run in a separate session).
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
+    proc.join(5)
+
+# ================= WORKER =================
+
+def _worker(name, seconds, every, conn):
+    os.setsid()
+    deadline.start(seconds)
+    if every:
+        playlist.schedule(every * 60)
+    # Outputs may be recorded from executor threads too.
+    sending = threading.Lock()
+
+    def send(message):
+        with sending:
+            conn.send(message)
+
+    capture_outputs(lambda path: send(("output", path)))
+
+    async def heartbeat():
+        while True:
+            send(("beat", None))
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def run(rt):
+        module = importlib.import_module(name)
+        beat = asyncio.create_task(heartbeat())
+        try:
+            return await module.run(rt)
+        finally:
+            beat.cancel()
+
+    try:
+        count = asyncio.run(run_standalone(run))
+        send(("done", {
+            "status": "ok",
+            "entries": count or 0,
+            "net": net.metrics(),
+        }))
+    except Exception as exc:
+        send(("done", {
+            "status": "failed",
+            "entries": 0,
+            "net": net.metrics(),
+            "detail": f"{type(exc).__name__}: {exc}"[:80],
+        }))
+    finally:
+        conn.close()
+
+# ================= SUPERVISOR =================
+
+class _Slot:
+    def __init__(self, ctx, name, conf):
+        self.name = name
+        self.timeout = conf.get("timeout", DEFAULT_TIMEOUT)
+        self.max_rss = conf.get("max_rss_mb", MAX_RSS_MB)
+        self.every = conf.get("every")  # minutes; None keeps RUN_INTERVAL
+        self.started = time.monotonic()
+        self.restarts = 0
+        self.ctx = ctx
+        self.spawn()
+
+    def spawn(self):
+        parent, child = self.ctx.Pipe(duplex=False)
+        self.conn = parent
+        # A restarted worker only gets the time the source has left.
+        seconds = self.timeout - (time.monotonic() - self.started)
+        self.proc = self.ctx.Process(
+            target=_worker, args=(self.name, seconds, self.every, child), daemon=True
+        )
+        self.proc.start()
+        child.close()
+        self.last_beat = time.monotonic()
+
+    def outcome(self, status, detail="", entries=0, hosts=None):
+        return {
+            "source": self.name,
+            "status": status,
+            "entries": entries,
+            "detail": detail,
+            "seconds": time.monotonic() - self.started,
+            "net": hosts or {},
+        }
+
+    def poll(self):
+        """Return the outcome once the worker is finished, else None."""
+        now = time.monotonic()
+        try:
+            while self.conn.poll():
+                kind, payload = self.conn.recv()
+                self.last_beat = now
+                if kind == "output":
+                    record_output(payload)
+                elif kind == "done":
+                    self.proc.join(5)
+                    return self.outcome(
+                        payload["status"], payload.get("detail", ""), payload["entries"],
+                        payload.get("net"),
+                    )
+        except (EOFError, OSError):
+            self.proc.join(5)
+            return self.outcome("crashed", f"exit code {self.proc.exitcode}")
+
+        if now - self.started > self.timeout:
+            _kill_tree(self.proc)
+            return self.outcome("timeout", f"killed after {self.timeout}s")
+
+        reason = None
+        if now - self.last_beat > HANG_TIMEOUT:
+            reason = f"no heartbeat for {HANG_TIMEOUT}s"
+        else:
+            rss = tree_rss_mb(self.proc.pid)
+            if rss > self.max_rss:
+                reason = f"RSS {rss:.0f}MB > {self.max_rss}MB"
+
+        if reason:
+            _kill_tree(self.proc)
+            if self.restarts >= MAX_RESTARTS:
+                return self.outcome("killed", reason)
+            self.restarts += 1
+            log(f"[supervisor] {self.name}: {reason}, restarting ({self.restarts}/{MAX_RESTARTS})")
+            self.spawn()
+        return None
+
+
+def supervise(sources, workers=MAX_WORKERS):
+    """Run ``[(name, conf), ...]`` in worker processes; returns outcomes."""
+    ctx = multiprocessing.get_context("spawn")
+    queue = list(sources)
+    running = []
+    outcomes = []
+
+    log(f"[supervisor] {len(queue)} sources on {workers} worker processes")
+
+    while queue or running:
+        while queue and len(running) < workers:
+            name, conf = queue.pop(0)
+            running.append(_Slot(ctx, name, conf))
+
+        for slot in list(running):
+            outcome = slot.poll()
+            if outcome:
+                running.remove(slot)
+                outcomes.append(outcome)
+                log(f"[supervisor] {slot.name}: {outcome['status']}")
+
+        time.sleep(POLL_INTERVAL)
+
+    return outcomes
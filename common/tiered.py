@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Static-first, browser-fallback stream resolution for player pages.
+
+The static tier resolves a player with plain HTTP and pattern matching.
+Only when it finds nothing is the player loaded in a headless browser (the
+browser tier), which captures the m3u8 the player itself requests. The
+browser comes from the runtime's chromium pool for LAUNCH_OPTIONS and is
+launched on the first fallback, so a run where every static resolution
+succeeds never starts one.
+
+Each player host's static hit rate is kept across runs in
+``.cache/tiers.json``. For a host where the static tier has been
+unreliable both tiers start together and race; the first stream wins.
+Either way a resolution gives up after TIER_DEADLINE seconds.
+"""
+
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+from common import breaker, ratelimit, timeouts
+from common.state import load_json, locked, save_json
+
+# ================= CONFIG =================
+
+TIERS_FILE = "tiers.json"
+
+ENGINE = "chromium"
+# Players must start without a gesture for their m3u8 request to show up.
+LAUNCH_OPTIONS = {"args": ["--autoplay-policy=no-user-gesture-required", "--mute-audio"]}
+TIER_DEADLINE = 45  # seconds per resolution, both tiers included
+CAPTURE_WAIT = 15  # seconds to wait for the player's m3u8 after loading
+
+# Below this static hit rate, a host's resolutions race both tiers.
+STATIC_RELIABLE = 0.6
+MIN_ATTEMPTS = 5  # static attempts before the hit rate is trusted
+HISTORY_WEIGHT = 50  # counts are scaled down to this so recent runs dominate
+
+AD_HOSTS = ("google", "doubleclick", "facebook", "analytics", "gstatic")
+
+# ================= HELPERS =================
+
+def log(msg):
+    print(msg, flush=True)
+
+
+def host_of(url):
+    return (urlsplit(url).hostname or url).lower()
+
+# ================= HISTORY =================
+
+_lock = threading.Lock()
+_history = None
+_delta = {}  # this run's static attempts, merged into the file on save
+
+
+def _load():
+    global _history
+    if _history is None:
+        _history = load_json(TIERS_FILE, {})
+    return _history
+
+
+def record(host, hit):
+    """Count one static-tier attempt for ``host``."""
+    with _lock:
+        _load()
+        for table in (_history, _delta):
+            stats = table.setdefault(host, {"attempts": 0, "hits": 0})
+            stats["attempts"] += 1
+            stats["hits"] += bool(hit)
+
+
+def static_reliable(host):
+    """Whether the static tier alone is worth trying first for ``host``."""
+    with _lock:
+        stats = _load().get(host)
+    if not stats or stats["attempts"] < MIN_ATTEMPTS:
+        return True
+    return stats["hits"] / stats["attempts"] >= STATIC_RELIABLE
+
+
+def save():
+    """Merge this run's static attempts into the persisted hit rates."""
+    global _delta
+    with _lock:
+        if not _delta:
+            return
+        with locked(TIERS_FILE):
+            merged = load_json(TIERS_FILE, {})
+            for host, new in _delta.items():
+                stats = merged.setdefault(host, {"attempts": 0, "hits": 0})
+                stats["attempts"] += new["attempts"]
+                stats["hits"] += new["hits"]
+                if stats["attempts"] > HISTORY_WEIGHT:
+                    scale = HISTORY_WEIGHT / stats["attempts"]
+                    stats["attempts"] = HISTORY_WEIGHT
+                    stats["hits"] = round(stats["hits"] * scale)
+            save_json(TIERS_FILE, merged)
+        _delta = {}
+
+# ================= TIERS =================
+
+async def static_tier(player_url, static):
+    """``await static()``, counted towards the host's hit rate."""
+    try:
+        stream = await static()
+    except Exception as e:
+        log(f"   Static tier error: {str(e)[:100]}")
+        stream = None
+    if stream and not stream.startswith("http"):
+        stream = None
+    record(host_of(player_url), stream)
+    return stream
+
+
+async def browser_tier(rt, player_url, referer=None, user_agent=None):
+    """Load the player in the shared browser and capture its m3u8."""
+    found = asyncio.get_running_loop().create_future()
+
+    def on_request(request):
+        url = request.url
+        if (".m3u8" in url and not found.done()
+                and not any(x in url.lower() for x in AD_HOSTS)):
+            found.set_result(url)
+
+    options = {"ignore_https_errors": True}
+    if user_agent:
+        options["user_agent"] = user_agent
+    async with rt.pool(ENGINE, **LAUNCH_OPTIONS).context(**options) as context:
+        page = await context.new_page()
+        page.on("request", on_request)
+        async with ratelimit.slot(player_url):
+            with breaker.guard(player_url), \
+                    timeouts.phase(player_url, "navigate", 30) as limit:
+                await page.goto(player_url, referer=referer,
+                                wait_until="domcontentloaded", timeout=limit * 1000)
+        # Players that wait for a gesture: start every video.
+        for frame in page.frames:
+            try:
+                await frame.evaluate(
+                    "() => document.querySelectorAll('video').forEach("
+                    "v => { v.muted = true; v.play(); })"
+                )
+            except Exception:
+                pass
+        try:
+            async with asyncio.timeout(CAPTURE_WAIT):
+                return await found
+        except TimeoutError:
+            return None
+
+
+async def _race(player_url, static, browser):
+    """Run both tiers at once; the first stream found wins."""
+    tasks = [
+        asyncio.ensure_future(static_tier(player_url, static)),
+        asyncio.ensure_future(browser()),
+    ]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    log(f"   Browser tier error: {str(task.exception())[:100]}")
+                elif task.result():
+                    return task.result()
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def resolve(rt, player_url, static, referer=None, user_agent=None):
+    """Stream for ``player_url``: ``await static()`` first and the browser
+    only when that finds nothing, or both at once for hosts where the
+    static tier is unreliable. None when neither finds a stream in time."""
+    host = host_of(player_url)
+
+    def browser():
+        return browser_tier(rt, player_url, referer, user_agent)
+
+    try:
+        async with asyncio.timeout(TIER_DEADLINE):
+            if not static_reliable(host):
+                log(f"   Racing static and browser tiers for {host}")
+                return await _race(player_url, static, browser)
+            stream = await static_tier(player_url, static)
+            if stream:
+                return stream
+            log("   Static tier found nothing, loading player in browser")
+            return await browser()
+    except TimeoutError:
+        log(f"   No stream within {TIER_DEADLINE}s: {player_url[:80]}")
+    except Exception as e:
+        log(f"   Browser tier error: {str(e)[:100]}")
+    return None
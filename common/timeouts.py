@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Timeouts learned from each host's latency history.
+
+Requests and page loads are timed per host and phase ("response" = connect
+through response headers, "body" = reading the body, "navigate" = a browser
+page load). The timings go into coarse histograms that are kept across
+runs in ``.cache/latency.json``. A phase's timeout is its p99 latency times
+TIMEOUT_HEADROOM, kept between the phase's floor and ceiling. A host with
+too little history gets the caller's default. A host whose last few
+attempts all timed out gets the floor for a while, so a dead host fails
+fast and is probed again later.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from urllib.error import URLError
+from urllib.parse import urlsplit
+
+from common.state import load_json, locked, save_json
+
+# ================= CONFIG =================
+
+LATENCY_FILE = "latency.json"
+
+# Seconds (floor, ceiling) per phase.
+PHASES = {
+    "response": (3, 30),
+    "body": (3, 30),
+    "navigate": (8, 45),
+}
+
+TIMEOUT_PERCENTILE = 0.99
+TIMEOUT_HEADROOM = 2.0
+MIN_SAMPLES = 20  # successful timings before the history is trusted
+
+DEAD_AFTER = 3  # timeouts in a row without a success
+DEAD_COOLDOWN = 30 * 60  # seconds a dead host stays on the floor
+
+# Histogram upper bounds in seconds; one extra bucket for anything slower.
+BUCKETS = (0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 4, 6, 8, 10, 13, 16,
+           20, 25, 30, 40, 50, 60, 90)
+# Histograms are scaled down to this many samples so recent runs dominate.
+HISTORY_WEIGHT = 200
+
+# ================= HELPERS =================
+
+def host_of(url):
+    return (urlsplit(url).hostname or url).lower()
+
+
+def _blank():
+    return {"hist": [0] * (len(BUCKETS) + 1), "streak": 0, "last_timeout": 0}
+
+
+def _percentile(hist, q):
+    total = sum(hist)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= target:
+            return BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1] * 2
+    return BUCKETS[-1] * 2
+
+
+def timed_out(exc):
+    """True for timeouts from asyncio, sockets, urllib, requests and
+    Playwright."""
+    if isinstance(exc, URLError):
+        exc = exc.reason
+    # Playwright's and requests' timeouts do not derive from the builtin one.
+    return isinstance(exc, TimeoutError) or "Timeout" in type(exc).__name__
+
+# ================= HISTORY =================
+
+_lock = threading.Lock()
+_history = None  # as loaded at the start of the run, plus this run
+_delta = {}  # this run's observations, merged into the file on save
+
+
+def _stats(table, host, phase):
+    return table.setdefault(host, {}).setdefault(phase, _blank())
+
+
+def _load():
+    global _history
+    if _history is None:
+        _history = load_json(LATENCY_FILE, {})
+    return _history
+
+
+def record(url, phase, seconds=None, timeout=False):
+    """Add one timing, or a timeout, for ``url``'s host."""
+    host = host_of(url)
+    with _lock:
+        _load()
+        for table in (_history, _delta):
+            stats = _stats(table, host, phase)
+            if timeout:
+                stats["streak"] += 1
+                stats["last_timeout"] = time.time()
+            else:
+                stats["hist"][bisect.bisect_left(BUCKETS, seconds)] += 1
+                stats["streak"] = 0
+                stats["succeeded"] = True
+
+
+def limit(url, phase, default):
+    """Timeout in seconds for ``phase`` of a request to ``url``."""
+    floor, ceiling = PHASES[phase]
+    with _lock:
+        stats = _load().get(host_of(url), {}).get(phase)
+        if stats is None:
+            return min(default, ceiling)
+        if (stats["streak"] >= DEAD_AFTER
+                and time.time() - stats["last_timeout"] < DEAD_COOLDOWN):
+            return floor
+        if sum(stats["hist"]) < MIN_SAMPLES:
+            return min(default, ceiling)
+        p = _percentile(stats["hist"], TIMEOUT_PERCENTILE)
+    return max(floor, min(ceiling, p * TIMEOUT_HEADROOM))
+
+
+@contextmanager
+def phase(url, name, default):
+    """Time one phase of a request; yields its timeout in seconds.
+
+    The caller applies the timeout. Leaving the block normally records a
+    timing, and a timeout error records a timeout.
+    """
+    started = time.monotonic()
+    try:
+        yield limit(url, name, default)
+    except BaseException as exc:
+        if timed_out(exc):
+            record(url, name, timeout=True)
+        raise
+    record(url, name, time.monotonic() - started)
+
+
+def save():
+    """Merge this run's observations into the persisted history.
+
+    Re-reads the file under its lock first so concurrent worker processes
+    add up rather than overwrite each other.
+    """
+    global _delta
+    with _lock:
+        if not _delta:
+            return
+        with locked(LATENCY_FILE):
+            merged = load_json(LATENCY_FILE, {})
+            for host, phases in _delta.items():
+                for name, new in phases.items():
+                    stats = _stats(merged, host, name)
+                    hist = [a + b for a, b in zip(stats["hist"], new["hist"])]
+                    total = sum(hist)
+                    if total > HISTORY_WEIGHT:
+                        hist = [round(c * HISTORY_WEIGHT / total) for c in hist]
+                    stats["hist"] = hist
+                    if new.get("succeeded"):
+                        stats["streak"] = new["streak"]
+                    else:
+                        stats["streak"] += new["streak"]
+                    stats["last_timeout"] = max(stats["last_timeout"], new["last_timeout"])
+            save_json(LATENCY_FILE, merged)
+        _delta = {}
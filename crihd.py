@@ -1,18 +1,18 @@
 #!/usr/bin/env python3
+import asyncio
 import os
 import sys
-import json
 import requests
 from pathlib import Path
-from urllib.parse import quote
+
+from common import net, timeouts
+from common.playlist import write_playlist
+from common.runtime import run_standalone
 
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
 API_URL = os.getenv("CRICHD_API_URL")
-if not API_URL:
-    print("Missing CRICHD_API_URL secret")
-    sys.exit(1)
 
 OUT_FILE = Path("crihd_tivimate.m3u8")
 
@@ -20,13 +20,15 @@ ENCODED_UA = "VLC%2F3.0.21%20LibVLC%2F3.0.21"
 
 # --------------------------------------------------
 def fetch_api() -> list[dict]:
-    r = requests.get(API_URL, timeout=20)
+    with net.slot_sync(API_URL) as slot, timeouts.phase(API_URL, "response", 20) as limit:
+        r = requests.get(API_URL, timeout=limit)
+        slot.status = r.status_code
     r.raise_for_status()
     return r.json()
 
 # --------------------------------------------------
-def build_playlist(data: list[dict]) -> str:
-    out = ["#EXTM3U"]
+def build_entries(data: list[dict]) -> list[list[str]]:
+    out = []
 
     for ch in data:
         name = ch.get("name")
@@ -39,31 +41,42 @@ def build_playlist(data: list[dict]) -> str:
         if not (name and link):
             continue
 
-        out.append(
+        out.append([
             f'#EXTINF:-1 tvg-id="{cid}" tvg-name="{name}" '
-            f'tvg-logo="{logo}",{name}'
-        )
-
-        out.append(
+            f'tvg-logo="{logo}",{name}',
             f'{link}'
             f'|referer={referer}'
             f'|origin={origin}'
-            f'|user-agent={ENCODED_UA}'
-        )
+            f'|user-agent={ENCODED_UA}',
+        ])
 
-    return "\n".join(out) + "\n"
+    return out
 
 # --------------------------------------------------
-def main():
-    print("📡 Fetching CricHD API...")
-    data = fetch_api()
+async def run(rt) -> int:
+    """Orchestrator entry point"""
+    if not API_URL:
+        raise RuntimeError("Missing CRICHD_API_URL secret")
 
+    # One API call returns every channel ready to use: nothing to fetch
+    # or resolve per entry, so no pipeline.
+    print("📡 Fetching CricHD API...")
+    data = await asyncio.to_thread(fetch_api)
     print(f"📺 Channels found: {len(data)}")
 
-    playlist = build_playlist(data)
-    OUT_FILE.write_text(playlist, encoding="utf-8")
+    entries = build_entries(data)
+    if write_playlist(OUT_FILE, entries):
+        print("Playlist written: crihd_tivimate.m3u8")
+
+    return len(entries)
 
-    print("Playlist written: crihd_tivimate.m3u8")
+# --------------------------------------------------
+def main():
+    try:
+        asyncio.run(run_standalone(run))
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
 
 # --------------------------------------------------
 if __name__ == "__main__":
@@ -2,14 +2,21 @@
 
 import asyncio
 import re
-import json
+import sys
+from datetime import datetime, time as dtime
 from urllib.parse import urljoin, quote_plus
+from zoneinfo import ZoneInfo
 
-from playwright.async_api import (
-    async_playwright,
-    TimeoutError as PlaywrightTimeoutError,
-)
-from selectolax.lexbor import LexborHTMLParser as HTMLParser
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+from common import deadline, ratelimit, timeouts
+from common.jobqueue import IDLE_TIMEOUT, QUEUE_MODE, JobQueue, drain
+from common.journal import Journal
+from common.lifecycle import Lifecycle
+from common.pipeline import Pipeline, Stage
+from common.playlist import write_playlist
+from common.priority import roll_forward, schedule
+from common.runtime import run_standalone
 
 # ============================================================
 # CONFIG
@@ -22,6 +29,9 @@ USER_AGENT = (
 
 HOMEPAGE = "https://mlbwebcast.com/"
 
+# Schedule times on the site are US Eastern.
+SITE_TZ = ZoneInfo("America/New_York")
+
 OUTPUT_VLC = "emelbecast_VLC.m3u8"
 OUTPUT_TIVI = "emelbecast_TiviMate.m3u8"
 
@@ -32,11 +42,14 @@ DEFAULT_LOGO = (
 TVG_ID = "MLB.Baseball.Dummy.us"
 GROUP_TITLE = "MLB TEAM GAME"
 
-# How long to wait for the player to generate/request the stream.
-STREAM_WAIT_SECONDS = 30
+# Time budget per team page, from loading it to capturing the stream. The
+# run deadline is shared out among the pages still to visit, within these
+# bounds.
+MIN_STREAM_WAIT = 15
+MAX_STREAM_WAIT = 60
 
-# Maximum number of concurrent browser pages.
-MAX_CONCURRENT = 2
+# Browser servers the orchestrator starts for this source up front.
+BROWSERS = [("firefox", {})]
 
 # ============================================================
 # LOGGING
@@ -69,6 +82,35 @@ def team_name_from_title(title: str) -> str:
     )
     return clean_text(title)
 
+def parse_kickoff(text: str):
+    """Epoch seconds from a schedule date such as "Apr 5 7:05 PM" (site
+    time, Eastern). Without a date, today's or tomorrow's is assumed."""
+    text = clean_text(text)
+    m = re.search(r"(\d{1,2}):(\d{2})\s*([AaPp]\.?[Mm]\.?)?", text)
+    if not m:
+        return None
+    hour, minute = int(m.group(1)), int(m.group(2))
+    meridiem = (m.group(3) or "").replace(".", "").lower()
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+
+    day = datetime.now(SITE_TZ).date()
+    d = re.search(r"\b([A-Za-z]{3})[a-z]*\.?\s+(\d{1,2})\b", text)
+    if d:
+        try:
+            month = datetime.strptime(d.group(1).title(), "%b").month
+            day = day.replace(month=month, day=int(d.group(2)))
+        except ValueError:
+            d = None
+
+    try:
+        kickoff = datetime.combine(day, dtime(hour, minute), SITE_TZ).timestamp()
+    except ValueError:
+        return None
+    return kickoff if d else roll_forward(kickoff)
+
 def is_m3u8(url: str) -> bool:
     if not url:
         return False
@@ -87,9 +129,8 @@ def clean_m3u8_url(url: str) -> str:
 # HOMEPAGE EVENT DISCOVERY
 # ============================================================
 
-async def fetch_events_via_playwright(playwright):
+async def fetch_events_via_playwright(browser):
     """Discover MLB team/game URLs."""
-    browser = await playwright.firefox.launch(headless=True)
     context = await browser.new_context(
         user_agent=USER_AGENT,
         viewport={"width": 1920, "height": 1080},
@@ -103,7 +144,9 @@ async def fetch_events_via_playwright(playwright):
 
     try:
         try:
-            await page.goto(HOMEPAGE, wait_until="domcontentloaded", timeout=30000)
+            async with ratelimit.slot(HOMEPAGE):
+                with timeouts.phase(HOMEPAGE, "navigate", 30) as limit:
+                    await page.goto(HOMEPAGE, wait_until="domcontentloaded", timeout=limit * 1000)
         except PlaywrightTimeoutError:
             log("Homepage DOM load timed out; continuing...")
 
@@ -149,6 +192,7 @@ async def fetch_events_via_playwright(playwright):
                 "event": team_name,
                 "team": team_name,
                 "logo": logo,
+                "kind": "team",
             }
             team_count += 1
 
@@ -174,14 +218,16 @@ async def fetch_events_via_playwright(playwright):
                 href = urljoin(HOMEPAGE, href)
                 raw_event = await vs_link.inner_text()
 
-                # Remove date
+                # Remove date, keeping it as the kickoff time
                 date_nodes = vs_link.locator("span.mtdate")
                 date_count = await date_nodes.count()
                 event_name = raw_event
+                kickoff = None
                 for d in range(date_count):
                     date_text = await date_nodes.nth(d).inner_text()
                     if date_text:
                         event_name = event_name.replace(date_text, "")
+                        kickoff = kickoff or parse_kickoff(date_text)
 
                 event_name = fix_event(event_name)
                 if not event_name:
@@ -198,12 +244,16 @@ async def fetch_events_via_playwright(playwright):
                 if key in events:
                     events[key]["event"] = event_name
                     events[key]["logo"] = logo
+                    events[key]["kickoff"] = kickoff
+                    events[key]["kind"] = "game"
                 else:
                     events[key] = {
                         "url": href,
                         "event": event_name,
                         "team": event_name,
                         "logo": logo,
+                        "kickoff": kickoff,
+                        "kind": "game",
                     }
                 game_count += 1
             except Exception as exc:
@@ -223,26 +273,74 @@ async def fetch_events_via_playwright(playwright):
             await context.close()
         except Exception:
             pass
-        try:
-            await browser.close()
-        except Exception:
-            pass
 
     return list(events.values())
 
+def _norm(value: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", (value or "").lower()).strip()
+
+def prune_team_pages(events):
+    """Keep one page per game and drop team pages without a game.
+
+    A team page is covered when the team plays in a listed game, which is
+    resolved once through its game row instead of once per team page.
+    Without any game rows (layout change) every team page is kept.
+    """
+    games = []
+    seen = set()
+    for event in events:
+        if event.get("kind") != "game":
+            continue
+        # The same matchup can be listed under both teams' pages.
+        key = (" vs ".join(sorted(map(_norm, event["event"].split(" vs ")))),
+               event.get("kickoff"))
+        if key in seen:
+            continue
+        seen.add(key)
+        games.append(event)
+
+    if not games:
+        log("No game rows found; keeping every team page")
+        return events
+
+    sides = {
+        _norm(side)
+        for game in games
+        for side in game["event"].split(" vs ")
+        if _norm(side)
+    }
+
+    covered = idle = 0
+    for event in events:
+        if event.get("kind") == "game":
+            continue
+        team = _norm(event["team"])
+        if any(side in team or team in side for side in sides):
+            covered += 1
+        else:
+            idle += 1
+
+    log(f"Games: {len(games)}; skipped {covered} team pages covered by a "
+        f"game and {idle} without a game")
+    return games
+
 # ============================================================
 # M3U8 EXTRACTION - FIXED
 # ============================================================
 
 async def capture_m3u8_from_page(
-    playwright,
+    browser,
     event,
-    timeout_seconds=STREAM_WAIT_SECONDS,
+    timeout_seconds=MAX_STREAM_WAIT,
 ):
-    """Capture m3u8 stream URL from team page using the player's API call."""
+    """Capture m3u8 stream URL from team page using the player's API call.
+
+    ``timeout_seconds`` bounds the whole visit, not only the final wait.
+    """
     url = event["url"]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
 
-    browser = await playwright.firefox.launch(headless=True)
     context = await browser.new_context(
         user_agent=USER_AGENT,
         viewport={"width": 1920, "height": 1080},
@@ -291,7 +389,9 @@ async def capture_m3u8_from_page(
 
         # Load the team page
         try:
-            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            async with ratelimit.slot(url):
+                with timeouts.phase(url, "navigate", 30) as limit:
+                    await page.goto(url, wait_until="domcontentloaded", timeout=limit * 1000)
         except PlaywrightTimeoutError:
             log("  Team page DOM load timed out; continuing...")
 
@@ -312,7 +412,9 @@ async def capture_m3u8_from_page(
         if iframe_src and "mlbhd.html" in iframe_src:
             log(f"  Navigating to player iframe: {iframe_src}")
             try:
-                await page.goto(iframe_src, wait_until="domcontentloaded", timeout=15000)
+                async with ratelimit.slot(iframe_src):
+                    with timeouts.phase(iframe_src, "navigate", 15) as limit:
+                        await page.goto(iframe_src, wait_until="domcontentloaded", timeout=limit * 1000)
                 await page.wait_for_timeout(3000)
 
                 # Get the player HTML content
@@ -418,9 +520,10 @@ async def capture_m3u8_from_page(
 
         # If still not captured, monitor for network responses
         if not captured:
-            log(f"  Monitoring for stream (max {timeout_seconds}s)...")
+            wait = max(0, timeout_seconds - (loop.time() - started))
+            log(f"  Monitoring for stream (max {wait:.0f}s)...")
             elapsed = 0
-            while elapsed < timeout_seconds and not captured:
+            while elapsed < wait and not captured:
                 await page.wait_for_timeout(2000)
                 elapsed += 2
 
@@ -447,7 +550,7 @@ async def capture_m3u8_from_page(
                         pass
 
                 if elapsed % 5 == 0:
-                    log(f"  Still waiting... {elapsed}/{timeout_seconds}s")
+                    log(f"  Still waiting... {elapsed}/{wait:.0f}s")
 
     except Exception as exc:
         log(f"  Stream capture error: {str(exc)[:300]}")
@@ -461,10 +564,6 @@ async def capture_m3u8_from_page(
             await context.close()
         except Exception:
             pass
-        try:
-            await browser.close()
-        except Exception:
-            pass
 
     return captured
 
@@ -473,125 +572,237 @@ async def capture_m3u8_from_page(
 # ============================================================
 
 def write_playlists(entries):
-    if not entries:
-        log("No entries to write")
-        return
+    """Write both playlists; no entries writes header-only files."""
+    # Channel numbers follow the canonical (name) order so they stay stable.
+    entries = sorted(
+        entries,
+        key=lambda x: (clean_text(x["event"]).replace(",", "").lower(), x["m3u8"]),
+    )
+
+    def extinf(i, entry):
+        safe_name = clean_text(entry["event"]).replace(",", "")
+        logo = entry.get("logo", DEFAULT_LOGO)
+        return (
+            f'#EXTINF:-1 '
+            f'tvg-chno="{i}" '
+            f'tvg-id="{TVG_ID}" '
+            f'tvg-name="{safe_name}" '
+            f'tvg-logo="{logo}" '
+            f'group-title="{GROUP_TITLE}",'
+            f'{safe_name}'
+        )
 
     # VLC
-    with open(OUTPUT_VLC, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n")
-        for i, entry in enumerate(entries, 1):
-            safe_name = clean_text(entry["event"]).replace(",", "")
-            logo = entry.get("logo", DEFAULT_LOGO)
-            f.write(
-                f'#EXTINF:-1 '
-                f'tvg-chno="{i}" '
-                f'tvg-id="{TVG_ID}" '
-                f'tvg-name="{safe_name}" '
-                f'tvg-logo="{logo}" '
-                f'group-title="{GROUP_TITLE}",'
-                f'{safe_name}\n'
-            )
-            f.write(f"#EXTVLCOPT:http-referrer={HOMEPAGE}\n")
-            f.write(f"#EXTVLCOPT:http-origin={HOMEPAGE}\n")
-            f.write(f"#EXTVLCOPT:http-user-agent={USER_AGENT}\n")
-            f.write(f"{entry['m3u8']}\n\n")
+    vlc = []
+    for i, entry in enumerate(entries, 1):
+        vlc.append([
+            extinf(i, entry),
+            f"#EXTVLCOPT:http-referrer={HOMEPAGE}",
+            f"#EXTVLCOPT:http-origin={HOMEPAGE}",
+            f"#EXTVLCOPT:http-user-agent={USER_AGENT}",
+            entry["m3u8"],
+        ])
 
     # TiviMate
     ua_encoded = quote_plus(USER_AGENT)
-    with open(OUTPUT_TIVI, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n")
-        for i, entry in enumerate(entries, 1):
-            safe_name = clean_text(entry["event"]).replace(",", "")
-            logo = entry.get("logo", DEFAULT_LOGO)
-            f.write(
-                f'#EXTINF:-1 '
-                f'tvg-chno="{i}" '
-                f'tvg-id="{TVG_ID}" '
-                f'tvg-name="{safe_name}" '
-                f'tvg-logo="{logo}" '
-                f'group-title="{GROUP_TITLE}",'
-                f'{safe_name}\n'
-            )
-            f.write(
-                f"{entry['m3u8']}"
-                f"|referer={HOMEPAGE}"
-                f"|origin={HOMEPAGE}"
-                f"|user-agent={ua_encoded}\n\n"
-            )
-
-    log(f"\nPlaylists saved:")
-    log(f"  {OUTPUT_VLC}")
-    log(f"  {OUTPUT_TIVI}")
+    tivi = []
+    for i, entry in enumerate(entries, 1):
+        tivi.append([
+            extinf(i, entry),
+            f"{entry['m3u8']}"
+            f"|referer={HOMEPAGE}"
+            f"|origin={HOMEPAGE}"
+            f"|user-agent={ua_encoded}",
+        ])
+
+    written = [
+        path
+        for path, playlist in ((OUTPUT_VLC, vlc), (OUTPUT_TIVI, tivi))
+        if write_playlist(path, playlist)
+    ]
+
+    if written:
+        log("\nPlaylists saved:")
+        for path in written:
+            log(f"  {path}")
 
 # ============================================================
 # PROCESS ONE TEAM
 # ============================================================
 
-async def process_event(playwright, event, semaphore):
-    async with semaphore:
-        log("")
-        log("=" * 70)
-        log(f"PROCESSING: {event['event']}")
-        log(f"URL: {event['url']}")
+async def extract_event(pool, event, budget=MAX_STREAM_WAIT):
+    log("")
+    log("=" * 70)
+    log(f"PROCESSING: {event['event']} (budget {budget:.0f}s)")
+    log(f"URL: {event['url']}")
 
-        m3u8 = await capture_m3u8_from_page(playwright, event, STREAM_WAIT_SECONDS)
+    m3u8 = await capture_m3u8_from_page(await pool.browser(), event, budget)
 
-        if m3u8:
-            event["m3u8"] = m3u8
-            log(f"✓ STREAM CAPTURED: {event['event']}")
-            return event
+    if m3u8:
+        event["m3u8"] = m3u8
+        log(f"✓ STREAM CAPTURED: {event['event']}")
+        return event
 
-        log(f"✗ NO STREAM: {event['event']}")
-        return None
+    log(f"✗ NO STREAM: {event['event']}")
+    return None
+
+def emit_event(event, journal, collected):
+    # Checkpoint right away so a timeout or crash keeps this stream.
+    journal.append(event["url"], event)
+    collected.append(event)
+    write_playlists(collected)
+    return event
 
 # ============================================================
-# MAIN
+# JOB QUEUE
 # ============================================================
 
-async def main():
-    log("Starting MLB Webcast Updater...")
-
-    async with async_playwright() as p:
-        events = await fetch_events_via_playwright(p)
-        log(f"Found {len(events)} total events")
+async def work_queue(pool, jq, idle_timeout=None, on_result=None):
+    """Lease emelbe jobs from the shared queue and capture their streams."""
+    async def handler(event):
+        log(f"[queue] {event['event']} -> {event['url']}")
+        async with pool.slot() as browser:
+            budget = deadline.current().share(1, floor=MIN_STREAM_WAIT, cap=MAX_STREAM_WAIT)
+            if budget is None:
+                return None
+            m3u8 = await capture_m3u8_from_page(browser, event, budget)
+        if not m3u8:
+            return None
+        event["m3u8"] = m3u8
+        if on_result:
+            await on_result(event)
+        return event
+
+    await drain(
+        jq, "emelbe", handler,
+        concurrency=pool.max_pages,
+        idle_timeout=idle_timeout,
+    )
 
-        if not events:
-            log("No events detected.")
-            return
+async def resolve_via_queue(pool, events):
+    """Enqueue one job per event; other processes, here or on hosts sharing
+    the JOB_QUEUE database, can join with --worker."""
+    # Queue calls can wait out the database's busy timeout: keep them off
+    # the event loop.
+    jq = await asyncio.to_thread(JobQueue)
+    try:
+        await asyncio.to_thread(
+            jq.start_cycle, "emelbe", [(e["url"], e, i) for i, e in enumerate(events)]
+        )
 
-        log("")
-        log("Discovered team/event URLs:")
-        for i, event in enumerate(events, 1):
-            log(f"  {i:02d}. {event['event']} -> {event['url']}")
+        async def checkpoint(event):
+            done = await asyncio.to_thread(jq.results, "emelbe")
+            done[event["url"]] = event
+            write_playlists(list(done.values()))
 
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-        tasks = [process_event(p, event, semaphore) for event in events]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await work_queue(pool, jq, on_result=checkpoint)
+        log(f"Queue: {await asyncio.to_thread(jq.counts, 'emelbe')}")
+        return list((await asyncio.to_thread(jq.results, "emelbe")).values())
+    finally:
+        jq.close()
 
-        collected = []
-        for result in results:
-            if isinstance(result, Exception):
-                log(f"Worker error: {result}")
-                continue
-            if result:
-                collected.append(result)
+async def run_worker(rt):
+    pool = rt.pool("firefox")
+    jq = await asyncio.to_thread(JobQueue)
+    try:
+        await work_queue(pool, jq, idle_timeout=IDLE_TIMEOUT)
+    finally:
+        jq.close()
+    return 0
 
-        collected.sort(key=lambda x: x.get("event", "").lower())
+# ============================================================
+# MAIN
+# ============================================================
 
-        log("")
-        log("=" * 70)
-        log(f"Captured {len(collected)}/{len(events)} streams")
+async def run(rt):
+    log("Starting MLB Webcast Updater...")
 
-        if not collected:
-            log("No streams captured.")
-            return
+    # One shared Firefox; every page gets its own isolated context, and
+    # the pool sizes how many are open at once by free memory.
+    pool = rt.pool("firefox")
+
+    async with pool.slot() as browser:
+        events = await fetch_events_via_playwright(browser)
+    log(f"Found {len(events)} total events")
+
+    if not events:
+        log("No events detected.")
+        return 0
+
+    # One browser session per game, not per team page.
+    events = prune_team_pages(events)
+
+    # Finished games are retired rather than resolved and published again.
+    lifecycle = Lifecycle("emelbe")
+    active = set(lifecycle.observe({e["url"]: e.get("kickoff") for e in events}))
+    lifecycle.save()
+    events = [e for e in events if e["url"] in active]
+    if not events:
+        # Every game has finished: unpublish them rather than leaving the
+        # last playlist up.
+        log("All games finished, clearing playlists.")
+        write_playlists([])
+        return 0
+
+    # Spend browser time on the games about to be watched first; games
+    # beyond the horizon wait for a later run.
+    events, deferred = schedule(events, lambda e: e.get("kickoff"))
+
+    log("")
+    log("Discovered team/event URLs:")
+    for i, event in enumerate(events, 1):
+        log(f"  {i:02d}. {event['event']} -> {event['url']}")
+
+    journal = None
+    finished = True
+    if QUEUE_MODE:
+        collected = await resolve_via_queue(pool, events)
+    else:
+        journal = Journal("emelbe")
+        collected = [journal.get(e["url"]) for e in events if e["url"] in journal]
+        pending = [e for e in events if e["url"] not in journal]
+        if collected:
+            log(f"Resuming: {len(collected)} streams already in journal")
+
+        pipeline = Pipeline("emelbe", pending, [
+            Stage(
+                "extract",
+                lambda event, budget: extract_event(pool, event, budget),
+                concurrency=pool.max_pages,
+                budget=(MIN_STREAM_WAIT, MAX_STREAM_WAIT),
+                gate=pool,
+            ),
+            Stage("emit", lambda event: emit_event(event, journal, collected)),
+        ])
+        await pipeline.run()
+        finished = pipeline.complete
+
+    collected.sort(key=lambda x: x.get("event", "").lower())
+
+    log("")
+    log("=" * 70)
+    log(f"Captured {len(collected)}/{len(events)} streams")
+
+    if not collected:
+        log("No streams captured.")
+        return 0
+
+    write_playlists(collected)
+    if journal and finished:
+        journal.clear()
+    elif journal:
+        log("Run cut short by the deadline; journal kept for the next run")
+    return len(collected)
 
-        write_playlists(collected)
+async def main():
+    await run_standalone(run)
 
 # ============================================================
 # ENTRY POINT
 # ============================================================
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if "--worker" in sys.argv:
+        asyncio.run(run_standalone(run_worker))
+    else:
+        asyncio.run(main())
@@ -2,15 +2,18 @@
 
 import asyncio
 import base64
-import json
-import os
 import re
-import time
 from urllib.parse import quote_plus, urljoin
 
-import aiohttp
 from selectolax.parser import HTMLParser
 
+from common import net, resolutions, tiered
+from common.catalog import Catalog
+from common.lifecycle import Lifecycle
+from common.pipeline import Pipeline, Stage
+from common.playlist import write_playlist
+from common.runtime import run_standalone
+
 # ================= CONFIG =================
 
 BASE_URL = "https://thestreameast.top/"
@@ -29,37 +32,29 @@ ORIGIN = "https://gooz.aapmains.net"
 TVG_ID = "Live.Event.us"
 TAG = "iSTRM"
 
-CACHE_FILE = "istreameast_cache.json"
+# Entries are re-resolved once older than this (see common.catalog).
 CACHE_EXP = 3 * 60 * 60  # 3 hours
 
 DEFAULT_LOGO = "https://i.gyazo.com/4a5e9fa2525808ee4b65002b56d3450e.png"
 
+# Upper bound per stage; the per-host limiter in common.net adapts below it.
+FETCH_CONCURRENCY = 8
+
 # ================= HELPERS =================
 
 def log(msg):
     print(msg, flush=True)
 
 
-def load_cache():
-    if not os.path.exists(CACHE_FILE):
-        return {}
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def save_cache(data):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-
-
-async def fetch(session, url):
+async def fetch(session, url, until=None):
+    """Page text, or None; with ``until`` reading stops at its first match."""
     try:
-        async with session.get(url, timeout=20) as r:
-            if r.status == 200:
-                return await r.text()
+        status, text = await net.fetch_shared(
+            session, url, headers={"User-Agent": USER_AGENT}, timeout=20, hedge=True,
+            until=until,
+        )
+        if status == 200:
+            return text
     except Exception:
         pass
     return None
@@ -67,14 +62,17 @@ async def fetch(session, url):
 
 # ================= STREAM EXTRACTION =================
 
-async def extract_stream(session, event_url):
-    html = await fetch(session, event_url)
-    if not html:
-        return None
+# Reading stops once these are found: the first iframe tag is all
+# find_iframe looks at, and an encoded source is the top-priority pattern.
+# Only a payload that decodes to an http(s) URL ("http" is "aHR0c..." in
+# base64) ends the read; for any other the later patterns need the rest
+# of the body.
+FIRST_IFRAME = re.compile(r"<iframe\b[^>]*>", re.I)
+ENCODED_SOURCE = re.compile(r'const\s+source\s*=\s*"((?-i:aHR0c)[A-Za-z0-9+/=]+)"', re.I)
 
-    soup = HTMLParser(html)
 
-    iframe = soup.css_first("iframe")
+def find_iframe(html):
+    iframe = HTMLParser(html).css_first("iframe")
     if not iframe:
         return None
 
@@ -83,16 +81,14 @@ async def extract_stream(session, event_url):
         return None
 
     # FIX: handle relative iframe URLs
-    iframe_src = urljoin(BASE_URL, iframe_src)
+    return urljoin(BASE_URL, iframe_src)
 
-    iframe_html = await fetch(session, iframe_src)
-    if not iframe_html:
-        return None
 
+def stream_from_iframe(iframe_html):
     # ================= PATTERNS =================
 
     # 1. Old base64 pattern
-    m = re.search(r'const\s+source\s*=\s*"([^"]+)"', iframe_html, re.I)
+    m = ENCODED_SOURCE.search(iframe_html)
     if m:
         try:
             decoded = base64.b64decode(m.group(1)).decode("utf-8")
@@ -111,14 +107,22 @@ async def extract_stream(session, event_url):
     if m:
         return m.group(1)
 
-    # 4. Generic fallback (any http stream)
-    m = re.search(r'(https?://[^"\']+)', iframe_html)
-    if m:
-        return m.group(1)
-
+    # Anything else needs the player's JS: left to the browser tier.
     return None
 
 
+async def resolve_iframe(rt, session, iframe_url, event_url):
+    """Stream for a player iframe, shared with other sources' resolutions;
+    static first, the browser only when that fails (see common.tiered)."""
+    async def static():
+        iframe_html = await fetch(session, iframe_url, until=ENCODED_SOURCE)
+        return stream_from_iframe(iframe_html) if iframe_html else None
+
+    return await resolutions.resolve(iframe_url, "istreameast", lambda: tiered.resolve(
+        rt, iframe_url, static, referer=event_url, user_agent=USER_AGENT,
+    ))
+
+
 # ================= EVENTS =================
 
 async def get_events(session):
@@ -158,73 +162,100 @@ async def get_events(session):
 
 # ================= MAIN =================
 
-async def main():
+async def run(rt):
     log("Starting iStrm updater...")
 
-    cache = load_cache()
-    now = int(time.time())
+    catalog = Catalog("istreameast")
+    lifecycle = Lifecycle("istreameast")
+    listed = []
 
-    headers = {"User-Agent": USER_AGENT}
+    session = await rt.session()
 
-    async with aiohttp.ClientSession(headers=headers) as session:
+    async def discover():
         events = await get_events(session)
         log(f"Found {len(events)} events")
-
-        entries = []
-
-        for i, ev in enumerate(events, 1):
-            key = f"[{ev['sport']}] {ev['title']} ({TAG})"
-
-            if key in cache and now - cache[key]["ts"] < CACHE_EXP:
-                entries.append(cache[key]["entry"])
-                continue
-
-            log(f"[{i}/{len(events)}] {key}")
-
-            stream = await extract_stream(session, ev["url"])
-            if not stream:
-                log("No stream found")
-                continue
-
-            log(f"  STREAM FOUND: {stream}")
-
-            entry = {
-                "name": key,
-                "url": stream,
-                "logo": DEFAULT_LOGO,
-            }
-
-            cache[key] = {
-                "ts": now,
-                "entry": entry
-            }
-
-            entries.append(entry)
+        for ev in events:
+            ev["key"] = f"[{ev['sport']}] {ev['title']} ({TAG})"
+
+        # The site shows no kickoff times: events retire when they leave
+        # the listing. Everything not picked is served from the catalog.
+        active, todo = lifecycle.plan(
+            catalog, {ev["key"]: None for ev in events}, max_age=CACHE_EXP
+        )
+        listed.extend(active)
+        todo = set(todo)
+        for ev in events:
+            if ev["key"] in todo:
+                yield ev
+
+    async def fetch_page(ev):
+        log(ev["key"])
+        ev["html"] = await fetch(session, ev["url"], until=FIRST_IFRAME)
+        return ev if ev["html"] else None
+
+    async def extract(ev):
+        iframe_src = find_iframe(ev["html"])
+        ev["stream"] = (
+            await resolve_iframe(rt, session, iframe_src, ev["url"]) if iframe_src else None
+        )
+        if not ev["stream"]:
+            log(f"No stream found: {ev['key']}")
+            return None
+        return ev
+
+    async def verify(ev):
+        if not ev["stream"].startswith("http"):
+            return None
+
+        log(f"  STREAM FOUND: {ev['stream']}")
+        ev["entry"] = {
+            "name": ev["key"],
+            "url": ev["stream"],
+            "logo": DEFAULT_LOGO,
+        }
+        catalog.update(ev["key"], ev["entry"], url=ev["stream"])
+        return ev
+
+    pipeline = Pipeline("istreameast", discover, [
+        Stage("fetch", fetch_page, concurrency=FETCH_CONCURRENCY),
+        Stage("extract", extract, concurrency=FETCH_CONCURRENCY),
+        Stage("verify", verify),
+    ])
+    await pipeline.run()
+
+    if listed:
+        catalog.retain(listed)
+    catalog.save()
+    lifecycle.save()
+    entries = catalog.entries(listed, max_age=CACHE_EXP)
 
     if not entries:
         log("No streams collected")
-        return
+        return 0
 
     # ================= WRITE M3U =================
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n")
-        for e in entries:
-            f.write(
-                f'#EXTINF:-1 tvg-id="{TVG_ID}" '
-                f'tvg-name="{e["name"]}" '
-                f'tvg-logo="{e["logo"]}" '
-                f'group-title="Live Events",{e["name"]}\n'
-            )
-            f.write(
-                f'{e["url"]}'
-                f'|referer={REFERER}'
-                f'|origin={ORIGIN}'
-                f'|user-agent={ENCODED_UA}\n'
-            )
-
-    save_cache(cache)
+    playlist = []
+    for e in entries:
+        playlist.append([
+            f'#EXTINF:-1 tvg-id="{TVG_ID}" '
+            f'tvg-name="{e["name"]}" '
+            f'tvg-logo="{e["logo"]}" '
+            f'group-title="Live Events",{e["name"]}',
+            f'{e["url"]}'
+            f'|referer={REFERER}'
+            f'|origin={ORIGIN}'
+            f'|user-agent={ENCODED_UA}',
+        ])
+
+    write_playlist(OUTPUT_FILE, playlist)
+
     log("istreameast.m3u saved")
+    return len(entries)
+
+
+async def main():
+    await run_standalone(run)
 
 
 if __name__ == "__main__":
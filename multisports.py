@@ -1,7 +1,12 @@
+import asyncio
 import os
 import urllib.request
 from urllib.parse import quote
 
+from common import net, timeouts
+from common.playlist import write_playlist
+from common.runtime import run_standalone
+
 # ================= CONFIG =================
 
 SOURCE_URL = os.environ.get("MULTISPORT_URL")
@@ -23,17 +28,17 @@ def fetch_playlist(url: str) -> list[str]:
         url,
         headers={"User-Agent": DEFAULT_USER_AGENT},
     )
-    with urllib.request.urlopen(req, timeout=30) as r:
-        return r.read().decode("utf-8", errors="ignore").splitlines()
+    with net.slot_sync(url) as slot:
+        with timeouts.phase(url, "response", 30) as limit:
+            r = urllib.request.urlopen(req, timeout=limit)
+        with r, timeouts.phase(url, "body", 30):
+            slot.status = r.status
+            return r.read().decode("utf-8", errors="ignore").splitlines()
 
 
-def main():
-    if not SOURCE_URL:
-        raise RuntimeError("MULTISPORT_URL secret is missing")
-
-    lines = fetch_playlist(SOURCE_URL)
-
-    output = [f'#EXTM3U url-tvg="{NEW_EPG}"']
+def parse_blocks(lines: list[str]):
+    """Yield one entry (EXTINF, extra tags, URL with headers) per stream."""
+    block = []
 
     current_extinf = None
     referrer = None
@@ -54,7 +59,7 @@ def main():
             referrer = None
             origin = None
             user_agent = None
-            output.append(line)
+            block.append(line)
             continue
 
         # VLC headers
@@ -84,23 +89,41 @@ def main():
                 headers.append(f"user-agent={user_agent}")
 
             if headers:
-                output.append(base_url + "|" + "|".join(headers))
+                block.append(base_url + "|" + "|".join(headers))
             else:
-                output.append(base_url)
+                block.append(base_url)
 
+            yield block
+            block = []
             current_extinf = None
             continue
 
         if line.startswith("#"):
-            output.append(line)
+            block.append(line)
+
 
-    if len(output) <= 1:
+async def run(rt):
+    """Orchestrator entry point"""
+    if not SOURCE_URL:
+        raise RuntimeError("MULTISPORT_URL secret is missing")
+
+    # A single upstream playlist: nothing to fetch per entry, so no
+    # pipeline.
+    header = [f'#EXTM3U url-tvg="{NEW_EPG}"']
+    lines = await asyncio.to_thread(fetch_playlist, SOURCE_URL)
+    entries = list(parse_blocks(lines))
+
+    if not entries:
         raise RuntimeError("Output playlist is empty")
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        f.write("\n".join(output))
+    if write_playlist(OUTPUT_FILE, entries, header):
+        print(f"Saved {OUTPUT_FILE} ({len(entries)} entries)")
 
-    print(f"Saved {OUTPUT_FILE} ({len(output)} lines)")
+    return len(entries)
+
+
+def main():
+    return asyncio.run(run_standalone(run))
 
 
 if __name__ == "__main__":
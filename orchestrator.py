@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Run every enabled source in one process and one event loop.
+
+Each source module in sources.json is imported as a plugin and its
+``run(rt)`` coroutine is started concurrently with the others. All of them
+share one Runtime (HTTP pool, browsers, cache). With --isolate each source
+runs in its own supervised worker process instead. A source runs when it
+is enabled, its required secrets are present and at least ``every``
+minutes have passed since its last successful run.
+
+Usage: python orchestrator.py [--only a,b] [--force] [--isolate]
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from common import deadline, net, playlist
+from common.browser import SERVER_MODE, ensure_server
+from common.runtime import Runtime
+from common.state import load_json, save_json
+from common.supervisor import supervise
+
+# ================= CONFIG =================
+
+SOURCES_FILE = Path(__file__).parent / "sources.json"
+LAST_RUN_FILE = "orchestrator.json"
+METRICS_FILE = "metrics.json"
+
+DEFAULT_EVERY = 30  # minutes
+DEFAULT_TIMEOUT = 600  # seconds
+
+# Cron runs drift by a few minutes; treat a source as due slightly early.
+SCHEDULE_SLACK = 5 * 60
+
+# ================= HELPERS =================
+
+def log(msg=""):
+    print(msg, flush=True)
+
+
+def load_sources():
+    with open(SOURCES_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def skip_reason(name, conf, last_run, now, force):
+    if not conf.get("enabled", True):
+        return "disabled"
+    missing = [v for v in conf.get("requires", []) if not os.environ.get(v)]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    if force:
+        return None
+    every = conf.get("every", DEFAULT_EVERY) * 60
+    if now - last_run.get(name, 0) < every - SCHEDULE_SLACK:
+        return "not due"
+    return None
+
+def start_browsers(due):
+    """Start the browser servers the due sources declare in ``BROWSERS``,
+    with their launch options, before any source attaches to one."""
+    for name, _ in due:
+        try:
+            browsers = getattr(importlib.import_module(name), "BROWSERS", ())
+        except Exception as exc:
+            log(f"{name}: cannot read its browsers ({exc}); started on first use")
+            continue
+        for engine, launch_options in browsers:
+            try:
+                ensure_server(engine, launch_options)
+            except Exception as exc:
+                log(f"{name}: {engine} server failed to start: {exc}")
+
+# ================= RUN =================
+
+async def run_source(rt, name, conf):
+    started = time.monotonic()
+    outcome = {"source": name, "status": "ok", "entries": 0, "detail": ""}
+    timeout = conf.get("timeout", DEFAULT_TIMEOUT)
+    # Sources wind down before the hard timeout and keep partial results.
+    deadline.start(timeout)
+    # Tokens they publish must outlive the wait for their next run.
+    playlist.schedule(conf.get("every", DEFAULT_EVERY) * 60)
+    try:
+        module = importlib.import_module(name)
+        count = await asyncio.wait_for(module.run(rt), timeout=timeout)
+        outcome["entries"] = count or 0
+    except asyncio.TimeoutError:
+        outcome["status"] = "timeout"
+    except Exception as exc:
+        outcome["status"] = "failed"
+        outcome["detail"] = f"{type(exc).__name__}: {exc}"[:80]
+    outcome["seconds"] = time.monotonic() - started
+    return outcome
+
+
+def print_table(outcomes):
+    log()
+    log(f"{'SOURCE':<13} {'STATUS':<9} {'ENTRIES':>7} {'SECONDS':>8}  DETAIL")
+    log("-" * 70)
+    for o in outcomes:
+        seconds = f"{o['seconds']:.1f}" if "seconds" in o else "-"
+        log(
+            f"{o['source']:<13} {o['status']:<9} {o['entries']:>7} "
+            f"{seconds:>8}  {o['detail']}"
+        )
+
+
+async def orchestrate(only=None, force=False, isolate=False):
+    sources = load_sources()
+    last_run = load_json(LAST_RUN_FILE, {})
+    now = time.time()
+
+    due = []
+    outcomes = []
+    for name, conf in sources.items():
+        if only and name not in only:
+            continue
+        reason = skip_reason(name, conf, last_run, now, force)
+        if reason:
+            outcomes.append({"source": name, "status": "skipped", "entries": 0, "detail": reason})
+        else:
+            due.append((name, conf))
+
+    log(f"Running: {', '.join(n for n, _ in due) or 'nothing'}")
+
+    if SERVER_MODE:
+        await asyncio.to_thread(start_browsers, due)
+
+    if isolate:
+        results = await asyncio.to_thread(supervise, due)
+    else:
+        async with Runtime() as rt:
+            results = await asyncio.gather(
+                *(run_source(rt, name, conf) for name, conf in due)
+            )
+
+    for result in results:
+        if result["status"] == "ok":
+            last_run[result["source"]] = now
+    save_json(LAST_RUN_FILE, last_run)
+
+    outcomes = list(results) + outcomes
+    print_table(outcomes)
+
+    # Worker processes each report their own limiters; in-process sources
+    # share this process's.
+    hosts = net.merge(*(o.pop("net", None) for o in outcomes)) if isolate else net.metrics()
+    net.report(hosts)
+    save_json(METRICS_FILE, {"finished": time.time(), "sources": outcomes, "hosts": hosts})
+    return outcomes
+
+# ================= MAIN =================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", help="comma separated source names")
+    parser.add_argument("--force", action="store_true", help="ignore schedules")
+    parser.add_argument(
+        "--isolate", action="store_true",
+        help="run each source in its own supervised worker process",
+    )
+    args = parser.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    outcomes = asyncio.run(orchestrate(only, args.force, args.isolate))
+
+    ran = [o for o in outcomes if o["status"] != "skipped"]
+    if ran and all(o["status"] != "ok" for o in ran):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,31 @@
 # -*- coding: utf-8 -*-
 
 import re
+import sys
 import time
 import os
 import asyncio
 import base64
-import json
-from datetime import datetime, timedelta
+from datetime import datetime, time as dtime
 from pathlib import Path
-from git import Repo
+from zoneinfo import ZoneInfo
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import quote, urlparse
-from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+from urllib.parse import quote, urljoin
+from playwright.async_api import Browser, BrowserContext, Page
+
+from common import breaker, deadline, net, ratelimit, timeouts
+from common.browserpool import BrowserPool
+from common.journal import Journal
+from common.catalog import Catalog
+from common.lifecycle import Lifecycle
+from common.jobqueue import IDLE_TIMEOUT, QUEUE_MODE, JobQueue, drain
+from common.pipeline import Pipeline, Stage
+from common.publish import publish
+from common.state import load_json, save_json
+from common.runtime import run_standalone
+from common.playlist import name_key, write_playlist
+from common.priority import kickoff_ts, roll_forward, schedule
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -22,34 +35,63 @@ import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # ───────── CONFIG ─────────
-ROJA_URL = "https://rojadirecta.com.co/"
-
-# Forced headers for all streams
-FORCED_REFERER = "https://capo8play.com/"
-FORCED_ORIGIN = "https://capo8play.com"
 
 REPO_DIR = Path(__file__).parent
 EVENT_FILE = "eventos.m3u8"
 TIVIMATE_FILE = "eventos_tivimate.m3u8"
 
-MAX_EVENTS = 20
-STREAM_TIMEOUT = 30  # seconds per event
+# Seconds per event page. The run deadline is shared out among the events
+# still pending, within these bounds, instead of capping the event count.
+MIN_STREAM_BUDGET = 15
+MAX_STREAM_BUDGET = 45
+
+# Channels raced per event, each in its own page; the first tokenized
+# stream wins and the other pages are closed.
+MAX_CHANNELS = int(os.environ.get("PELOTA_MAX_CHANNELS", 3))
+
+# Chromium flags for the headless runner environment
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--ignore-certificate-errors',
+    '--autoplay-policy=no-user-gesture-required',
+    '--mute-audio',
+]
+# Browser servers the orchestrator starts for this source up front.
+BROWSERS = [("chromium", {"args": BROWSER_ARGS})]
 
 # Default user agent
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Mobile Safari/537.36"
 
 EXCLUDED_LEAGUES = []
 
+# Listing times on the Rojadirecta mirrors are Colombian time.
+SITE_TZ = ZoneInfo(os.environ.get("PELOTA_SITE_TZ", "America/Bogota"))
+
 # ───────── HELPERS ─────────
+LISTING_TIME = re.compile(r"(?:^|[T\s])(\d{1,2}):(\d{2})(?::\d{2})?")
+
+
 def parse_time(time_str):
-    """Parse time string to datetime object"""
+    """Kickoff from a listing time ("HH:MM", "HH:MM:SS" or an ISO
+    datetime) as an aware datetime in SITE_TZ, today unless a date is
+    given; None if unparseable"""
+    time_str = (time_str or "").strip()
     try:
-        now = datetime.now()
-        hour, minute = map(int, time_str.split(':'))
-        event_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        return event_time
-    except:
+        parsed = datetime.fromisoformat(time_str)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=SITE_TZ)
+    except ValueError:
+        pass
+    m = LISTING_TIME.search(time_str)
+    if not m:
         return None
+    hour, minute = int(m.group(1)), int(m.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return datetime.combine(datetime.now(SITE_TZ).date(), dtime(hour, minute), SITE_TZ)
 
 def decode_base64_url(encoded_url: str) -> str:
     """Decode base64 encoded URL from the r= parameter"""
@@ -59,105 +101,252 @@ def decode_base64_url(encoded_url: str) -> str:
     except:
         return encoded_url
 
-# ───────── UPDATER ─────────
-def get_roja_events():
-    """Extract ONLY Canal 1 links from the new rojadirecta.com.co structure"""
+# ───────── MIRRORS ─────────
+def channel_list(links: list, base: str) -> list:
+    """Usable (name, href) channel links as absolute URLs, Canal 1 first,
+    at most MAX_CHANNELS"""
+    channels = []
+    seen = set()
+    for name, href in links:
+        if not href or href.startswith("#"):
+            continue
+        url = urljoin(base, href)
+        if url in seen or not url.startswith("http"):
+            continue
+        seen.add(url)
+        channels.append({'name': name or f"Canal {len(channels) + 1}", 'url': url})
+    channels.sort(key=lambda c: c['name'] != "Canal 1")
+    return channels[:MAX_CHANNELS]
+
+
+def parse_submenu_listing(html: str, base: str) -> list:
+    """rojadirecta.com.co layout: ul#menu > li.toggle-submenu with a
+    div.match-item and the channels in ul.submenu"""
     events = []
-    try:
-        print(f"Fetching events from: {ROJA_URL}")
-        headers = {'User-Agent': DEFAULT_USER_AGENT}
-        r = requests.get(ROJA_URL, timeout=15, headers=headers, verify=False)
-        soup = BeautifulSoup(r.text, "html.parser")
-
-        # Find all match items
-        menu_items = soup.select("ul#menu > li.toggle-submenu")
-        print(f"Found {len(menu_items)} events on page")
+    soup = BeautifulSoup(html, "html.parser")
+    
+    # Find all match items
+    menu_items = soup.select("ul#menu > li.toggle-submenu")
+    
+    for li in menu_items:
+        # Get match info
+        match_item = li.select_one("div.match-item")
+        if not match_item:
+            continue
         
-        for li in menu_items:
-            # Get match info
-            match_item = li.select_one("div.match-item")
-            if not match_item:
-                continue
-            
-            info_div = match_item.select_one("div.info")
-            if not info_div:
-                continue
-            
-            # Get time
-            time_tag = info_div.find("time")
-            if not time_tag:
-                continue
-            hora = time_tag.get("datetime", "").strip()
-            if not hora:
-                continue
-            
-            # Get event name
-            span = info_div.find("span")
-            if not span:
-                continue
-            event_text = span.text.strip()
-            
-            if ":" not in event_text:
-                continue
-            
-            # Split league and match
-            parts = event_text.split(":", 1)
-            if len(parts) != 2:
-                continue
-                
-            liga = parts[0].strip()
-            partido = parts[1].strip()
-            
-            # Get ONLY Canal 1 link from submenu
-            submenu = li.select_one("ul.submenu")
-            if not submenu:
-                continue
-            
-            # Find the link with "Canal 1" text
-            canal1_link = None
-            for link_li in submenu.select("li"):
-                span_text = link_li.find("span")
-                if span_text and "Canal 1" in span_text.text:
-                    a_tag = link_li.find("a")
-                    if a_tag:
-                        canal1_link = a_tag.get("href", "")
-                        break
-            
-            if not canal1_link:
-                continue
-            
-            # Normalize URL
-            if canal1_link.startswith("/"):
-                canal1_link = "https://rojadirecta.com.co" + canal1_link
+        info_div = match_item.select_one("div.info")
+        if not info_div:
+            continue
+        
+        # Get time
+        time_tag = info_div.find("time")
+        if not time_tag:
+            continue
+        hora = time_tag.get("datetime", "").strip()
+        if not hora:
+            continue
+        
+        # Get event name
+        span = info_div.find("span")
+        if not span:
+            continue
+        event_text = span.text.strip()
+        
+        if ":" not in event_text:
+            continue
+        
+        # Split league and match
+        parts = event_text.split(":", 1)
+        if len(parts) != 2:
+            continue
             
-            if canal1_link:
-                event_time = parse_time(hora.replace(":", "").replace("-", ""))
-                if not event_time and ":" in hora:
-                    event_time = parse_time(hora)
-                
-                events.append({
-                    'liga': liga,
-                    'hora': hora,
-                    'partido': partido,
-                    'channel': 'Canal 1',
-                    'url': canal1_link,
-                    'time_obj': event_time
-                })
-
-        print(f"Extracted {len(events)} Canal 1 stream links")
-    except Exception as e:
-        print(f"Error scraping: {e}")
+        liga = parts[0].strip()
+        partido = parts[1].strip()
+        
+        # Get every channel link from submenu
+        submenu = li.select_one("ul.submenu")
+        if not submenu:
+            continue
+        
+        links = []
+        for link_li in submenu.select("li"):
+            span_text = link_li.find("span")
+            a_tag = link_li.find("a")
+            if span_text and a_tag:
+                links.append((span_text.text.strip(), a_tag.get("href", "")))
+        
+        channels = channel_list(links, base)
+        if not channels:
+            continue
+        
+        event_time = parse_time(hora)
+        
+        events.append({
+            'liga': liga,
+            'hora': hora,
+            'partido': partido,
+            'channel': channels[0]['name'],
+            'url': channels[0]['url'],
+            'channels': channels,
+            'time_obj': event_time
+        })
+    
+    return events
+
+
+def parse_menu_listing(html: str, base: str) -> list:
+    """Older rojadirectaenvivo/rojadirectablog layout: ul.menu > li with
+    the time in span.t and the channels in ul > li.subitemN"""
+    events = []
+    soup = BeautifulSoup(html, "html.parser")
+    
+    for li in soup.select("ul.menu > li"):
+        t = li.find("span", class_="t")
+        if not t:
+            continue
+        hora = t.text.strip()
+        
+        link = li.find("a", recursive=False)
+        if not link:
+            continue
+        
+        raw = link.text.strip()
+        if hora in raw:
+            raw = raw.replace(hora, "").strip()
+        
+        if ":" not in raw:
+            continue
+        
+        liga, partido = (x.strip() for x in raw.split(":", 1))
+        
+        channels = channel_list(
+            [(a.text.strip(), a.get("href", "")) for a in li.select("ul > li > a")],
+            base,
+        )
+        if not channels:
+            continue
+        
+        events.append({
+            'liga': liga,
+            'hora': hora,
+            'partido': partido,
+            'channel': channels[0]['name'],
+            'url': channels[0]['url'],
+            'channels': channels,
+            'time_obj': parse_time(hora)
+        })
+    
+    return events
+
+
+# Rojadirecta keeps moving domains and layouts. Every mirror is raced at
+# discovery and the first valid listing wins; each mirror's own parser is
+# tried first, then the others in case its layout changed. The stream
+# referer belongs to the player host the mirror embeds.
+ROJA_MIRRORS = [
+    {
+        "name": "rojadirecta.com.co",
+        "url": "https://rojadirecta.com.co/",
+        "base": "https://rojadirecta.com.co",
+        "parser": parse_submenu_listing,
+        "referer": "https://capo8play.com/",
+        "origin": "https://capo8play.com",
+    },
+    {
+        "name": "rojadirectaenvivo.pl",
+        "url": "https://www.rojadirectaenvivo.pl/",
+        "base": "https://rojadirectablog.com",
+        "parser": parse_menu_listing,
+        "referer": "https://capo7play.com/",
+        "origin": "https://capo7play.com",
+    },
+]
+PARSERS = [parse_submenu_listing, parse_menu_listing]
+
+MIRRORS_FILE = "pelota.mirrors.json"
+MIRROR_BENCH_AFTER = 3  # failed discoveries in a row
+MIRROR_BENCH_SECONDS = 6 * 60 * 60  # before a benched mirror is raced again
+
+
+def fetch_mirror(mirror: dict) -> list:
+    """Fetch and parse one mirror's listing; raises when it is unusable"""
+    url = mirror["url"]
+    headers = {'User-Agent': DEFAULT_USER_AGENT}
+    with net.slot_sync(url) as slot, timeouts.phase(url, "response", 15) as limit:
+        r = requests.get(url, timeout=limit, headers=headers, verify=False)
+        slot.status = r.status_code
+    r.raise_for_status()
+    
+    parsers = [mirror["parser"]] + [p for p in PARSERS if p is not mirror["parser"]]
+    for parser in parsers:
+        events = [
+            e for e in parser(r.text, mirror["base"])
+            if e['partido']
+        ]
+        if events:
+            for e in events:
+                e['referer'] = mirror["referer"]
+                e['origin'] = mirror["origin"]
+            return events
+    raise ValueError("no events with channel links in listing")
+
+
+def mirror_benched(health: dict, now: float) -> bool:
+    return (health.get("fails", 0) >= MIRROR_BENCH_AFTER
+            and now - health.get("tried", 0) < MIRROR_BENCH_SECONDS)
+
+
+async def get_roja_events() -> list:
+    """Race the Rojadirecta mirrors; the first valid listing wins"""
+    health = load_json(MIRRORS_FILE, {})
+    now = time.time()
+    racers = [m for m in ROJA_MIRRORS if not mirror_benched(health.get(m["name"], {}), now)]
+    if not racers:
+        racers = ROJA_MIRRORS
+    print(f"Racing mirrors: {', '.join(m['name'] for m in racers)}")
+    
+    started = time.monotonic()
+    pending = {asyncio.ensure_future(asyncio.to_thread(fetch_mirror, m)): m for m in racers}
+    events = []
+    try:
+        while pending and not events:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                mirror = pending.pop(task)
+                record = health.setdefault(mirror["name"], {})
+                record["tried"] = time.time()
+                if task.exception() is None and not events:
+                    events = task.result()
+                    record["fails"] = 0
+                    record["wins"] = record.get("wins", 0) + 1
+                    record["seconds"] = round(time.monotonic() - started, 2)
+                    print(f"Mirror {mirror['name']}: {len(events)} events "
+                          f"in {record['seconds']}s")
+                elif task.exception() is not None:
+                    record["fails"] = record.get("fails", 0) + 1
+                    print(f"Mirror {mirror['name']} failed: {str(task.exception())[:100]}")
+    finally:
+        # Slower mirrors are dropped; their threads finish on their own.
+        for task in pending:
+            task.cancel()
+        save_json(MIRRORS_FILE, health)
     
     return events
 
 # ───────── PLAYWRIGHT STREAM EXTRACTION ─────────
+def is_tokenized(url: str) -> bool:
+    return "md5=" in url or "expires=" in url or "token=" in url
+
 
-async def capture_stream(page: Page, url: str) -> str | None:
+async def capture_stream(page: Page, url: str, budget: float = MAX_STREAM_BUDGET) -> str | None:
     """
     Load the event page, navigate through iframes,
     click play, and capture the m3u8 URL from network requests.
+    Gives up on clicking once ``budget`` seconds have passed.
     """
     captured_m3u8 = []
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + budget
     
     async def handle_request(request):
         """Intercept network requests to find m3u8"""
@@ -186,13 +375,17 @@ async def capture_stream(page: Page, url: str) -> str | None:
     try:
         # Load the event page
         print(f"  Loading: {url}")
-        await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        async with ratelimit.slot(url):
+            with breaker.guard(url), timeouts.phase(url, "navigate", 30) as limit:
+                await page.goto(url, wait_until="domcontentloaded", timeout=min(limit, budget) * 1000)
         
         # Wait for iframes to load
         await asyncio.sleep(3)
         
         # Try to click play in all iframes
         for attempt in range(10):
+            if loop.time() >= stop_at:
+                break
             try:
                 # Get all frames (including nested ones)
                 frames = page.frames
@@ -240,15 +433,15 @@ async def capture_stream(page: Page, url: str) -> str | None:
                                 }
                             }
                         """)
-                    except:
+                    except Exception:
                         pass
-            except:
+            except Exception:
                 pass
             
             await asyncio.sleep(2)
             
             # Check if we already have tokenized m3u8
-            tokenized = [u for u in captured_m3u8 if "md5=" in u or "expires=" in u or "token=" in u]
+            tokenized = [u for u in captured_m3u8 if is_tokenized(u)]
             if tokenized:
                 return tokenized[0]
             
@@ -258,10 +451,10 @@ async def capture_stream(page: Page, url: str) -> str | None:
                 return valid[0]
         
         # Wait additional time for streams to load
-        await asyncio.sleep(5)
+        await asyncio.sleep(min(5, max(0, stop_at - loop.time())))
         
         # Final check
-        tokenized = [u for u in captured_m3u8 if "md5=" in u or "expires=" in u or "token=" in u]
+        tokenized = [u for u in captured_m3u8 if is_tokenized(u)]
         if tokenized:
             return tokenized[0]
         
@@ -285,16 +478,63 @@ async def capture_stream(page: Page, url: str) -> str | None:
     return None
 
 
-async def extract_m3u8_async(context: BrowserContext, event_info: dict) -> dict | None:
-    """Extract m3u8 stream from event page using Playwright"""
-    url = event_info['url']
-    partido = event_info['partido']
+async def capture_channel(context: BrowserContext, channel: dict, budget: float) -> str | None:
+    """Capture one channel's stream in its own page"""
+    page = await context.new_page()
+    try:
+        return await capture_stream(page, channel['url'], budget)
+    finally:
+        await page.close()
+
+
+async def race_channels(context: BrowserContext, channels: list, budget: float) -> str | None:
+    """Race the channels in separate pages; the first tokenized m3u8 wins
+    and the other pages are cancelled. Without one, the first stream
+    captured in Canal 1 order is used."""
+    tasks = [
+        asyncio.ensure_future(capture_channel(context, channel, budget))
+        for channel in channels
+    ]
+    fallback = [None] * len(tasks)
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    print(f"  Channel error: {str(task.exception())[:100]}")
+                    continue
+                stream_url = task.result()
+                if stream_url and is_tokenized(stream_url):
+                    print(f"  {channels[tasks.index(task)]['name']} won the race")
+                    return stream_url
+                fallback[tasks.index(task)] = stream_url
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return next((u for u in fallback if u), None)
+
+
+def event_channels(event_info: dict) -> list:
+    """Channels to race for an event whose host breaker lets them through"""
+    # Jobs queued before channel racing carry only their Canal 1 link.
+    channels = event_info.get('channels') or [
+        {'name': event_info.get('channel', 'Canal 1'), 'url': event_info['url']}
+    ]
+    return [c for c in channels if breaker.allows(c['url'])]
+
+
+async def extract_m3u8_async(context: BrowserContext, event_info: dict,
+                             budget: float = MAX_STREAM_BUDGET) -> dict | None:
+    """Extract m3u8 stream from the event's channel pages using Playwright"""
+    channels = event_channels(event_info)
+    if not channels:
+        print("  Skipped: circuit open for every channel host")
+        return None
     
-    page = None
     try:
-        page = await context.new_page()
-        
-        stream_url = await capture_stream(page, url)
+        stream_url = await race_channels(context, channels, budget)
         
         if stream_url:
             print(f"  ✓ Stream captured!")
@@ -302,8 +542,9 @@ async def extract_m3u8_async(context: BrowserContext, event_info: dict) -> dict
             
             return {
                 "url": stream_url,
-                "referer": FORCED_REFERER,
-                "origin": FORCED_ORIGIN,
+                # Jobs queued before mirror racing carry no referer.
+                "referer": event_info.get('referer', ROJA_MIRRORS[0]['referer']),
+                "origin": event_info.get('origin', ROJA_MIRRORS[0]['origin']),
                 "user_agent": DEFAULT_USER_AGENT,
             }
         else:
@@ -311,120 +552,224 @@ async def extract_m3u8_async(context: BrowserContext, event_info: dict) -> dict
             
     except Exception as e:
         print(f"  Error: {str(e)[:150]}")
-    finally:
-        if page:
-            await page.close()
     
     return None
 
 
-async def process_all_events(events_to_process: list) -> tuple[list, list, int]:
-    """Process all events using a single browser instance"""
-    entries = ["#EXTM3U"]
-    tivimate = ["#EXTM3U"]
-    successful = 0
-    
-    async with async_playwright() as p:
-        # Launch browser with specific args for headless environment
-        browser = await p.chromium.launch(
-            headless=True,
-            args=[
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--disable-web-security',
-                '--ignore-certificate-errors',
-                '--autoplay-policy=no-user-gesture-required',
-                '--mute-audio',
-            ]
-        )
+def event_key(event: dict) -> str:
+    """Journal key identifying one match"""
+    return f"{event['hora']}|{event['liga']}|{event['partido']}"
+
+
+def build_entries(resolved: list) -> tuple[list, list]:
+    """Build VLC and TiviMate entry blocks from resolved streams"""
+    entries = []
+    tivimate = []
+    
+    for result in resolved:
+        liga = result['liga']
+        hora = result['hora']
+        partido = result['partido']
+        title = f"{hora} {liga} - {partido}"
         
-        context = await browser.new_context(
-            user_agent=DEFAULT_USER_AGENT,
-            viewport={'width': 1920, 'height': 1080},
-            ignore_https_errors=True,
-            bypass_csp=True,
-        )
+        # VLC format
+        vlc = [f'#EXTINF:-1 group-title="{liga}",{title}']
+        if result.get("referer"):
+            vlc.append(f'#EXTVLCOPT:http-referrer={result["referer"]}')
+        if result.get("origin"):
+            vlc.append(f'#EXTVLCOPT:http-origin={result["origin"]}')
+        if result.get("user_agent"):
+            vlc.append(f'#EXTVLCOPT:http-user-agent={result["user_agent"]}')
+        vlc.append(result["url"])
+        entries.append(vlc)
         
+        # Tivimate format
+        params = []
+        if result.get("referer"):
+            params.append(f"referer={result['referer']}")
+        if result.get("origin"):
+            params.append(f"origin={result['origin']}")
+        if result.get("user_agent"):
+            params.append(f"user-agent={quote(result['user_agent'])}")
+        tivimate.append([
+            f'#EXTINF:-1 group-title="{liga}",{title}',
+            f'{result["url"]}|{"|".join(params)}' if params else result["url"],
+        ])
+    
+    return entries, tivimate
+
+
+def write_outputs(resolved: list) -> tuple[list, list]:
+    """Atomically (re-)render both playlists from the streams resolved so far"""
+    entries, tivimate = build_entries(resolved)
+    write_playlist(REPO_DIR / EVENT_FILE, entries, key=name_key)
+    write_playlist(REPO_DIR / TIVIMATE_FILE, tivimate, key=name_key)
+    return entries, tivimate
+
+
+async def new_context(browser: Browser) -> BrowserContext:
+    return await browser.new_context(
+        user_agent=DEFAULT_USER_AGENT,
+        viewport={'width': 1920, 'height': 1080},
+        ignore_https_errors=True,
+        bypass_csp=True,
+    )
+
+
+async def process_all_events(pool: BrowserPool, events_to_process: list, journal: Journal,
+                             render=write_outputs) -> tuple[list, bool]:
+    """Process all events through the pipeline on the pool's shared browser.
+    
+    Every captured stream is journaled and the playlists are re-rendered
+    with ``render`` immediately, so a killed run still publishes what it
+    resolved. Returns the resolved streams and whether every event got its
+    turn.
+    """
+    resolved = []
+    pending = []
+    for event in events_to_process:
+        if event_key(event) in journal:
+            resolved.append(journal.get(event_key(event)))
+        else:
+            pending.append(event)
+    
+    if resolved:
+        print(f"Resuming: {len(resolved)} events already resolved in journal")
+    if not pending:
+        return resolved, True
+    
+    async def extract(event: dict, budget: float) -> dict | None:
+        print(f"\n{event['hora']} - {event['partido']} (budget {budget:.0f}s)")
+        if not event_channels(event):
+            # Hosts are down or blocking us: don't spend a page on them.
+            print("  Skipped: circuit open for every channel host")
+            return None
+        context = await new_context(await pool.browser())
         try:
-            for idx, event in enumerate(events_to_process, 1):
-                print(f"\n[{idx}/{len(events_to_process)}] {event['hora']} - {event['partido']}")
-                
-                result = await extract_m3u8_async(context, event)
-                
-                if result:
-                    liga = event['liga']
-                    hora = event['hora']
-                    partido = event['partido']
-                    title = f"{hora} {liga} - {partido}"
-                    
-                    # VLC format
-                    entries.append(f'#EXTINF:-1 group-title="{liga}",{title}')
-                    if result.get("referer"):
-                        entries.append(f'#EXTVLCOPT:http-referrer={result["referer"]}')
-                    if result.get("origin"):
-                        entries.append(f'#EXTVLCOPT:http-origin={result["origin"]}')
-                    if result.get("user_agent"):
-                        entries.append(f'#EXTVLCOPT:http-user-agent={result["user_agent"]}')
-                    entries.append(result["url"])
-                    
-                    # Tivimate format
-                    tivimate.append(f'#EXTINF:-1 group-title="{liga}",{title}')
-                    params = []
-                    if result.get("referer"):
-                        params.append(f"referer={result['referer']}")
-                    if result.get("origin"):
-                        params.append(f"origin={result['origin']}")
-                    if result.get("user_agent"):
-                        params.append(f"user-agent={quote(result['user_agent'])}")
-                    if params:
-                        tivimate.append(f'{result["url"]}|{"|".join(params)}')
-                    else:
-                        tivimate.append(result["url"])
-                    
-                    successful += 1
-                    print(f"  ✓ Added to playlist")
-                else:
-                    print(f"  ✗ No stream found")
-                
-                # Small delay between events
-                await asyncio.sleep(2)
-                
+            result = await extract_m3u8_async(context, event, budget)
         finally:
             await context.close()
-            await browser.close()
+        if not result:
+            return None
+        result.update({
+            'liga': event['liga'],
+            'hora': event['hora'],
+            'partido': event['partido'],
+        })
+        return result
+    
+    def emit(result: dict) -> dict:
+        journal.append(event_key(result), result)
+        resolved.append(result)
+        render(resolved)
+        print(f"  ✓ Added to playlist: {result['partido']}")
+        return result
+    
+    # Each event gets its own context, holding one page per raced channel,
+    # so its memory is freed with it; the pool decides how many events run
+    # side by side.
+    pipeline = Pipeline("pelota", pending, [
+        Stage(
+            "extract", extract,
+            concurrency=pool.max_pages,
+            budget=(MIN_STREAM_BUDGET, MAX_STREAM_BUDGET),
+            gate=pool,
+        ),
+        Stage("emit", emit),
+    ])
+    await pipeline.run()
     
-    return entries, tivimate, successful
+    return resolved, pipeline.complete
+
+
+# ───────── JOB QUEUE ─────────
+async def work_queue(rt, jq: JobQueue, idle_timeout: float | None = None, on_result=None):
+    """Lease pelota jobs from the shared queue and resolve them"""
+    pool = rt.pool("chromium", args=BROWSER_ARGS)
+    
+    async def handler(payload: dict) -> dict | None:
+        print(f"\n[queue] {payload['hora']} - {payload['partido']}")
+        if not event_channels(payload):
+            print("  Skipped: circuit open for every channel host")
+            return None
+        async with pool.slot() as browser:
+            budget = deadline.current().share(1, floor=MIN_STREAM_BUDGET, cap=MAX_STREAM_BUDGET)
+            if budget is None:
+                return None
+            context = await new_context(browser)
+            try:
+                result = await extract_m3u8_async(context, payload, budget)
+            finally:
+                await context.close()
+        if result:
+            result.update({
+                'liga': payload['liga'],
+                'hora': payload['hora'],
+                'partido': payload['partido'],
+            })
+            if on_result:
+                await on_result(result)
+        return result
+    
+    await drain(jq, "pelota", handler, concurrency=pool.max_pages, idle_timeout=idle_timeout)
+
+
+async def resolve_via_queue(rt, events_to_process: list, render=write_outputs) -> list:
+    """Enqueue one job per event and help resolve them.
+    
+    Other processes, here or on hosts sharing the JOB_QUEUE database,
+    can join with `python pelota.py --worker`. Queue calls can wait out
+    the database's busy timeout, so they run off the event loop.
+    """
+    jq = await asyncio.to_thread(JobQueue)
+    try:
+        await asyncio.to_thread(jq.start_cycle, "pelota", [
+            (event_key(e), {k: e[k] for k in ('liga', 'hora', 'partido', 'channel', 'url', 'channels', 'referer', 'origin')}, i)
+            for i, e in enumerate(events_to_process)
+        ])
+        # Re-render as results arrive; complete() runs right after the
+        # handler, so merge the new result with those already stored.
+        async def checkpoint(result):
+            done = await asyncio.to_thread(jq.results, "pelota")
+            done[event_key(result)] = result
+            render(list(done.values()))
+        
+        await work_queue(rt, jq, on_result=checkpoint)
+        print(f"Queue: {await asyncio.to_thread(jq.counts, 'pelota')}")
+        return list((await asyncio.to_thread(jq.results, "pelota")).values())
+    finally:
+        jq.close()
+
+
+async def run_worker(rt) -> int:
+    jq = await asyncio.to_thread(JobQueue)
+    try:
+        await work_queue(rt, jq, idle_timeout=IDLE_TIMEOUT)
+    finally:
+        jq.close()
+    return 0
 
 
 # ───────── GIT PUSH ─────────
 def push_to_github(successful: int):
-    """Push generated files to GitHub repository."""
-    is_github_actions = os.getenv("GITHUB_ACTIONS") == "true"
+    """Publish generated files when running outside the scheduled workflow.
     
-    if is_github_actions:
-        print("Running in GitHub Actions - files ready for workflow to push")
-    else:
-        try:
-            repo = Repo(REPO_DIR)
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            repo.git.add(EVENT_FILE)
-            repo.git.add(TIVIMATE_FILE)
-            
-            if repo.is_dirty(untracked_files=True):
-                repo.index.commit(f"Update {current_time} - {successful} streams")
-                repo.remote("origin").push()
-                print("✓ Pushed to git")
-            else:
-                print("No changes to commit")
-        except Exception as e:
-            print(f"Git error: {e}")
+    In GitHub Actions the shared publish stage commits all scrapers at once.
+    """
+    if os.getenv("GITHUB_ACTIONS") == "true":
+        print("Running in GitHub Actions - files ready for the publish stage")
+        return
+    
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        publish(f"Update {current_time} - {successful} streams")
+    except Exception as e:
+        print(f"Git error: {e}")
 
 
 # ───────── MAIN ─────────
-async def main_async():
+async def run(rt) -> int:
+    """Discover, resolve and write playlists; returns the stream count"""
     print("=" * 60)
     print("ROJADIRECTA STREAM UPDATER (Playwright)")
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -432,21 +777,18 @@ async def main_async():
     print("=" * 60)
     
     # Get events
-    all_events = get_roja_events()
+    all_events = await get_roja_events()
     
     if not all_events:
         print("No events found!")
-        return
+        return 0
     
-    print(f"\nTotal Canal 1 events found: {len(all_events)}")
+    print(f"\nTotal events found: {len(all_events)}")
     
     # Filter excluded leagues
     if EXCLUDED_LEAGUES:
         all_events = [e for e in all_events if not any(x.lower() in e['liga'].lower() for x in EXCLUDED_LEAGUES)]
     
-    # Sort by time
-    all_events.sort(key=lambda x: (x['hora'], x['liga']))
-    
     # Remove duplicate matches
     seen_matches = set()
     unique_events = []
@@ -456,38 +798,95 @@ async def main_async():
             seen_matches.add(match_key)
             unique_events.append(e)
     
-    events_to_process = unique_events[:MAX_EVENTS]
+    # Resolve in kickoff order (live, soon, later today, tomorrow); matches
+    # beyond the horizon wait for a later run. No fixed cap: the run
+    # deadline decides how many get resolved.
+    events_to_process, deferred = schedule(
+        unique_events,
+        lambda e: roll_forward(kickoff_ts(e['time_obj'])),
+    )
     print(f"Events to process: {len(events_to_process)}")
     
     if not events_to_process:
         print("No events to process!")
-        (REPO_DIR / EVENT_FILE).write_text("#EXTM3U\n", encoding='utf-8')
-        (REPO_DIR / TIVIMATE_FILE).write_text("#EXTM3U\n", encoding='utf-8')
-        return
+        write_playlist(REPO_DIR / EVENT_FILE, [])
+        write_playlist(REPO_DIR / TIVIMATE_FILE, [])
+        return 0
     
     for e in events_to_process:
         print(f"  {e['hora']} | {e['liga']}: {e['partido']}")
     
+    # Rolling refresh: resolve this run's slice, reuse the catalog for the
+    # rest (everything is resolved unless ROLLING_SLICE is set).
+    # Finished and vanished matches are retired and evicted; matches about
+    # to kick off are re-resolved even if the catalog holds a stream.
+    catalog = Catalog("pelota")
+    lifecycle = Lifecycle("pelota")
+    listed, todo = lifecycle.plan(catalog, {
+        event_key(e): roll_forward(kickoff_ts(e['time_obj']))
+        for e in unique_events
+    })
+    todo = set(todo)
+    to_resolve = [e for e in events_to_process if event_key(e) in todo]
+    
+    journal = None if QUEUE_MODE else Journal("pelota")
+    stored = set()
+    
+    def render(resolved: list) -> tuple[list, list]:
+        """Write this run's results merged with the catalog"""
+        # Called after every capture: only results not stored yet go into
+        # the catalog, and ones resumed from the journal keep the time they
+        # were actually resolved.
+        for result in resolved:
+            key = event_key(result)
+            if key in stored:
+                continue
+            stored.add(key)
+            stamp = journal.stamp(key) if journal is not None else None
+            catalog.update(key, result, url=result['url'], resolved=stamp)
+        return write_outputs(catalog.entries(listed))
+    
     # Process all events
-    entries, tivimate, successful = await process_all_events(events_to_process)
+    finished = True
+    if QUEUE_MODE:
+        resolved = await resolve_via_queue(rt, to_resolve, render)
+    else:
+        pool = rt.pool("chromium", args=BROWSER_ARGS)
+        resolved, finished = await process_all_events(pool, to_resolve, journal, render)
+    successful = len(resolved)
     
     # Save files
     print(f"\n{'=' * 60}")
-    print(f"Results: {successful}/{len(events_to_process)} streams captured")
+    print(f"Results: {successful}/{len(to_resolve)} streams captured")
     
+    entries = []
     try:
-        (REPO_DIR / EVENT_FILE).write_text("\n".join(entries), encoding='utf-8')
-        (REPO_DIR / TIVIMATE_FILE).write_text("\n".join(tivimate), encoding='utf-8')
+        entries, tivimate = render(resolved)
+        catalog.retain(listed)
+        catalog.save()
+        lifecycle.save()
         print(f"Files written:")
-        print(f"  - {EVENT_FILE} ({len(entries)-1} entries)")
-        print(f"  - {TIVIMATE_FILE} ({len(tivimate)-1} entries)")
+        print(f"  - {EVENT_FILE} ({len(entries)} entries)")
+        print(f"  - {TIVIMATE_FILE} ({len(tivimate)} entries)")
         
-        if successful > 0:
+        if entries:
             print(f"\nSample output:")
-            for line in entries[1:6]:
+            for line in [l for e in entries[:2] for l in e][:5]:
                 print(f"  {line[:120]}")
     except Exception as e:
         print(f"Error writing files: {e}")
+    else:
+        # Run finished: the next scheduled run starts from scratch. A run
+        # cut short by the deadline keeps its journal so the next one
+        # spends its time on the events this one did not reach.
+        if journal and finished:
+            journal.clear()
+    
+    return len(entries)
+
+
+async def main_async():
+    successful = await run_standalone(run)
     
     # Push to GitHub
     if successful > 0:
@@ -498,7 +897,10 @@ async def main_async():
 
 def main():
     """Entry point for the script"""
-    asyncio.run(main_async())
+    if "--worker" in sys.argv:
+        asyncio.run(run_standalone(run_worker))
+    else:
+        asyncio.run(main_async())
 
 
 if __name__ == "__main__":
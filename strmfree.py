@@ -1,11 +1,16 @@
+import asyncio
 import os
 import re
 import json
 import time
-import urllib.request
-import urllib.parse
 from urllib.parse import quote
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from common import net
+from common.catalog import Catalog
+from common.lifecycle import Lifecycle
+from common.pipeline import Pipeline, Stage
+from common.playlist import write_playlist
+from common.runtime import run_standalone
 
 # ================= CONFIG =================
 SOURCE_URL = os.environ.get("STRM_FREE_API_URL")
@@ -25,14 +30,23 @@ CATEGORIES = [
     "baseball", "football", "racing", "tennis", "cricket"
 ]
 
+# Upper bound on embeds in flight; the per-host limiter in common.net
+# adapts below it.
+EXTRACT_CONCURRENCY = 8
+
+# The embed's player iframe, the top-priority pattern; reading an embed
+# page stops as soon as it is found.
+EMBED_IFRAME = re.compile(r'src="(https://streamfree\.top/live-cdn/[^"]+\.m3u8[^"]*)"')
+
 # ===========================================
 
 def fetch_json(url: str) -> dict | None:
     """Fetch JSON data from a URL with a timeout."""
-    req = urllib.request.Request(url, headers={"User-Agent": USER_AGENT_RAW})
     try:
-        with urllib.request.urlopen(req, timeout=30) as r:
-            return json.loads(r.read().decode("utf-8"))
+        text = net.fetch_text_sync(
+            url, headers={"User-Agent": USER_AGENT_RAW}, timeout=30, hedge=True
+        )
+        return json.loads(text)
     except Exception as e:
         print(f" Failed to fetch {url}: {e}")
         return None
@@ -42,18 +56,18 @@ def extract_m3u8_from_embed(embed_url: str) -> str | None:
     Fetch the embed page and extract the m3u8 URL.
     Handles both direct iframe sources and JavaScript-loaded streams.
     """
-    req = urllib.request.Request(embed_url, headers={"User-Agent": USER_AGENT_RAW})
     try:
-        with urllib.request.urlopen(req, timeout=30) as r:
-            html = r.read().decode("utf-8")
+        html = net.fetch_text_sync(
+            embed_url, headers={"User-Agent": USER_AGENT_RAW}, timeout=30, hedge=True,
+            until=EMBED_IFRAME,
+        )
     except Exception as e:
         print(f" Failed to fetch embed {embed_url}: {e}")
         return None
 
     # Pattern 1: Look for iframe src that contains the m3u8
     # This handles cases where the m3u8 is directly in the iframe's src attribute.
-    iframe_pattern = r'src="(https://streamfree\.top/live-cdn/[^"]+\.m3u8[^"]*)"'
-    match = re.search(iframe_pattern, html)
+    match = EMBED_IFRAME.search(html)
     if match:
         return match.group(1)
 
@@ -79,7 +93,7 @@ def extract_m3u8_from_embed(embed_url: str) -> str | None:
 
     return None
 
-def process_stream(stream: dict) -> tuple[str, str]:
+def process_stream(stream: dict) -> tuple[str, list[str]]:
     """Process a single stream: get metadata and capture m3u8 URL."""
     name = stream.get("name", "Unknown Event")
     category = stream.get("category", "unknown")
@@ -110,63 +124,110 @@ def process_stream(stream: dict) -> tuple[str, str]:
         return None, None
 
     # Prepare TiviMate entry
-    entry = (
+    entry = [
         f'#EXTINF:-1 tvg-id="{category}.{stream_key}" '
         f'tvg-name="[{league}] {name} | (STFREE)" '
         f'tvg-logo="{thumbnail}" '
-        f'group-title="{league}",{name}\n'
-        f'{m3u8_url}|referer={embed_url}|origin={embed_url}|user-agent={USER_AGENT}'
-    )
+        f'group-title="{league}",{name}',
+        f'{m3u8_url}|referer={embed_url}|origin={embed_url}|user-agent={USER_AGENT}',
+    ]
     return embed_url, entry
 
-def main():
-    if not SOURCE_URL:
-        raise RuntimeError("STRM_FREE_API_URL secret is missing")
+async def fetch_category(category: str) -> tuple[str, dict | None]:
+    url = f"{BASE_URL}/api/v1/streams?category={category}"
+    return category, await asyncio.to_thread(fetch_json, url)
 
-    all_streams = []
-    print("📡 Fetching streams from all categories...")
+def stream_id(stream: dict) -> str:
+    """Catalog key for a stream"""
+    category = stream.get("category", "unknown")
+    stream_key = stream.get("stream_key")
+    if stream_key:
+        return f"{category}/{stream_key}"
+    return stream.get("embed_url") or stream.get("name", "")
 
-    # Fetch all categories in parallel for speed
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_category = {
-            executor.submit(fetch_json, f"{BASE_URL}/api/v1/streams?category={cat}"): cat
-            for cat in CATEGORIES
-        }
+async def discover(catalog: Catalog, listed: list[str]):
+    """Yield streams as each category arrives, so extraction starts early.
 
-        for future in as_completed(future_to_category):
-            category = future_to_category[future]
-            data = future.result()
+    In rolling mode the whole listing is needed to pick this run's slice,
+    so streams are held back until every category is in.
+    """
+    tasks = [asyncio.create_task(fetch_category(cat)) for cat in CATEGORIES]
+    held = []
+    try:
+        for future in asyncio.as_completed(tasks):
+            category, data = await future
             if data and "streams" in data:
                 streams = data["streams"]
                 print(f" {category}: found {len(streams)} streams")
-                all_streams.extend(streams)
+                for stream in streams:
+                    listed.append(stream_id(stream))
+                    if catalog.rolling:
+                        held.append(stream)
+                    else:
+                        yield stream
             else:
                 print(f" {category}: no streams or invalid data")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if held:
+        todo = set(catalog.plan(listed))
+        for stream in held:
+            if stream_id(stream) in todo:
+                yield stream
+
+def extract(stream: dict) -> tuple[str, list[str]] | None:
+    _, entry = process_stream(stream)
+    return (stream_id(stream), entry) if entry else None
+
+async def run(rt):
+    """Orchestrator entry point"""
+    if not SOURCE_URL:
+        raise RuntimeError("STRM_FREE_API_URL secret is missing")
 
-    if not all_streams:
-        raise RuntimeError("No streams found in any category")
+    print("📡 Fetching streams from all categories...")
+
+    catalog = Catalog("strmfree")
+    lifecycle = Lifecycle("strmfree")
+    listed = []
 
-    print(f"\n Processing {len(all_streams)} streams to capture M3U8 URLs...")
-    output_lines = ["#EXTM3U"]
-    processed_count = 0
+    def emit(result: tuple[str, list[str]]) -> list[str]:
+        key, entry = result
+        catalog.update(key, entry, url=entry[-1])
+        return entry
 
-    # Process each stream sequentially to avoid rate limiting
-    for stream in all_streams:
-        embed_url, entry = process_stream(stream)
-        if entry:
-            output_lines.append(entry)
-            processed_count += 1
-        # Add a delay between requests to avoid being blocked
-        time.sleep(1)
+    # Embeds in flight adapt to the host instead of one per second.
+    pipeline = Pipeline("strmfree", lambda: discover(catalog, listed), [
+        Stage("extract", extract, concurrency=EXTRACT_CONCURRENCY, blocking=True),
+        Stage("emit", emit),
+    ])
+    await pipeline.run()
 
+    if not listed:
+        raise RuntimeError("No streams found in any category")
+
+    # Fresh results merged with still-valid entries from earlier runs;
+    # streams the API no longer lists are retired, and ones that kept
+    # failing to re-resolve for max_age are dropped.
+    active = lifecycle.observe({key: None for key in listed})
+    catalog.retain(active)
+    catalog.save()
+    lifecycle.save()
+    entries = catalog.entries(active, max_age=catalog.max_age)
+
+    processed_count = len(entries)
     if processed_count == 0:
         raise RuntimeError("No M3U8 URLs captured")
 
     # Write the playlist file
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        f.write("\n".join(output_lines))
+    if write_playlist(OUTPUT_FILE, entries):
+        print(f"\n Saved {OUTPUT_FILE} with {processed_count} entries")
 
-    print(f"\n Saved {OUTPUT_FILE} with {processed_count} entries")
+    return processed_count
+
+def main():
+    return asyncio.run(run_standalone(run))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Sources are top-level scripts; make them importable as modules.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
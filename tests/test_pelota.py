@@ -0,0 +1,44 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+for module in ("requests", "bs4", "playwright"):
+    pytest.importorskip(module)
+
+import pelota
+from common.playlist import display_name, parse
+
+EVENTOS = Path(__file__).resolve().parent.parent / "eventos.m3u8"
+
+
+def listed_times():
+    """Listing times the titles of the committed playlist start with."""
+    _, entries = parse(EVENTOS.read_text(encoding="utf-8"))
+    return [display_name(entry).split(" ", 1)[0] for entry in entries]
+
+
+def test_committed_titles_have_kickoffs():
+    times = listed_times()
+    assert times
+    for hora in times:
+        kickoff = pelota.parse_time(hora)
+        assert kickoff is not None, hora
+        assert kickoff.tzinfo is pelota.SITE_TZ
+        assert kickoff.strftime("%H:%M") == hora[:5]
+        assert kickoff.date() == datetime.now(pelota.SITE_TZ).date()
+
+
+@pytest.mark.parametrize("hora, expected", [
+    ("15:00", "15:00"),
+    ("9:30", "09:30"),
+    ("15:00:00", "15:00"),
+    ("2026-10-19T21:45:00", "21:45"),
+])
+def test_parse_time_formats(hora, expected):
+    assert pelota.parse_time(hora).strftime("%H:%M") == expected
+
+
+@pytest.mark.parametrize("hora", ["", "TBD", "25:00", "150000"])
+def test_parse_time_rejects(hora):
+    assert pelota.parse_time(hora) is None